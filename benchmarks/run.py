@@ -0,0 +1,252 @@
+"""
+Benchmarks of the color switch and mean image hot paths.
+
+Run from the repository root:
+
+    python -m benchmarks.run                      # default cases, compared with the saved baseline
+    python -m benchmarks.run --sizes 1 12 50      # bigger images (megapixels)
+    python -m benchmarks.run --save-baseline      # store the results as the new baseline
+    python -m benchmarks.run --check              # exit with 1 when a case regressed
+
+Every case runs in a fresh process, so its peak RSS is not inflated by the previous ones.
+Each case is run once for timing and once more under tracemalloc to measure allocations,
+so the tracing overhead does not show up in the timings. Cases are instrumented like jobs:
+the seconds and traced peak of every stage are reported under the totals of the case. Baselines are specific to the machine
+and are stored in benchmarks/baseline.json, which is not committed.
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import json
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+from source.data.SwitchSettings import SwitchSettings
+from source.ops import FrameSwitchColorOperators as switch_ops
+from source.ops import FrameMeanImageOperator as mean_ops
+from source.ops.instrumentation import Instrumentation
+from source.ops.job_runner import Job
+from source.ops.pixel_cache import pixel_cache
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+DISTRIBUTIONS = ["flat", "gradient", "noise"]
+TARGET_COLORS = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (0, 255, 255), (255, 0, 255), (0, 0, 0), (255, 255, 255)]
+
+
+def synthetic_image(megapixels: float, distribution: str, seed: int = 0) -> np.ndarray:
+    """
+    Generates an RGB image of about the given size.
+
+    Args:
+        megapixels (float): The number of pixels, in millions.
+        distribution (str): "flat" (512 posterized colors), "gradient" (smooth ramps, tens of thousands
+                            of colors) or "noise" (uniform noise, up to millions of colors).
+        seed (int): Seed of the random generator.
+
+    Returns:
+        np.ndarray: Array with shape (rows, columns, 3) of uint8 values.
+    """
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(megapixels * 1e6 / width)
+    rng = np.random.default_rng(seed)
+
+    if distribution == "flat":
+        return (rng.integers(0, 8, (height, width, 3)) * 32).astype(np.uint8)
+    if distribution == "gradient":
+        x = np.linspace(0, 255, width)[np.newaxis, :]
+        y = np.linspace(0, 255, height)[:, np.newaxis]
+        planes = [x + 0 * y, y + 0 * x, (x + y) / 2]
+        return np.stack(planes, axis=2).astype(np.uint8)
+    return rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def switch_settings(matrix: np.ndarray, combinations: int, tolerance: int) -> list[SwitchSettings]:
+    """
+    Builds two color switches, whose targets multiply to about the given number of combinations.
+    The original colors are taken from the image, so they always match some pixels.
+    """
+    first = max(1, int(combinations ** 0.5))
+    second = max(1, combinations // first)
+    settings = []
+    for position, count in (((0.5, 0.5), first), ((0.25, 0.75), second)):
+        row, column = int(matrix.shape[0] * position[0]), int(matrix.shape[1] * position[1])
+        rgb = tuple(int(value) for value in matrix[row, column])
+        targets = [TARGET_COLORS[index % len(TARGET_COLORS)] for index in range(count)]
+        settings.append(SwitchSettings(
+            rgb, "#%02x%02x%02x" % rgb, targets, tolerance > 0, "Spherical", tolerance, True
+        ))
+    return settings
+
+
+def run_lookup(case: dict, trace: bool) -> dict:
+    matrix = synthetic_image(case['megapixels'], case['distribution'])
+    settings = switch_settings(matrix, 1, case['tolerance'])
+    metrics = Instrumentation("benchmark", trace_memory=trace)
+
+    metrics.start()
+    start = perf_counter()
+    with metrics.stage("lookup"):
+        switch_ops.make_look_up_table(matrix, settings, "RGB")
+    seconds = perf_counter() - start
+    metrics.finish()
+    return {"seconds": seconds, "pixels": matrix.shape[0] * matrix.shape[1], "stages": metrics.stages}
+
+
+def run_render(case: dict, trace: bool) -> dict:
+    matrix = synthetic_image(case['megapixels'], case['distribution'])
+    settings = switch_settings(matrix, case['combinations'], case['tolerance'])
+    with TemporaryDirectory() as folder:
+        file_name = os.path.join(folder, "source.png")
+        Image.fromarray(matrix).save(file_name, compress_level=1)
+        job = Job("benchmark", None, (), trace_memory=trace)
+        # Start with an empty cache of decoded pixels
+        pixel_cache.directory = os.path.join(folder, "cache")
+
+        job.metrics.start()
+        start = perf_counter()
+        switch_ops.render_images(job, file_name, settings, None, folder)
+        seconds = perf_counter() - start
+        job.metrics.finish()
+    return {"seconds": seconds, "pixels": job.pixels, "stages": job.metrics.stages}
+
+
+def run_mean(case: dict, trace: bool) -> dict:
+    with TemporaryDirectory() as folder:
+        mean_data = {}
+        for index in range(case['frames']):
+            matrix = synthetic_image(case['megapixels'], case['distribution'], seed=index)
+            file_name = os.path.join(folder, f"frame_{index}.png")
+            Image.fromarray(matrix).save(file_name, compress_level=1)
+            mean_data[file_name] = {"weight": 1, "height": matrix.shape[0], "width": matrix.shape[1], "mode": "RGB"}
+        job = Job("benchmark", None, (), trace_memory=trace)
+        pixel_cache.directory = os.path.join(folder, "cache")
+
+        job.metrics.start()
+        start = perf_counter()
+        mean_ops.render_mean_file(job, mean_data, matrix.shape, folder)
+        seconds = perf_counter() - start
+        job.metrics.finish()
+    return {"seconds": seconds, "pixels": job.pixels, "stages": job.metrics.stages}
+
+
+STAGES = {"lookup": run_lookup, "render": run_render, "mean": run_mean}
+
+
+def run_case(case: dict, trace: bool) -> dict:
+    """
+    Runs one case in the current process. Used as the task of a single use worker process.
+    The case is instrumented like a job, so the seconds and traced peak of each of its stages
+    (load, lookup, render, save...) are reported along with the totals.
+
+    Args:
+        case (dict): The case, with its "stage" and parameters.
+        trace (bool): Whether allocations are traced instead of measuring time and memory.
+
+    Returns:
+        dict: The measurements of the case.
+    """
+    result = STAGES[case['stage']](case, trace)
+    if trace:
+        peaks = {name: stage['peak_mb'] for name, stage in result['stages'].items()}
+        return {"traced_peak_mb": max(peaks.values(), default=0.0), "stage_peaks_mb": peaks}
+
+    result['pixels_per_second'] = result['pixels'] / result['seconds']
+    if resource is not None:
+        # Kilobytes on Linux, bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result['peak_rss_mb'] = rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+    return result
+
+
+def make_cases(args) -> list[dict]:
+    cases = []
+    for megapixels in args.sizes:
+        for distribution in args.distributions:
+            for tolerance in args.tolerances:
+                cases.append({"stage": "lookup", "megapixels": megapixels, "distribution": distribution, "tolerance": tolerance})
+        for combinations in args.combinations:
+            cases.append({"stage": "render", "megapixels": megapixels, "distribution": "gradient", "tolerance": 16, "combinations": combinations})
+        cases.append({"stage": "mean", "megapixels": megapixels, "distribution": "noise", "frames": args.frames})
+
+    for case in cases:
+        case['name'] = "-".join(f"{key}={value}" for key, value in case.items())
+    return cases
+
+
+def measure(case: dict, trace: bool) -> dict:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(run_case, case, trace).result()
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Benchmarks of the color switch and mean image hot paths.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4], help="image sizes in megapixels")
+    parser.add_argument("--distributions", nargs="+", default=DISTRIBUTIONS, choices=DISTRIBUTIONS)
+    parser.add_argument("--tolerances", type=int, nargs="+", default=[0, 16, 64])
+    parser.add_argument("--combinations", type=int, nargs="+", default=[4, 16])
+    parser.add_argument("--frames", type=int, default=4, help="number of images of the mean image cases")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=list(STAGES))
+    parser.add_argument("--no-trace", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before a case is reported")
+    parser.add_argument("--check", action="store_true", help="exit with 1 if any case regressed")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    results = {}
+    regressions = 0
+    print(f"{'case':<80} {'seconds':>9} {'Mpx/s':>8} {'RSS MB':>8} {'alloc MB':>9}  baseline")
+    for case in make_cases(args):
+        if case['stage'] not in args.stages:
+            continue
+        result = measure(case, trace=False)
+        if not args.no_trace:
+            traced = measure(case, trace=True)
+            for name, peak_mb in traced.pop('stage_peaks_mb').items():
+                result['stages'][name]['peak_mb'] = peak_mb
+            result.update(traced)
+        results[case['name']] = result
+
+        comparison = ""
+        if case['name'] in baseline:
+            ratio = result['seconds'] / baseline[case['name']]['seconds']
+            comparison = f"{ratio:.2f}x"
+            if ratio > 1 + args.threshold:
+                comparison += " REGRESSION"
+                regressions += 1
+        print(
+            f"{case['name']:<80} {result['seconds']:>9.3f} {result['pixels_per_second'] / 1e6:>8.2f} "
+            f"{result.get('peak_rss_mb', float('nan')):>8.0f} {result.get('traced_peak_mb', float('nan')):>9.0f}  {comparison}"
+        )
+        for name, stage in result['stages'].items():
+            print(f"  {name:<78} {stage['seconds']:>9.3f} {'':>8} {'':>8} {stage.get('peak_mb', float('nan')):>9.0f}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
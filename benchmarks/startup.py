@@ -0,0 +1,105 @@
+"""
+Benchmark of the startup of the GUI.
+
+Run from the repository root:
+
+    python -m benchmarks.startup                  # median of 5 cold starts
+    python -m benchmarks.startup --repeat 20
+
+Every start runs in a fresh interpreter. It measures how long importing source.main_gui takes,
+which heavy modules are loaded when the window opens, the time to the first drawn window and
+how long every lazy tab takes to open the first time. Without a display only the imports are measured.
+"""
+from argparse import ArgumentParser
+from statistics import median
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["numpy", "PIL.Image", "PIL.ImageTk", "scipy.spatial", "skimage.color", "tifffile"]
+
+# Runs in the measured interpreter: prints one JSON line with the timings
+PROBE = """
+from time import perf_counter
+start = perf_counter()
+import json, sys, types, tkinter
+
+HEAVY_MODULES = {heavy}
+result = {{}}
+
+def loaded():
+    # Modules loaded lazily and not used yet are instances of a subclass of ModuleType
+    return [name for name in HEAVY_MODULES if type(sys.modules.get(name)) is types.ModuleType]
+
+def first_window(root, n=0):
+    root.update()
+    result['first_window'] = perf_counter() - start
+    result['loaded_at_first_window'] = loaded()
+    modes = [child for child in root.winfo_children() if isinstance(child, tkinter.ttk.Notebook)][0]
+    result['tabs'] = {{}}
+    for tab in modes.tabs()[1:]:
+        tab_start = perf_counter()
+        modes.select(tab)
+        root.update()
+        result['tabs'][modes.tab(tab, 'text')] = perf_counter() - tab_start
+    root.destroy()
+
+tkinter.Misc.mainloop = first_window
+import tkinter.ttk
+from source.main_gui import GUI
+result['import'] = perf_counter() - start
+result['loaded_at_import'] = loaded()
+try:
+    GUI()
+except tkinter.TclError as error:
+    result['error'] = str(error)
+print(json.dumps(result))
+"""
+
+
+def cold_start() -> dict:
+    """
+    Starts the GUI in a fresh interpreter and returns its timings.
+    """
+    probe = PROBE.format(heavy=HEAVY_MODULES)
+    output = subprocess.run(
+        [sys.executable, "-c", probe], cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Benchmark of the startup of the GUI.")
+    parser.add_argument("--repeat", type=int, default=5, help="number of cold starts")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    # The first start warms up the bytecode cache and the file system cache
+    cold_start()
+    runs = [cold_start() for _ in range(args.repeat)]
+
+    results = {"import": median(run['import'] for run in runs), "loaded_at_import": runs[-1]['loaded_at_import']}
+    print(f"import source.main_gui      {results['import'] * 1000:8.1f} ms")
+    print(f"  heavy modules loaded      {', '.join(results['loaded_at_import']) or '-'}")
+    if 'error' in runs[-1]:
+        print(f"no window: {runs[-1]['error']}")
+    else:
+        results['first_window'] = median(run['first_window'] for run in runs)
+        results['loaded_at_first_window'] = runs[-1]['loaded_at_first_window']
+        print(f"time to first window        {results['first_window'] * 1000:8.1f} ms")
+        print(f"  heavy modules loaded      {', '.join(results['loaded_at_first_window']) or '-'}")
+        results['tabs'] = {}
+        for tab in runs[-1]['tabs']:
+            results['tabs'][tab] = median(run['tabs'][tab] for run in runs)
+            print(f"first opening of {tab:<10} {results['tabs'][tab] * 1000:8.1f} ms")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
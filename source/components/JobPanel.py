@@ -0,0 +1,151 @@
+from tkinter.ttk import Button, Labelframe, Progressbar, Treeview, Label, Checkbutton
+from tkinter import BooleanVar
+
+from source.data.SystemData import SystemData
+from source.ops.job_runner import FAILED
+
+
+class JobPanel(Labelframe):
+    """
+    The JobPanel class displays the background jobs of the application: their status, the progress
+    of the running job with its estimated time left and speed, the stage timings and counters of the
+    selected job, and a button to cancel jobs. New jobs can be profiled and have their memory traced.
+    The panel polls the JobRunner through `after`, so the jobs never touch Tk widgets.
+
+    Inherits from:
+        Labelframe: A Tkinter widget that groups other widgets under a label.
+
+    Attributes:
+        data (SystemData): The application data holding the JobRunner.
+        tree (Treeview | None): The list of jobs.
+        progress (Progressbar | None): The progress of the running job.
+        status (Label | None): Progress, time left and speed of the running job.
+        b_cancel (Button | None): A button cancelling the selected jobs, or the running one.
+        metrics (Label | None): Stage timings and counters of the selected job, or of the latest one.
+        profile (BooleanVar): Whether new jobs are profiled.
+        trace_memory (BooleanVar): Whether the memory of new jobs is traced.
+    """
+    tree: Treeview | None = None
+    progress: Progressbar | None = None
+    status: Label | None = None
+    b_cancel: Button | None = None
+    metrics: Label | None = None
+    profile: BooleanVar
+    trace_memory: BooleanVar
+
+    POLL_INTERVAL: int = 200
+
+    def __init__(self, root, data: SystemData):
+        """
+        Initializes the JobPanel and starts polling the jobs.
+
+        Args:
+            root (Tk): The main window where the panel is placed.
+            data (SystemData): The application data holding the JobRunner.
+        """
+        Labelframe.__init__(self, root, text="Jobs")
+        self.data = data
+        self.create()
+        self.pack(side='bottom', fill='x', padx=10, pady=(0, 10))
+        self.after(self.POLL_INTERVAL, self.refresh)
+
+    def create(self) -> None:
+        """
+        Creates and arranges the widgets of the panel.
+        """
+        self['padding'] = (10, 5)
+        self.tree = Treeview(self, columns=("job", "status", "progress"), show='headings', height=3)
+        self.tree.heading('job', text='Job', anchor='w')
+        self.tree.heading('status', text='Status')
+        self.tree.heading('progress', text='Progress')
+        self.tree.column('status', width=200, stretch=False)
+        self.tree.column('progress', width=100, stretch=False, anchor='e')
+
+        self.progress = Progressbar(self, orient='horizontal', mode='determinate')
+        self.status = Label(self, text="")
+        self.b_cancel = Button(self, text="Cancel", command=self.cancel)
+        self.metrics = Label(self, text="", justify='left')
+
+        self.profile = BooleanVar(self, value=False)
+        self.trace_memory = BooleanVar(self, value=False)
+        check_profile = Checkbutton(self, text="Profile new jobs", variable=self.profile, command=self.update_options)
+        check_trace = Checkbutton(self, text="Trace memory of new jobs", variable=self.trace_memory, command=self.update_options)
+
+        self.columnconfigure(1, weight=1)
+        self.tree.grid(column=1, row=1, columnspan=2, sticky='we')
+        self.progress.grid(column=1, row=2, sticky='we', pady=(5, 0))
+        self.b_cancel.grid(column=2, row=2, rowspan=2, padx=(5, 0), pady=(5, 0), sticky='e')
+        self.status.grid(column=1, row=3, sticky='w')
+        self.metrics.grid(column=1, row=4, columnspan=2, sticky='w')
+        check_profile.grid(column=1, row=5, sticky='w')
+        check_trace.grid(column=1, row=6, sticky='w')
+
+    def refresh(self) -> None:
+        """
+        Updates the job list and the progress of the running job, then schedules the next update.
+        The next update is scheduled even when this one fails, so the panel never stops refreshing.
+        """
+        try:
+            for index, job in enumerate(self.data.jobs.jobs):
+                status = job.status
+                if status == FAILED:
+                    status = f"{FAILED}: {job.error}"
+                progress = f"{job.done}/{job.total}" if job.total else ""
+                if self.tree.exists(str(index)):
+                    self.tree.item(str(index), values=(job.name, status, progress))
+                else:
+                    self.tree.insert("", 'end', iid=str(index), values=(job.name, status, progress))
+
+            job = self.data.jobs.current()
+            if job is None:
+                self.progress['value'] = 0
+                self.status['text'] = ""
+            else:
+                self.progress['maximum'] = max(job.total, 1)
+                self.progress['value'] = job.done
+                eta = job.eta()
+                eta = f"{eta:.0f} s left" if eta is not None else "estimating time left"
+                self.status['text'] = f"{job.name}: {eta}, {job.speed() / 1e6:.2f} Mpx/s"
+
+            self.update_metrics()
+        finally:
+            self.after(self.POLL_INTERVAL, self.refresh)
+
+    def update_metrics(self) -> None:
+        """
+        Displays the stage timings and counters of the selected job, or of the latest started one,
+        and the functions which took the most time when the job was profiled.
+        """
+        jobs = [self.data.jobs.jobs[int(item)] for item in self.tree.selection()]
+        if not jobs:
+            jobs = [job for job in self.data.jobs.jobs if job.started is not None]
+        if not jobs:
+            self.metrics['text'] = ""
+            return
+
+        job = jobs[-1]
+        text = job.metrics.describe()
+        summary = job.metrics.summary
+        if summary is not None and 'profile' in summary:
+            for entry in summary['profile'][:3]:
+                text += f"\n{entry['cumulative_seconds']:.2f} s  {entry['function']}"
+        self.metrics['text'] = text
+
+    def update_options(self) -> None:
+        """
+        Applies the profiling and memory tracing options to the jobs submitted from now on.
+        """
+        self.data.jobs.profile = self.profile.get()
+        self.data.jobs.trace_memory = self.trace_memory.get()
+
+    def cancel(self) -> None:
+        """
+        Cancels the jobs selected in the list, or the running job if none is selected.
+        """
+        selected = [self.data.jobs.jobs[int(item)] for item in self.tree.selection()]
+        if not selected:
+            job = self.data.jobs.current()
+            selected = [job] if job is not None else []
+
+        for job in selected:
+            job.cancel()
@@ -1,39 +1,95 @@
-from tkinter.ttk import Notebook
+from tkinter.ttk import Notebook, Frame
+
+import lazy_loader as lazy
 
 from source.components.frames.FrameSelectFile import FrameSelectFile
-from source.components.frames.FrameSwitchColor import FrameSwitchColor
-from source.components.frames.FrameMeanImage import FrameMeanImage
 from source.data.SystemData import SystemData
 
+# The tabs using numpy, Pillow and the operators are imported when they are first opened
+FrameSwitchColor = lazy.load("source.components.frames.FrameSwitchColor", suppress_warning=True)
+FrameMeanImage = lazy.load("source.components.frames.FrameMeanImage", suppress_warning=True)
+LAZY_TABS = [FrameSwitchColor, FrameMeanImage]
+# Milliseconds after the window is shown before the lazy tabs are imported
+PRELOAD_DELAY = 500
+
 
 class Modes(Notebook):
     """
-    The Modes class is a Notebook widget that organizes different functional modes 
-    of the application into tabs. It allows users to switch between file selection 
+    The Modes class is a Notebook widget that organizes different functional modes
+    of the application into tabs. It allows users to switch between file selection
     and color switch modes.
 
+    Only the file selection tab is built with the window. The other tabs are empty frames until they
+    are opened for the first time, and the modules behind them are imported once the window is shown,
+    so opening them is fast too. Imports run in the Tk main loop, lazy_loader modules are not thread-safe.
+
     Inherits from:
         Notebook: A Tkinter widget that provides a tabbed interface.
+
+    Attributes:
+        lazy_tabs (dict): Name of the empty frame of a tab mapped to the function building its content.
     """
+    lazy_tabs: dict
 
     def __init__(self, root, data: SystemData):
         """
-        Initializes the Modes notebook and adds two tabs: one for file selection 
+        Initializes the Modes notebook and adds two tabs: one for file selection
         and one for switching colors.
 
         Args:
             root (Tk): The main window where the Notebook will be placed.
-            data (SystemData): An instance of SystemData that stores application state 
+            data (SystemData): An instance of SystemData that stores application state
                                such as selected files and color switch configurations.
         """
         Notebook.__init__(self, root)
         self.pack(expand=True, fill='both', padx=10, pady=10)
-        
+        self.lazy_tabs = {}
+
         f1 = FrameSelectFile(self, data)
         self.add(f1, text="Files selection")
 
-        f2 = FrameSwitchColor(self, data)
+        f2 = Frame(self)
         self.add(f2, text="Switch colors")
+        self.lazy_tabs[str(f2)] = lambda parent: FrameSwitchColor.FrameSwitchColor(parent, data)
 
-        f3 = FrameMeanImage(self, data)
+        f3 = Frame(self)
         self.add(f3, text="Mean image")
+        self.lazy_tabs[str(f3)] = lambda parent: FrameMeanImage.FrameMeanImage(parent, data)
+
+        self.bind("<<NotebookTabChanged>>", self.build_tab)
+        self.after(PRELOAD_DELAY, self.preload)
+
+    def build_tab(self, event=None) -> None:
+        """
+        Builds the content of the selected tab the first time it is opened.
+
+        Args:
+            event (Event, optional): The event object. Defaults to None.
+        """
+        name = str(self.select())
+        if name not in self.lazy_tabs:
+            return
+        parent = self.nametowidget(name)
+        try:
+            frame = self.lazy_tabs[name](parent)
+        except Exception:
+            # The tab is built again the next time it is opened
+            for child in parent.winfo_children():
+                child.destroy()
+            raise
+        frame.pack(expand=True, fill='both')
+        del self.lazy_tabs[name]
+
+    def preload(self, index: int = 0) -> None:
+        """
+        Imports the modules of the lazy tabs, one per idle moment of the main loop, so the window
+        keeps responding between them.
+
+        Args:
+            index (int): The index of the next module in LAZY_TABS.
+        """
+        if index >= len(LAZY_TABS):
+            return
+        # Accessing an attribute of a lazy module imports it
+        LAZY_TABS[index].__name__
+        self.after_idle(self.preload, index + 1)
@@ -1,5 +1,5 @@
-from tkinter.ttk import Button, Frame, Combobox, Notebook, Spinbox, Separator, Treeview
-from tkinter import IntVar
+from tkinter.ttk import Button, Frame, Notebook, Spinbox, Separator, Treeview
+from tkinter import IntVar, BooleanVar, Checkbutton
 
 from source.ops import FrameMeanImageOperator as ops
 from source.data.SystemData import SystemData
@@ -45,9 +45,17 @@ class FrameMeanImage(Frame):
             text="Remove selected"
         )
         self.separator = Separator(self, orient='horizontal')
+        self.resample = BooleanVar(self, value=False)
+        self.check_resample = Checkbutton(
+            self, text="Resample to the size of the first image", variable=self.resample, onvalue=True, offvalue=False
+        )
+        self.align = BooleanVar(self, value=False)
+        self.check_align = Checkbutton(
+            self, text="Align to the first image", variable=self.align, onvalue=True, offvalue=False
+        )
         self.button_generate = Button(
             self, 
-            command=lambda: ops.generate_mean_file(data), 
+            command=lambda: ops.generate_mean_file(data, self.resample.get(), self.align.get()), 
             text="Generate file"
         )
 
@@ -72,5 +80,11 @@ class FrameMeanImage(Frame):
 
         self.separator.grid(column=1, row=4, columnspan=9, sticky='we', pady=(10,10))
 
-        self.button_generate.grid(column=2, row=5, columnspan=7, sticky='nwe')
+        self.check_resample.grid(column=2, row=5, columnspan=7, sticky='w')
+        self.check_align.grid(column=2, row=6, columnspan=7, sticky='w', pady=(0, 5))
+
+        self.button_generate.grid(column=2, row=7, columnspan=7, sticky='nwe')
         self.button_generate['padding']= (15, 5)
+
+        # Files selected before the tab was opened
+        data.update_mean_tree()
@@ -1,9 +1,20 @@
-from tkinter.ttk import Frame, Button, Scrollbar, Notebook
-from tkinter import Toplevel, Canvas, messagebox, Event
+from tkinter.ttk import Frame, Button, Scrollbar, Notebook, Labelframe, Label, Combobox, Spinbox
+from tkinter import Toplevel, Canvas, Checkbutton, BooleanVar, StringVar, messagebox, filedialog, Event
 from PIL import Image, ImageTk
+import os
 
 from source.ops import FrameSwitchColorOperators as ops
-from source.data.SystemData import SystemData, SwitchData
+from source.ops import sys_operators as sops
+from source.ops.color_index import MODES
+from source.ops.pixel_cache import pixel_cache
+from source.ops import presets
+from source.ops.planner import SAMPLING_MODES, ALL_COMBINATIONS, INDEX_RANGE
+from source.ops.packed_output import OUTPUT_FORMATS, SEPARATE_FILES
+from source.data.SystemData import SystemData
+from source.data.SwitchData import SwitchData
+from source.data.RegionData import RegionData
+from source.data.SamplingSettings import SamplingSettings
+from source.data.SwitchPreset import SwitchPreset
 
 
 class FrameSwitchColor(Frame):
@@ -15,9 +26,25 @@ class FrameSwitchColor(Frame):
     scrollbar: Scrollbar | None = None
     scr_frame: Frame | None = None
     b_pop_up: Button | None = None
+    b_load_preset: Button | None = None
+    b_save_preset: Button | None = None
     b_generate: Button | None = None
     pop_up: Toplevel | None = None
     zoom_window: Toplevel | None = None
+    region_frame: Labelframe | None = None
+    region_label: Label | None = None
+    region_points: list[tuple] = []
+    check_resume: Checkbutton | None = None
+    resume: BooleanVar
+    sampling_frame: Labelframe | None = None
+    box_sampling: Combobox | None = None
+    spin_count: Spinbox | None = None
+    spin_seed: Spinbox | None = None
+    spin_start: Spinbox | None = None
+    spin_stop: Spinbox | None = None
+    sampling_mode: StringVar
+    box_output: Combobox | None = None
+    output_format: StringVar
     
     ZOOM_FACTOR: int = 15
     ZOOM_AREA_SIZE: int = 10 
@@ -52,13 +79,51 @@ class FrameSwitchColor(Frame):
 
         self.b_pop_up = Button(self.scr_frame, text="Select color to switch", command=lambda: self.draw_pop_up(data))
         self.b_pop_up['padding'] = (15, 5)
+        self.b_load_preset = Button(self.scr_frame, text="Load preset", command=lambda: self.load_preset(data))
+        self.b_save_preset = Button(self.scr_frame, text="Save preset", command=lambda: self.save_preset(data))
+
+        self.region_frame = Labelframe(self.scr_frame, text="Region")
+        self.region_frame['padding'] = (10, 5)
+        self.region_label = Label(self.region_frame, text="Whole image")
+        b_rectangle = Button(self.region_frame, text="Draw rectangle", command=lambda: self.draw_region_pop_up(data, "Rectangle"))
+        b_polygon = Button(self.region_frame, text="Draw polygon", command=lambda: self.draw_region_pop_up(data, "Polygon"))
+        b_mask = Button(self.region_frame, text="Load mask", command=lambda: self.load_region_mask(data))
+        b_clear = Button(self.region_frame, text="Clear region", command=lambda: self.set_region(data, None))
 
         for item in data.switch_data:
             self.create_switch_frame(item.color_hex)
 
+        self.sampling_frame = Labelframe(self.scr_frame, text="Combinations")
+        self.sampling_frame['padding'] = (10, 5)
+        self.sampling_mode = StringVar(self, value=ALL_COMBINATIONS)
+        self.box_sampling = Combobox(
+            self.sampling_frame, values=SAMPLING_MODES, textvariable=self.sampling_mode, state='readonly', width=18
+        )
+        l_count = Label(self.sampling_frame, text="Sample size")
+        self.spin_count = Spinbox(self.sampling_frame, from_=1, to=10**6, justify='right', width=8)
+        self.spin_count.set(100)
+        l_seed = Label(self.sampling_frame, text="Seed")
+        self.spin_seed = Spinbox(self.sampling_frame, from_=0, to=10**6, justify='right', width=8)
+        self.spin_seed.set(0)
+        l_range = Label(self.sampling_frame, text="Indices from / to")
+        self.spin_start = Spinbox(self.sampling_frame, from_=0, to=10**12, justify='right', width=8)
+        self.spin_start.set(0)
+        self.spin_stop = Spinbox(self.sampling_frame, from_=1, to=10**12, justify='right', width=8)
+        self.spin_stop.set(100)
+        l_output = Label(self.sampling_frame, text="Save as")
+        self.output_format = StringVar(self, value=SEPARATE_FILES)
+        self.box_output = Combobox(
+            self.sampling_frame, values=OUTPUT_FORMATS, textvariable=self.output_format, state='readonly', width=18
+        )
+
+        self.resume = BooleanVar(self, value=False)
+        self.check_resume = Checkbutton(
+            self.scr_frame, text="Skip combinations already in the target folder",
+            variable=self.resume, onvalue=True, offvalue=False
+        )
         self.b_generate = Button(
             self.scr_frame, text="Generate images",
-            command=lambda: (ops.generate_images(data), self.update_grid(data))
+            command=lambda: self.generate(data)
         )
         self.b_generate['padding'] = (15, 5)
 
@@ -66,7 +131,27 @@ class FrameSwitchColor(Frame):
         self.canvas.pack(side="left", fill="both", expand=True)
         self.scrollbar.pack(fill="both", expand=True)
 
+        self.region_frame.grid(column=1, row=0, columnspan=3, sticky='we', pady=(0, 5))
+        self.region_label.grid(column=1, row=1, columnspan=4, sticky='w')
+        b_rectangle.grid(column=1, row=2, padx=(0, 5), sticky='we')
+        b_polygon.grid(column=2, row=2, padx=5, sticky='we')
+        b_mask.grid(column=3, row=2, padx=5, sticky='we')
+        b_clear.grid(column=4, row=2, padx=(5, 0), sticky='we')
+
+        self.box_sampling.grid(column=1, row=1, columnspan=2, sticky='we', pady=(0, 5))
+        l_count.grid(column=1, row=2, sticky='w')
+        self.spin_count.grid(column=2, row=2, padx=(5, 0), sticky='we')
+        l_seed.grid(column=3, row=2, padx=(10, 0), sticky='w')
+        self.spin_seed.grid(column=4, row=2, padx=(5, 0), sticky='we')
+        l_range.grid(column=1, row=3, sticky='w')
+        self.spin_start.grid(column=2, row=3, padx=(5, 0), sticky='we')
+        self.spin_stop.grid(column=4, row=3, padx=(5, 0), sticky='we')
+        l_output.grid(column=1, row=4, sticky='w', pady=(5, 0))
+        self.box_output.grid(column=2, row=4, columnspan=3, padx=(5, 0), sticky='we', pady=(5, 0))
+
         self.b_pop_up.grid(column=2, row=1, sticky='we')
+        self.b_load_preset.grid(column=1, row=1, padx=(0, 5), sticky='we')
+        self.b_save_preset.grid(column=3, row=1, padx=(5, 0), sticky='we')
         # Bind mouse wheel scrolling to the canvas
         self.canvas.bind_all("<MouseWheel>", self._on_mouse_wheel)
         self.canvas.bind_all("<Button-4>", self._on_mouse_wheel)  # For macOS scroll up
@@ -115,7 +200,11 @@ class FrameSwitchColor(Frame):
         for widget in self.grid_slaves():
             widget.grid_forget()
 
+        self.update_region_label(data)
+
         self.b_pop_up.grid(column=2, row=1, sticky='we')
+        self.b_load_preset.grid(column=1, row=1, padx=(0, 5), sticky='we')
+        self.b_save_preset.grid(column=3, row=1, padx=(5, 0), sticky='we')
         row = 2
         # Chcek data in switch_data
         if len(data.switch_data) > 0:
@@ -123,11 +212,117 @@ class FrameSwitchColor(Frame):
                 item.grid_up(1, row)
                 row += 3
             
-            self.b_generate.grid(column=2, row=row, sticky='we')
+            self.sampling_frame.grid(column=1, row=row, columnspan=3, sticky='we', pady=(5, 5))
+            self.check_resume.grid(column=2, row=row + 1, sticky='w')
+            self.b_generate.grid(column=2, row=row + 2, sticky='we')
             self.b_generate.grid()
         else:
+            self.sampling_frame.grid_remove()
+            self.check_resume.grid_remove()
             self.b_generate.grid_remove()
 
+    def generate(self, data: SystemData):
+        """
+        Generates the images with the sampling and output format chosen in the "Combinations" frame,
+        then updates the grid.
+
+        Args:
+            data (SystemData): The data structure holding image and switch data.
+        """
+        sampling = self.sampling_settings()
+        if sampling is None:
+            return None
+        ops.generate_images(data, self.resume.get(), sampling, self.output_format.get())
+        self.update_grid(data)
+
+    def sampling_settings(self) -> SamplingSettings | None:
+        """
+        Reads the sampling of combinations from the "Combinations" frame.
+
+        Returns:
+            SamplingSettings | None: The sampling, or None if its values are not valid.
+        """
+        try:
+            sampling = SamplingSettings(
+                self.sampling_mode.get(), int(self.spin_count.get()), int(self.spin_seed.get()),
+                int(self.spin_start.get()), int(self.spin_stop.get())
+            )
+        except ValueError:
+            messagebox.showinfo(message='Sample size, seed and indices must be whole numbers.')
+            return None
+        if sampling.mode == INDEX_RANGE and not 0 <= sampling.start < sampling.stop:
+            messagebox.showinfo(message='The first index must be lower than the last one.')
+            return None
+        if sampling.mode != ALL_COMBINATIONS and sampling.mode != INDEX_RANGE and sampling.count < 1:
+            messagebox.showinfo(message='The sample size must be at least 1.')
+            return None
+        return sampling
+
+    def save_preset(self, data: SystemData):
+        """
+        Asks for a file and saves the color switches, the region and the "Combinations" frame to it as a preset.
+
+        Args:
+            data (SystemData): The data structure holding image and switch data.
+        """
+        settings = [item.settings() for item in data.switch_data if len(item.color_list)]
+        if len(settings) < 1:
+            messagebox.showinfo(message='Select at least 1 color to switch.')
+            return None
+        sampling = self.sampling_settings()
+        if sampling is None:
+            return None
+
+        file = filedialog.asksaveasfilename(
+            defaultextension=presets.PRESET_EXTENSION, filetypes=[("Presets", f"*{presets.PRESET_EXTENSION}")]
+        )
+        if not file:
+            return None
+        name = os.path.splitext(os.path.basename(file))[0]
+        preset = SwitchPreset(name, settings, data.region, sampling, self.output_format.get(), data.switch_mode)
+        presets.save_preset(preset, file)
+
+    def load_preset(self, data: SystemData):
+        """
+        Asks for a preset file and replaces the color switches, the region and the "Combinations" frame with it.
+
+        Args:
+            data (SystemData): The data structure holding image and switch data.
+        """
+        file = filedialog.askopenfilename(filetypes=[("Presets", f"*{presets.PRESET_EXTENSION}")])
+        if not file:
+            return None
+        try:
+            preset = presets.load_preset(file)
+        except ValueError:
+            messagebox.showinfo(message='The file is not a preset.')
+            return None
+        if len(data.file_names) == 1 and Image.open(data.file_names[0]).mode in MODES:
+            try:
+                presets.check_mode(preset.mode, Image.open(data.file_names[0]).mode)
+            except ValueError as error:
+                messagebox.showinfo(message=str(error))
+                return None
+
+        for frame in reversed(data.switch_data):
+            ops.remove_frame(frame, data)
+        for item in preset.settings:
+            frame = SwitchData(self.scr_frame, data, item.rgb_color, item.hex_color)
+            frame.apply(item)
+            data.switch_data.append(frame)
+        data.switch_mode = preset.mode
+
+        if preset.sampling is not None:
+            self.sampling_mode.set(preset.sampling.mode)
+            self.spin_count.set(preset.sampling.count)
+            self.spin_seed.set(preset.sampling.seed)
+            self.spin_start.set(preset.sampling.start)
+            self.spin_stop.set(preset.sampling.stop)
+        if preset.output_format:
+            self.output_format.set(preset.output_format)
+        self.set_region(data, preset.region)
+        self.update_grid(data)
+
     def draw_pop_up(self, data: SystemData):
         """
         Draws a pop-up window to allow the user to select a pixel from the image for color switching.
@@ -138,14 +333,14 @@ class FrameSwitchColor(Frame):
         if len(data.file_names) != 1:
             messagebox.showinfo(message='Select 1 image in "File selection".')
             return None
-        image_data = Image.open(data.file_names[0])
-        color_mode = image_data.mode
-        if color_mode is 'RGB':
-            messagebox.showinfo(message='This operation is possible only for RGB images.')
+        color_mode = Image.open(data.file_names[0]).mode
+        if color_mode not in MODES:
+            messagebox.showinfo(message='This operation is possible only for L, LA, RGB, RGBA and 16-bit grayscale images.')
             return None
+        image_data = pixel_cache.open_image(data.file_names[0])
 
         w, h = image_data.size
-        image_to_display = ImageTk.PhotoImage(image_data)    
+        image_to_display = ImageTk.PhotoImage(ops.preview_image(image_data))
 
         self.pop_up = Toplevel(height=h, width=w)
         self.pop_up.title("Select one pixel")
@@ -191,7 +386,7 @@ class FrameSwitchColor(Frame):
             Image.NEAREST
         )
         
-        tk_zoomed_image = ImageTk.PhotoImage(zoomed_image)
+        tk_zoomed_image = ImageTk.PhotoImage(ops.preview_image(zoomed_image))
         zoom_canvas.create_image(0, 0, anchor='nw', image=tk_zoomed_image)
         zoom_canvas.image = tk_zoomed_image 
         
@@ -216,16 +411,123 @@ class FrameSwitchColor(Frame):
         """
         x, y = int(event.x / multiplier), int(event.y / multiplier)
         rgb_pixel = image_data.getpixel((x, y))
+        if not isinstance(rgb_pixel, tuple):
+            rgb_pixel = (rgb_pixel, )
+        mode = image_data.mode
+        channels, max_value = MODES[mode]
+        hex_pixel = sops.pixel_to_hex(rgb_pixel[:channels], max_value)
 
-        is_new = True
-        if len(data.switch_data):
-            for image_data in data.switch_data:
-                if list(image_data.rgb_color) == list(rgb_pixel):
-                    is_new = False
+        # Colors are compared on their raw values, the hex of 16-bit colors is scaled for display only.
+        # Alpha is not matched, so colors differing only by alpha are the same color
+        is_new = all(tuple(item.rgb_color[:channels]) != rgb_pixel[:channels] for item in data.switch_data)
 
         self.zoom_window.destroy()
         self.pop_up.destroy()
 
         if is_new:
-            data.switch_data.append(SwitchData(self.scr_frame, data, rgb_pixel))
+            if not data.switch_data:
+                data.switch_mode = mode
+            data.switch_data.append(SwitchData(self.scr_frame, data, rgb_pixel, hex_pixel))
             self.update_grid(data)
+
+    def draw_region_pop_up(self, data: SystemData, kind: str):
+        """
+        Draws a pop-up window with the image, in which the user draws the region of interest.
+        A rectangle is drawn by dragging with the left button. A polygon is drawn by clicking
+        its vertices with the left button and closed with the right button.
+
+        Args:
+            data (SystemData): The data structure holding image and switch data.
+            kind (str): "Rectangle" or "Polygon".
+        """
+        if len(data.file_names) != 1:
+            messagebox.showinfo(message='Select 1 image in "File selection".')
+            return None
+        if Image.open(data.file_names[0]).mode not in MODES:
+            messagebox.showinfo(message='This operation is possible only for L, LA, RGB, RGBA and 16-bit grayscale images.')
+            return None
+        image_data = pixel_cache.open_image(data.file_names[0])
+
+        w, h = image_data.size
+        image_to_display = ImageTk.PhotoImage(ops.preview_image(image_data))
+
+        self.pop_up = Toplevel(height=h, width=w)
+        if kind == "Rectangle":
+            self.pop_up.title("Drag to draw a rectangle")
+        else:
+            self.pop_up.title("Click the vertices of a polygon, right click to close it")
+        canvas = Canvas(self.pop_up, height=h, width=w)
+        canvas.create_image(0, 0, anchor=('nw'), image=image_to_display)
+        canvas.image_to_display = image_to_display
+        canvas.pack()
+
+        self.region_points = []
+        clip = lambda event: (min(max(event.x, 0), w - 1), min(max(event.y, 0), h - 1))
+        if kind == "Rectangle":
+            shape = canvas.create_rectangle(0, 0, 0, 0, outline="red", width=2)
+            canvas.bind("<Button-1>", lambda event: self.region_points.append(clip(event)))
+            canvas.bind("<B1-Motion>", lambda event: canvas.coords(shape, *self.region_points[0], *clip(event)))
+            canvas.bind("<ButtonRelease-1>", lambda event: self.set_region(
+                data, RegionData.from_rectangle(*self.region_points[0], *clip(event), (w, h))
+            ))
+        else:
+            shape = canvas.create_line(0, 0, 0, 0, fill="red", width=2)
+            canvas.bind("<Button-1>", lambda event: self.add_polygon_point(canvas, shape, clip(event)))
+            canvas.bind("<Button-3>", lambda event: len(self.region_points) > 2 and self.set_region(
+                data, RegionData.from_polygon(self.region_points, (w, h))
+            ))
+
+    def add_polygon_point(self, canvas: Canvas, shape: int, point: tuple):
+        """
+        Adds a vertex to the polygon being drawn and redraws its outline.
+
+        Args:
+            canvas (Canvas): The canvas of the drawing pop-up.
+            shape (int): The canvas item of the outline.
+            point (tuple): The vertex in image coordinates.
+        """
+        self.region_points.append(point)
+        if len(self.region_points) > 1:
+            canvas.coords(shape, *[value for vertex in self.region_points for value in vertex])
+
+    def load_region_mask(self, data: SystemData):
+        """
+        Asks for a mask image and uses it as the region of interest.
+
+        Args:
+            data (SystemData): The data structure holding image and switch data.
+        """
+        file = filedialog.askopenfilename()
+        if file == "":
+            return None
+
+        region = RegionData.from_mask_image(file)
+        if region is None:
+            messagebox.showinfo(message='The mask does not select any pixel.')
+            return None
+        self.set_region(data, region)
+
+    def set_region(self, data: SystemData, region: RegionData | None):
+        """
+        Stores the region of interest, closes the drawing pop-up and updates the region label.
+
+        Args:
+            data (SystemData): The data structure holding image and switch data.
+            region (RegionData | None): The new region, None for the whole image.
+        """
+        data.region = region
+        if self.pop_up is not None and self.pop_up.winfo_exists():
+            self.pop_up.destroy()
+        self.update_region_label(data)
+
+    def update_region_label(self, data: SystemData):
+        """
+        Describes the current region of interest in the region frame.
+
+        Args:
+            data (SystemData): The data structure holding image and switch data.
+        """
+        if data.region is None:
+            self.region_label['text'] = "Whole image"
+        else:
+            self.region_label['text'] = data.region.describe()
@@ -0,0 +1,105 @@
+from PIL import Image, ImageDraw
+import numpy as np
+
+
+class RegionData():
+    """
+    The RegionData class describes the region of interest of a color switch. Only pixels inside
+    the region are matched and switched.
+
+    Attributes:
+        kind (str): "Rectangle", "Polygon" or "Mask", used to describe the region in the GUI.
+        box (tuple): The bounding box of the region (left, top, right, bottom), right and bottom excluded.
+        mask (np.ndarray | None): Boolean array of the bounding box size selecting the pixels of the region,
+                                  None when the whole bounding box is selected.
+        size (tuple | None): Size (width, height) of the image the region was made for, None if it fits any image.
+    """
+    kind: str
+    box: tuple
+    mask: np.ndarray | None
+    size: tuple | None
+
+    def __init__(self, kind: str, box: tuple, mask: np.ndarray | None = None, size: tuple | None = None):
+        """
+        Initializes the region.
+
+        Args:
+            kind (str): "Rectangle", "Polygon" or "Mask".
+            box (tuple): The bounding box of the region (left, top, right, bottom).
+            mask (np.ndarray | None): Boolean array of the bounding box size, or None.
+            size (tuple | None): Size (width, height) of the image the region was made for.
+        """
+        self.kind = kind
+        self.box = tuple(int(value) for value in box)
+        self.mask = mask
+        self.size = size
+
+    @classmethod
+    def from_rectangle(cls, x0: int, y0: int, x1: int, y1: int, size: tuple | None = None) -> "RegionData":
+        """
+        Creates a region from two opposite corners of a rectangle, drawn on an image of the given size (width, height).
+        """
+        return cls("Rectangle", (min(x0, x1), min(y0, y1), max(x0, x1) + 1, max(y0, y1) + 1), size=size)
+
+    @classmethod
+    def from_polygon(cls, points: list[tuple], size: tuple | None = None) -> "RegionData":
+        """
+        Creates a region from the vertices of a polygon, given in the coordinates of an image of the given size (width, height).
+        """
+        xs = [x for x, _ in points]
+        ys = [y for _, y in points]
+        box = (min(xs), min(ys), max(xs) + 1, max(ys) + 1)
+
+        mask = Image.new("1", (box[2] - box[0], box[3] - box[1]), 0)
+        ImageDraw.Draw(mask).polygon([(x - box[0], y - box[1]) for x, y in points], fill=1, outline=1)
+        return cls("Polygon", box, np.array(mask, dtype=bool), size)
+
+    @classmethod
+    def from_mask_image(cls, file_name: str) -> "RegionData | None":
+        """
+        Creates a region from a mask image. Pixels brighter than mid-gray belong to the region.
+
+        Returns:
+            RegionData | None: The region, or None if the mask selects no pixel.
+        """
+        image = Image.open(file_name)
+        mask = np.array(image.convert("L")) > 127
+        rows = np.flatnonzero(mask.any(axis=1))
+        columns = np.flatnonzero(mask.any(axis=0))
+        if len(rows) == 0:
+            return None
+
+        box = (columns[0], rows[0], columns[-1] + 1, rows[-1] + 1)
+        return cls("Mask", box, mask[box[1]:box[3], box[0]:box[2]], image.size)
+
+    def positions(self, shape: tuple) -> np.ndarray:
+        """
+        Returns the flat indices of the pixels of the region in an image of the given shape.
+        The bounding box is clipped to the image.
+
+        Args:
+            shape (tuple): Height and width of the image.
+
+        Returns:
+            np.ndarray: Sorted flat pixel indices (row * width + column).
+        """
+        height, width = shape[:2]
+        left, top = max(self.box[0], 0), max(self.box[1], 0)
+        right, bottom = min(self.box[2], width), min(self.box[3], height)
+        if right <= left or bottom <= top:
+            return np.array([], dtype=np.intp)
+
+        if self.mask is None:
+            rows, columns = np.mgrid[top:bottom, left:right]
+        else:
+            mask = self.mask[top - self.box[1]:bottom - self.box[1], left - self.box[0]:right - self.box[0]]
+            rows, columns = np.nonzero(mask)
+            rows, columns = rows + top, columns + left
+        return (rows * width + columns).ravel().astype(np.intp)
+
+    def describe(self) -> str:
+        """
+        Returns a short description of the region displayed in the GUI.
+        """
+        left, top, right, bottom = self.box
+        return f"{self.kind}: ({left}, {top}) - ({right - 1}, {bottom - 1})"
@@ -0,0 +1,25 @@
+class SamplingSettings():
+    """
+    The SamplingSettings class holds which combinations of color switches are rendered, when rendering
+    all of them would take too long. Combinations are numbered like in the full product, so a sampled
+    combination is saved under the same name as when every combination is rendered.
+
+    Attributes:
+        mode (str): One of planner.SAMPLING_MODES.
+        count (int): Number of combinations of a random or stratified sample.
+        seed (int): Seed of the random generator, the same seed draws the same sample.
+        start (int): First index of an index range.
+        stop (int): Index after the last one of an index range.
+    """
+    mode: str
+    count: int
+    seed: int
+    start: int
+    stop: int
+
+    def __init__(self, mode: str, count: int = 0, seed: int = 0, start: int = 0, stop: int = 0):
+        self.mode = mode
+        self.count = count
+        self.seed = seed
+        self.start = start
+        self.stop = stop
@@ -1,8 +1,10 @@
 from tkinter.ttk import Button, Frame, Label, Labelframe, Combobox, Spinbox
-from tkinter import BooleanVar, Listbox, Checkbutton, IntVar
+from tkinter import BooleanVar, Listbox, Checkbutton, IntVar, DoubleVar
 
 import source.ops.FrameSwitchColorOperators as ops
 import source.ops.sys_operators as sops
+from source.ops.color_index import TOLERANCE_TYPES
+from source.data.SwitchSettings import SwitchSettings
 
 
 class SwitchData(Labelframe):
@@ -13,16 +15,22 @@ class SwitchData(Labelframe):
 
     Attributes:
         rgb_color (tuple): The RGB value of the original color (as a tuple of three integers).
-        hex_color (str): The hexadecimal representation of the original color.
+        hex_color (str): The hexadecimal representation of the original color, scaled to 8 bits and followed
+                         by the raw value for 16-bit images (see sys_operators.pixel_to_hex).
         color_list (list[str]): A list of target colors for switching, represented as hexadecimal strings.
         box_color (Listbox | None): A Listbox displaying the current color in hex format.
         box_switches (Listbox | None): A Listbox showing the list of selected target colors.
         check_tolerance (Checkbutton | None): A Checkbutton to enable or disable tolerance use for color switching.
-        tolerance_type (set): A set of tolerance calculation methods, such as "Cubic" or "Sphere".
+        tolerance_type (list[str]): Tolerance calculation methods: "Cubic", "Spherical" and the perceptual
+                                  "ΔE76" and "ΔE2000" differences in the CIELAB space.
         tolerance_value (IntVar): An integer variable storing the tolerance value for color switching.
         use_tolerance (BooleanVar): An boolean variable storing user decision about tolerance usage.
         keep_difference (BooleanVar): An boolean variable storing user decision tp keep a difference between pixel
                                       values before and after color switching.
+        soft_edge (IntVar): An integer variable storing the width of the soft edge, in percent of the tolerance
+                            value. Colors within it are blended with the target color instead of switched.
+        feather (DoubleVar): A float variable storing the radius (Gaussian sigma) of the feather of the mask
+                             in pixels.
         b_add (Button | None): A button to open a color chooser for selecting target colors.
         b_remove (Button | None): A button to remove the selected color from the target color list.
         b_remove_frame (Button | None): A button to remove this frame from the parent widget.
@@ -35,10 +43,12 @@ class SwitchData(Labelframe):
     box_color: Listbox | None = None
     box_switches: Listbox | None = None
     check_tolerance: Checkbutton | None = None
-    tolerance_type = {"Cubic", "Sphere"}
+    tolerance_type = TOLERANCE_TYPES
     tolerance_value: IntVar
     use_tolerance: BooleanVar
     keep_difference: BooleanVar
+    soft_edge: IntVar
+    feather: DoubleVar
     b_add: Button | None = None
     b_remove: Button | None = None
     b_remove_frame: Button | None = None
@@ -84,10 +94,16 @@ class SwitchData(Labelframe):
         self.tolerance_value = IntVar()
         self.check_tolerance = Checkbutton(self, text="Use tolerance", variable=self.use_tolerance, onvalue=True, offvalue=False, command=self.toggle_tolerance_option, width=20)
         self.label_box = Label(self, text="Tolerance type: ")
-        self.box_tolerance = Combobox(self, values=["Cubic", "Spherical"], justify='left', width=9)
+        self.box_tolerance = Combobox(self, values=self.tolerance_type, justify='left', width=9)
         self.label_spin = Label(self, text="Tolerance value: ")
         self.spin_tolerance = Spinbox(self, from_=0, to=128, textvariable=self.tolerance_value, width=4)
         self.check_keep_diff = Checkbutton(self, text="Keep difference", variable=self.keep_difference, onvalue=True, offvalue=False, width=20)
+        self.soft_edge = IntVar()
+        self.feather = DoubleVar()
+        self.label_soft = Label(self, text="Soft edge (%): ")
+        self.spin_soft = Spinbox(self, from_=0, to=100, textvariable=self.soft_edge, width=4)
+        self.label_feather = Label(self, text="Feather (px): ")
+        self.spin_feather = Spinbox(self, from_=0, to=50, increment=0.5, textvariable=self.feather, width=4)
 
         self.b_add = Button(self, text="Select target color", command=lambda: ops.select_target_color(self) )
         self.b_add['padding'] = (10, 5)
@@ -117,9 +133,41 @@ class SwitchData(Labelframe):
         self.b_remove.grid(column=5, row=2, columnspan=3, padx=5, pady=5, sticky='nswe')
         self.b_remove_frame.grid(column=5, row=3, columnspan=3, padx=5, pady=5, ipady=5, sticky='we')
 
+    def settings(self) -> SwitchSettings:
+        """
+        Returns a snapshot of the frame's settings, which can be used outside of the Tk main loop.
+
+        Returns:
+            SwitchSettings: The current color, target colors and tolerance settings.
+        """
+        return SwitchSettings(
+            self.rgb_color, self.hex_color, self.color_list, self.use_tolerance.get(),
+            self.box_tolerance.get(), self.tolerance_value.get(), self.keep_difference.get(),
+            self.soft_edge.get(), self.feather.get()
+        )
+
+    def apply(self, settings: SwitchSettings):
+        """
+        Sets the target colors and tolerance settings of the frame, e.g. from a preset.
+
+        Args:
+            settings (SwitchSettings): The settings, for the same original color.
+        """
+        for color in settings.color_list:
+            if color not in self.color_list:
+                self.color_list.append(color)
+                self.box_switches.insert(len(self.color_list)+1, sops.RGB_to_hex(color))
+        self.use_tolerance.set(settings.use_tolerance)
+        self.box_tolerance.set(settings.tolerance_type)
+        self.tolerance_value.set(settings.tolerance_value)
+        self.keep_difference.set(settings.keep_difference)
+        self.soft_edge.set(settings.soft_edge)
+        self.feather.set(settings.feather)
+        self.toggle_tolerance_option()
+
     def toggle_tolerance_option(self):
         """
-        Toggles the visibility of the tolerance options (type and value) based on the state 
+        Toggles the visibility of the tolerance options (type, value and soft edges) based on the state 
         of the 'Use tolerance' checkbox.
         """
         if self.use_tolerance.get():
@@ -128,9 +176,17 @@ class SwitchData(Labelframe):
             self.label_spin.grid(column=1, row=6, padx=5, columnspan=2, sticky="w")
             self.spin_tolerance.grid(column=3, row=6, sticky="w")
             self.check_keep_diff.grid(column=1, row=7, columnspan=3, sticky='w')
+            self.label_soft.grid(column=1, row=8, padx=5, columnspan=2, sticky="w")
+            self.spin_soft.grid(column=3, row=8, sticky="w")
+            self.label_feather.grid(column=1, row=9, padx=5, columnspan=2, sticky="w")
+            self.spin_feather.grid(column=3, row=9, pady=(0,5), sticky="w")
         else:
             self.label_box.grid_forget()
             self.box_tolerance.grid_forget()
             self.label_spin.grid_forget()
             self.spin_tolerance.grid_forget()
-            self.check_keep_diff.grid_forget()
\ No newline at end of file
+            self.check_keep_diff.grid_forget()
+            self.label_soft.grid_forget()
+            self.spin_soft.grid_forget()
+            self.label_feather.grid_forget()
+            self.spin_feather.grid_forget()
\ No newline at end of file
@@ -0,0 +1,38 @@
+from source.data.SwitchSettings import SwitchSettings
+from source.data.SamplingSettings import SamplingSettings
+from source.data.RegionData import RegionData
+
+
+class SwitchPreset():
+    """
+    The SwitchPreset class is a saved color switch job: the settings of every SwitchData frame, the region
+    of interest and how the combinations are sampled and saved. A preset is applied to the GUI instead of
+    picking the colors again.
+
+    Attributes:
+        name (str): The name of the preset.
+        settings (list[SwitchSettings]): Snapshots of the switch data.
+        region (RegionData | None): The region of interest, None for the whole image.
+        sampling (SamplingSettings | None): Which combinations are rendered, None for all of them.
+        output_format (str | None): How the combinations are saved, one of packed_output.OUTPUT_FORMATS,
+                                    None for separate files.
+        mode (str | None): The PIL mode of the image the original colors were picked from, None when unknown.
+                           Original colors are in the native units of that mode (see presets.check_mode).
+    """
+    name: str
+    settings: list[SwitchSettings]
+    region: RegionData | None
+    sampling: SamplingSettings | None
+    output_format: str | None
+    mode: str | None
+
+    def __init__(
+            self, name: str, settings: list[SwitchSettings], region: RegionData | None = None,
+            sampling: SamplingSettings | None = None, output_format: str | None = None, mode: str | None = None
+        ):
+        self.name = name
+        self.settings = list(settings)
+        self.region = region
+        self.sampling = sampling
+        self.output_format = output_format
+        self.mode = mode
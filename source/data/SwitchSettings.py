@@ -0,0 +1,51 @@
+class SwitchSettings():
+    """
+    The SwitchSettings class is a snapshot of the settings of one SwitchData frame. Unlike the frame
+    it holds no Tk widgets or variables, so it can be used outside of the Tk main loop,
+    e.g. by jobs running in a worker thread.
+
+    Attributes:
+        rgb_color (tuple): The original color, as picked from the image.
+        hex_color (str): The hexadecimal representation of the original color, the key of its switches.
+                         For 16-bit images it is followed by the raw value, see sys_operators.pixel_to_hex.
+        color_list (list[tuple]): Target colors as 8-bit RGB tuples.
+        use_tolerance (bool): Whether the tolerance is used.
+        tolerance_type (str): The tolerance calculation method, see color_index.TOLERANCE_TYPES.
+        tolerance_value (int): The tolerance value in 8-bit units.
+        keep_difference (bool): Whether the difference between the pixel and the original color is kept.
+        soft_edge (int): With a tolerance above 0, the outer part of the tolerance, in percent, in which matched
+                         pixels fade from the target color to their own color. 0 for a hard cutoff.
+        feather (float): With a tolerance above 0, the sigma in pixels of a Gaussian blur of the match mask,
+                         0 for none.
+    """
+    rgb_color: tuple
+    hex_color: str
+    color_list: list[tuple]
+    use_tolerance: bool
+    tolerance_type: str
+    tolerance_value: int
+    keep_difference: bool
+    soft_edge: int
+    feather: float
+
+    def __init__(
+            self, rgb_color: tuple, hex_color: str, color_list: list[tuple], use_tolerance: bool = False,
+            tolerance_type: str = "", tolerance_value: int = 0, keep_difference: bool = False,
+            soft_edge: int = 0, feather: float = 0
+        ):
+        self.rgb_color = tuple(rgb_color)
+        self.hex_color = hex_color
+        self.color_list = [tuple(color) for color in color_list]
+        self.use_tolerance = use_tolerance
+        self.tolerance_type = tolerance_type
+        self.tolerance_value = tolerance_value
+        self.keep_difference = keep_difference
+        self.soft_edge = soft_edge
+        self.feather = feather
+
+    def is_soft(self) -> bool:
+        """
+        Returns whether matched pixels are blended with the target color rather than replaced by it.
+        A tolerance of 0 only matches the original color itself, which is always fully switched.
+        """
+        return self.use_tolerance and self.tolerance_value > 0 and (self.soft_edge > 0 or self.feather > 0)
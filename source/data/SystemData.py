@@ -1,9 +1,18 @@
 from tkinter.ttk import Combobox, Treeview
 from tkinter import filedialog
-from PIL import Image
+from typing import TYPE_CHECKING
 import os
 
-from source.data.SwitchData import SwitchData
+import lazy_loader as lazy
+
+from source.ops.job_runner import JobRunner
+
+if TYPE_CHECKING:
+    from source.data.SwitchData import SwitchData
+    from source.data.RegionData import RegionData
+
+# Pillow is imported when the first file is selected, not when the window opens
+Image = lazy.load("PIL.Image", suppress_warning=True)
 
 
 class SystemData():
@@ -17,23 +26,33 @@ class SystemData():
         file_list (Combobox | None): A Tkinter Combobox widget for displaying selected files.
         mean_tree: (Treeview | None): A Tkinter Treeview widget for displaying selected files and their weight in mean image operation.
         mean_data: (dict): A dictionary of selected file path with file weight.
+        region (RegionData | None): The region of interest of color switching, None for the whole image.
+        switch_mode (str | None): The PIL mode of the image the switch colors were picked from, None before
+                                  any is picked.
+        jobs (JobRunner): The runner of background jobs, such as image generation.
     """
     file_names: list[str]
-    switch_data: list[SwitchData]
+    switch_data: list["SwitchData"]
     file_list: Combobox | None
     mean_tree: Treeview | None
     mean_data: dict
+    region: "RegionData | None"
+    switch_mode: str | None
+    jobs: JobRunner
 
     def __init__(self):
         """
         Initializes an empty SystemData object with no selected files, no color switch data,
-        and no assigned Combobox widget.
+        no assigned Combobox widget and an idle job runner.
         """
         self.file_names = []
         self.switch_data = []
         self.file_list = None
         self.mean_tree = None
         self.mean_data = {}
+        self.region = None
+        self.switch_mode = None
+        self.jobs = JobRunner()
 
     def select_files(self) -> None:
         """
@@ -131,6 +150,7 @@ class SystemData():
         """
         self.file_names = []
         self.mean_data = {}
+        self.region = None
         self.update_files_data()
         print("List has been cleared.")
 
@@ -138,6 +158,15 @@ class SystemData():
     def update_files_data(self):
         self.file_list['values'] = self.file_names
         self.file_list.set("")
+        self.update_mean_tree()
+
+
+    def update_mean_tree(self) -> None:
+        """
+        Redraws the files of the mean image tab, once the tab has been opened.
+        """
+        if self.mean_tree is None:
+            return
 
         # Clear tree
         for item in self.mean_tree.get_children():
@@ -2,6 +2,7 @@ from tkinter import Tk
 
 from source.components import MenuBar as mb
 from source.components import Modes
+from source.components import JobPanel
 
 from source.data.SystemData import SystemData
 
@@ -29,6 +30,7 @@ class GUI:
 
         menubar = mb.MenuBar(root)
         modes = Modes.Modes(root, self.data)
+        jobs = JobPanel.JobPanel(root, self.data)
 
         root.mainloop()
 
@@ -0,0 +1,77 @@
+"""
+Headless watch mode: applies a preset or averages the images dropped into a folder.
+
+Run from the repository root:
+
+    python -m source.main_watch INPUT OUTPUT --preset preset.json     # switch colors of every new image
+    python -m source.main_watch INPUT OUTPUT --mean --batch-size 4    # average every 4 new images
+    python -m source.main_watch INPUT OUTPUT --preset preset.json --once
+
+The service runs until interrupted (Ctrl+C or SIGTERM), then finishes the queued batches. Metrics and
+throughput reports are written as JSON lines to the standard output, or to the file given by --metrics.
+Concurrent jobs share the memory budget (see scheduler.memory_budget).
+"""
+from argparse import ArgumentParser
+import os
+import signal
+import sys
+
+from source.ops.instrumentation import METRICS_ENVIRONMENT_VARIABLE
+from source.ops.presets import load_preset
+from source.ops.scheduler import MEMORY_BUDGET_VARIABLE, memory_budget
+from source.ops.watch_folder import WatchService, SWITCH, MEAN
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Applies a preset or averages the images dropped into a folder.")
+    parser.add_argument("input", help="the watched folder")
+    parser.add_argument("output", help="the folder of the results")
+    engine = parser.add_mutually_exclusive_group(required=True)
+    engine.add_argument("--preset", help="switch colors of every new image with this preset")
+    engine.add_argument("--mean", action="store_true", help="average the new images, batch by batch")
+    parser.add_argument("--batch-size", type=int, default=8, help="number of files of a batch")
+    parser.add_argument("--batch-seconds", type=float, default=5.0, help="longest wait for a full batch")
+    parser.add_argument("--workers", type=int, default=2, help="number of batches processed at once")
+    parser.add_argument("--queue-size", type=int, default=4, help="number of batches waiting for a worker")
+    parser.add_argument("--poll-seconds", type=float, default=1.0, help="time between two scans of the folder")
+    parser.add_argument("--report-seconds", type=float, default=30.0, help="time between two throughput reports")
+    parser.add_argument("--resample", action="store_true", help="resample mean inputs to the first image")
+    parser.add_argument("--align", action="store_true", help="align mean inputs to the first image")
+    parser.add_argument("--once", action="store_true", help="process the files in the folder, then stop")
+    parser.add_argument("--metrics", help="file of the JSON lines, the standard output by default")
+    args = parser.parse_args()
+    args.input = os.path.abspath(args.input)
+    args.output = os.path.abspath(args.output)
+
+    if not os.path.isdir(args.input):
+        parser.error(f"{args.input} is not a folder")
+    preset = None
+    if args.preset is not None:
+        try:
+            preset = load_preset(args.preset)
+        except ValueError as error:
+            parser.error(str(error))
+
+    if args.metrics is not None:
+        os.environ[METRICS_ENVIRONMENT_VARIABLE] = args.metrics
+    os.environ.setdefault(METRICS_ENVIRONMENT_VARIABLE, "-")
+    if MEMORY_BUDGET_VARIABLE not in os.environ:
+        os.environ[MEMORY_BUDGET_VARIABLE] = str(memory_budget() / max(args.workers, 1) / 2**20)
+
+    try:
+        service = WatchService(
+            args.input, args.output, MEAN if args.mean else SWITCH, preset, args.batch_size, args.batch_seconds,
+            args.workers, args.queue_size, args.poll_seconds, args.report_seconds, args.resample, args.align
+        )
+    except ValueError as error:
+        parser.error(str(error))
+
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: service.stop())
+    summary = service.run(once=args.once)
+    print(service.metrics.describe(), file=sys.stderr)
+    return 1 if summary['counters'].get("files failed") else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,10 +1,17 @@
 from tkinter.ttk import Spinbox
 from tkinter import filedialog, messagebox
-from PIL import Image
 import numpy as np
-from os import chdir
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os import path
 
 from source.data.SystemData import SystemData
+from source.ops.job_runner import Job
+from source.ops.pixel_cache import pixel_cache
+from source.ops.scheduler import plan_mean
+from source.ops.alignment import open_resampled, estimate_shift, placement, transform_cache, registration
+from source.ops.color_index import MODES
+from source.ops.mean_modes import MeanMode
 
 def change_weight_of_elements(spinbox: Spinbox, data: SystemData) -> None:
     try:
@@ -31,9 +38,9 @@ def change_weight_of_elements(spinbox: Spinbox, data: SystemData) -> None:
     data.update_files_data()
 
 
-def generate_mean_file(data: SystemData) -> None:
+def generate_mean_file(data: SystemData, resample: bool = False, align: bool = False) -> None:
     # Check if in memory are more then 1 file
-    shape = validate_data_for_generate(data)
+    shape = validate_data_for_generate(data, resample, align)
     if not shape:
         return None
 
@@ -41,53 +48,171 @@ def generate_mean_file(data: SystemData) -> None:
     target_folder = filedialog.askdirectory()
     if target_folder == "":
         return None
-    chdir(target_folder)
 
-    # Make result matrix
-    matrix = np.zeros(shape, dtype=int)
-    weight_sum = 0
-    for key in data.mean_data.keys():
-        # Prepare values
-        weight = data.mean_data[key]['weight']
-
-        weight_sum += weight
-        # Add image to prepared matrix
-        image_matrix = np.array(Image.open(key), dtype=int)
-        for _ in range(weight):
-            matrix += image_matrix
-
-    # Get mean value from the matrix
-    matrix = matrix / weight_sum
-
-    # Prepare to save as image
-    matrix = np.array(matrix, dtype='uint8')
-    new_image = Image.fromarray(matrix)
-
-    new_image.save(f"mean_image_result.jpg")
+    # Generate in the background, the selection can be changed in the meantime
+    mean_data = {key: dict(value) for key, value in data.mean_data.items()}
+    data.jobs.submit("Mean image", render_mean_file, mean_data, shape, target_folder, resample, align)
 
     data.clear_selection()
 
 
-def validate_data_for_generate(data: SystemData) -> tuple | None:
+def render_mean_file(
+        job: Job, mean_data: dict, shape: tuple, target_folder: str, resample: bool = False, align: bool = False
+    ) -> None:
+    metrics = job.metrics
+    with metrics.stage("plan"):
+        plan = plan_mean(mean_data, shape, cached=pixel_cache.max_bytes > 0)
+    metrics.emit({"plan": plan.describe()})
+
+    # Every image is resampled to the size of the first one, the common grid
+    if resample:
+        size = (shape[1], shape[0])
+        load = lambda key: open_resampled(key, size)[0]
+    else:
+        load = lambda key: pixel_cache.open_pixels(key)[0]
+
+    shifts = {}
+    if align:
+        with metrics.stage("align"):
+            shifts = align_images(job, list(mean_data.keys()), load, plan.workers, resample)
+
+    # Sum the weighted images strip by strip, in thinner strips if the memory runs out anyway
+    while True:
+        try:
+            matrix = mean_strips(job, mean_data, shape, plan, load, shifts, resample)
+            break
+        except MemoryError:
+            plan = plan.split()
+            metrics.count("memory fallbacks")
+    metrics.count("strips", plan.strips)
+    metrics.count("workers", plan.workers)
+
+    # Save in the precision of the result, JPEG only keeps 8-bit L and RGB
+    with metrics.stage("save"):
+        file_name = mean_mode_of(mean_data).save(matrix, target_folder)
+    metrics.count("bytes written", path.getsize(file_name))
+
+
+def align_images(job: Job, keys: list[str], load, workers: int, resample: bool = False) -> dict:
+    # Shifts registering every image with the first one, estimated in parallel and cached by file hashes
+    metrics = job.metrics
+    reference = load(keys[0])
+    reference_hash = pixel_cache.file_hash(keys[0])
+    shifts = {keys[0]: (0, 0)}
+
+    def shift_of(key: str) -> tuple[int, int]:
+        cache_key = f"{reference_hash}:{pixel_cache.file_hash(key)}:{'resampled' if resample else 'native'}"
+        shift = transform_cache.get(cache_key)
+        if shift is None:
+            shift = estimate_shift(reference, load(key))
+            transform_cache.put(cache_key, shift)
+            metrics.count("shifts estimated")
+        return shift
+
+    # LazyLoader is not thread-safe before Python 3.12, the module is loaded before the threads use it
+    registration.__name__
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for key, shift in zip(keys[1:], pool.map(shift_of, keys[1:])):
+            job.check()
+            shifts[key] = shift
+    transform_cache.save()
+    metrics.emit({"shifts": {path.basename(key): shift for key, shift in shifts.items()}})
+    return shifts
+
+
+def mean_mode_of(mean_data: dict) -> MeanMode:
+    return MeanMode.promote(item['mode'] for item in mean_data.values())
+
+
+def mean_strips(
+        job: Job, mean_data: dict, shape: tuple, plan, load=None, shifts: dict | None = None, resample: bool = False
+    ) -> np.ndarray:
+    metrics = job.metrics
+    job.done = 0
+    job.set_total(len(mean_data) * plan.strips)
+    load = load or (lambda key: pixel_cache.open_pixels(key)[0])
+    shifts = shifts or {}
+    weight_sum = sum(item['weight'] for item in mean_data.values())
+    # Every strip is promoted to the mode of the result: channels, alpha and bit depth
+    mean_mode = mean_mode_of(mean_data)
+    dtype = np.dtype(plan.accumulator_dtype)
+    result = np.empty(mean_mode.shape(*shape[:2]), dtype=mean_mode.dtype())
+
+    # Images which do not cover the whole grid only count where they are
+    covering = all(
+        shifts.get(key, (0, 0)) == (0, 0) and (item['height'], item['width']) == tuple(shape[:2])
+        for key, item in mean_data.items()
+    ) or (resample and not shifts)
+
+    def weighted_strip(key: str, top: int, bottom: int) -> tuple | None:
+        # Only the pages of the strip are read from the memory map of the cache
+        matrix = load(key)
+        place = placement(shifts.get(key, (0, 0)), matrix.shape, top, bottom, shape[1])
+        if place is None:
+            return None
+        rows, columns, source_rows, source_columns = place
+        weight = mean_data[key]['weight']
+        color, alpha = mean_mode.weighted(matrix[source_rows, source_columns], mean_data[key]['mode'], weight, dtype)
+        return rows, columns, color, alpha, dtype.type(weight)
+
+    def add(matrix: np.ndarray, alpha_sum: np.ndarray | None, coverage: np.ndarray | None, weighted: tuple | None) -> None:
+        if weighted is None:
+            return
+        rows, columns, color, alpha, weight = weighted
+        # Gray strips are broadcast to every color channel
+        matrix[rows, columns] += color
+        if alpha_sum is not None:
+            alpha_sum[rows, columns] += alpha
+        if coverage is not None:
+            coverage[rows, columns] += weight
+
+    with ThreadPoolExecutor(max_workers=plan.workers) as pool:
+        for top, bottom in plan.rows(shape[0]):
+            matrix = np.zeros((bottom - top, shape[1], mean_mode.channels), dtype=dtype)
+            alpha_sum = np.zeros((bottom - top, shape[1]), dtype=dtype) if mean_mode.alpha else None
+            coverage = None if covering else np.zeros((bottom - top, shape[1]), dtype=dtype)
+            # At most `workers` weighted strips are in memory at once
+            pending = deque()
+            for key in mean_data.keys():
+                job.check()
+                pending.append(pool.submit(weighted_strip, key, top, bottom))
+                if len(pending) >= plan.workers:
+                    with metrics.stage("accumulate"):
+                        add(matrix, alpha_sum, coverage, pending.popleft().result())
+                    job.advance((bottom - top) * shape[1])
+            while pending:
+                with metrics.stage("accumulate"):
+                    add(matrix, alpha_sum, coverage, pending.popleft().result())
+                job.advance((bottom - top) * shape[1])
+
+            # Get mean value from the matrix, rounded down
+            with metrics.stage("accumulate"):
+                result[top:bottom] = mean_mode.finish(matrix, alpha_sum, weight_sum if coverage is None else coverage)
+    return result
+
+
+def validate_data_for_generate(data: SystemData, resample: bool = False, align: bool = False) -> tuple | None:
     # Check if in memory are more then 1 file
     if len(data.mean_data) < 2:
         messagebox.showinfo(message='Select at least 2 images in "File selection"')
         return None
 
-    # Check if every images have this same resolution
-    resolution = []
-    if item['mode'] in ['L']:
-        channels = 1
-    elif item['mode'] in ['RGB']:
-        channels = 3
-    elif item['mode'] in ['RGBA']:
-        channels = 4
+    # Images of different modes are promoted to a common one, strip by strip
+    for item in data.mean_data.values():
+        if item['mode'] not in MODES:
+            messagebox.showinfo(message='Mean image is possible only for L, LA, RGB, RGBA and 16-bit grayscale images.')
+            return None
 
+    # Check if every images have this same resolution, unless they are resampled or aligned
+    resolution = []
     for item in data.mean_data.values():
-        resolution.append((item['height'], item['width'], channels))
+        resolution.append((item['height'], item['width']))
 
-    if len(set(resolution)) != 1:
-        messagebox.showinfo(message='Selected files have different resolutions.')
+    if len(set(resolution)) != 1 and not (resample or align):
+        messagebox.showinfo(
+            message='Selected files have different resolutions. Resample or align them to average them.'
+        )
         return None
 
-    return resolution[0]
\ No newline at end of file
+    # The first image is the common grid
+    return mean_mode_of(data.mean_data).shape(*resolution[0])
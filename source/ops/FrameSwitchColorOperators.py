@@ -1,12 +1,20 @@
 from tkinter import colorchooser, messagebox, filedialog
 from PIL import Image
+import lazy_loader as lazy
 import numpy as np
-from itertools import product
 import os
-from math import sqrt
+
+from source.ops.color_index import ColorIndex, MODES, color_view, load_matrix, native_color, output_extension
+from source.ops.pixel_cache import pixel_cache, hash_file
+from source.ops.manifest import Manifest, table_digests, combination_fingerprint
+from source.ops.planner import prune_table, idle_colors, plan_combinations
+from source.ops.packed_output import SEPARATE_FILES, BATCH_BYTES, open_writer
+from source.ops.scheduler import plan_switch
+from source.ops.presets import MatchPlan, check_mode
+
+ndimage = lazy.load("scipy.ndimage", suppress_warning=True)
 
 MIN_COLOR_VALUE = 0
-MAX_COLOR_VALUE = 255
 
 def select_target_color(item) -> None:
     """
@@ -31,6 +39,7 @@ def remove_selected_color(data) -> None:
     index = data.box_switches.curselection()
     if index:
         data.box_switches.delete(index)
+        data.color_list.pop(index[0])
 
 def remove_frame(frame, data) -> None:
     """
@@ -42,28 +51,32 @@ def remove_frame(frame, data) -> None:
     """
     frame.grid_remove()
     data.switch_data.remove(frame)
+    if not data.switch_data:
+        data.switch_mode = None
 
-def generate_images(data) -> None:
+def generate_images(data, resume: bool = False, sampling=None, output_format: str = SEPARATE_FILES) -> None:
     """
     Generates new image files by applying color transformations to the selected image based on the user's color switching preferences. 
     This involves creating multiple combinations of color changes and saving each variation as a new image file. 
-    Once the images are generated, the program resets the user's color selections and file data.
+    The generation runs as a job in the background (see render_images), so the program is reset right away
+    and the user can prepare the next job while this one is running.
 
     Args:
         data (SystemData): An object containing:
             - file_names (list[str]): A list of file names representing the images to be processed.
             - switch_data (list[SwitchData]): A list of SwitchData objects, each representing the user's 
               selected color switches and transformations.
+            - jobs (JobRunner): The runner of background jobs.
+        resume (bool): Whether combinations already rendered into the target folder are skipped (see Manifest).
+        sampling (SamplingSettings | None): Which combinations are rendered, None for all of them.
+        output_format (str): How the combinations are saved, one of packed_output.OUTPUT_FORMATS.
 
     Workflow:
         1. The function first removes any SwitchData entries where no target colors are selected.
         2. Validates if the `switch_data` is appropriate for further processing.
         3. Prompts the user to select a target directory to save the generated images.
-        4. For each image, the function applies color transformations based on the switch data:
-            - Uses a lookup table to map original colors to new target colors.
-            - If multiple colors are selected for switching, generates all possible combinations of transformations.
-        5. Saves each generated image file in the target directory with unique color combinations.
-        6. After generating the images, the program is reset by removing the color switching frames and clearing the file data.
+        4. Queues a job rendering every combination with a snapshot of the switch data.
+        5. After queueing the job, the program is reset by removing the color switching frames and clearing the file data.
 
     Returns:
         None: The function performs its operations but does not return any value.
@@ -80,35 +93,142 @@ def generate_images(data) -> None:
     target_folder = filedialog.askdirectory()
     if target_folder == "":
         return None
-    os.chdir(target_folder)
 
-    # Prepare file
-    image = Image.open(data.file_names[0])
-    matrix = np.array(image)
-    look_up_table = make_look_up_table(matrix, data.switch_data)
-
-    # Make all combinations of color switches
-    if len(data.switch_data) > 1:
-        colors = ()
-        for item in data.switch_data:
-            colors = colors + ([(color, item.hex_color) for color in item.color_list], )
-        combos = product(*colors)
-    else:
-        item = data.switch_data[0]
-        combos = ([(color, item.hex_color)] for color in item.color_list)
-    
-    # Generate every combo
-    for index, combo in enumerate(combos):
-        generate_file(matrix, look_up_table, combo, index)
+    file_name = data.file_names[0]
+    settings = [item.settings() for item in data.switch_data]
+    data.jobs.submit(
+        f"Switch colors: {os.path.basename(file_name)}",
+        render_images, file_name, settings, data.region, target_folder, resume, sampling, output_format
+    )
 
     # Reset program
-    for frame in data.switch_data:
+    for frame in reversed(data.switch_data):
         remove_frame(frame, data)
 
     data.file_names = []
     data.mean_data = {}
+    data.region = None
+    data.switch_mode = None
+
+def render_images(
+        job, file_name: str, settings: list, region, target_folder: str, resume: bool = False, sampling=None,
+        output_format: str = SEPARATE_FILES
+    ) -> None:
+    """
+    Renders and saves every combination of color switches. Runs as a background job.
 
-    print("Finished!")
+    Workflow:
+        1. Uses a lookup table to map original colors to the pixels which should be switched.
+        2. If multiple colors are selected for switching, generates all possible combinations of transformations,
+           or a sample of them. Combinations are decoded from their index one at a time, the product is never built.
+        3. Saves each generated image file in the target directory with unique color combinations.
+        4. Records every combination in the manifest of the target directory. When resuming, combinations
+           whose fingerprint is already in the manifest with an intact file are not rendered again.
+        5. Pixels overwritten by later switches are pruned from the lookup table. Original colors left without
+           pixels do not change the image, so combinations differing only by their targets are rendered once
+           and the others are saved as hard links (or manifest aliases) of the rendered file.
+        6. Unless saved as separate files, combinations are packed in batches into contact sheets, a multi-page
+           TIFF or .npy chunks (see packed_output). The manifest records where every combination is.
+        7. The memory of the job is planned (see scheduler.plan_switch): the lookup table is built in strips
+           of rows when needed, and in thinner strips if it runs out of memory anyway.
+        8. The masks of the lookup table are cached by image hash and compiled match plan (see presets.MatchPlan),
+           so running the same switches on the same image again does not match the colors again.
+
+    Args:
+        job (Job): The job running the operation, used to report progress and metrics and check for cancellation.
+        file_name (str): The image to process.
+        settings (list[SwitchSettings]): Snapshots of the switch data.
+        region (RegionData | None): The region of interest, None for the whole image.
+        target_folder (str): The folder where the images are saved.
+        resume (bool): Whether combinations already recorded in the manifest are skipped.
+        sampling (SamplingSettings | None): Which combinations are rendered, None for all of them.
+        output_format (str): How the combinations are saved, one of packed_output.OUTPUT_FORMATS.
+    """
+    metrics = job.metrics
+    target_folder = os.path.abspath(target_folder)
+
+    # Prepare file
+    with metrics.stage("load"):
+        # Copy-on-write map of the decoded pixels, only the switched pages are copied
+        matrix, mode = pixel_cache.open_pixels(file_name, writable=True)
+    with metrics.stage("plan"):
+        plan = plan_switch(matrix.shape, mode, settings)
+    metrics.emit({"plan": plan.describe()})
+    source_hash = pixel_cache.file_hash(file_name)
+    with metrics.stage("lookup"):
+        # Masks matched by an earlier job with the same match plan are read from the cache
+        match_plan = MatchPlan.compile(settings, region)
+        cached = match_plan.load(source_hash, plan)
+        missing = [item for item in settings if item.hex_color not in cached]
+        matched = {}
+        while missing:
+            try:
+                matched = make_look_up_table(matrix, missing, mode, region, plan)
+                break
+            except MemoryError:
+                plan = plan.split()
+                metrics.count("memory fallbacks")
+        match_plan.store(source_hash, matched)
+        look_up_table = {
+            item.hex_color: cached[item.hex_color] if item.hex_color in cached else matched[item.hex_color]
+            for item in settings
+        }
+    if cached:
+        metrics.count("cached masks", len(cached))
+    if missing:
+        metrics.count("lookup strips", plan.strips)
+    for hex_color, (pixels, *_) in look_up_table.items():
+        metrics.count(f"matched {hex_color}", len(pixels))
+    with metrics.stage("plan"):
+        pixels = matrix.shape[0] * matrix.shape[1]
+        look_up_table = prune_table(look_up_table, [item.hex_color for item in settings], pixels)
+    for hex_color in idle_colors(look_up_table):
+        metrics.count(f"idle {hex_color}")
+
+    # Plan the combinations of color switches
+    choices = [[(color, item.hex_color) for color in item.color_list] for item in settings]
+    total, combos = plan_combinations(choices, sampling)
+    job.set_total(total)
+
+    manifest = Manifest(target_folder, resume)
+    writer = open_writer(output_format, target_folder, mode, manifest, resume, min(plan.batch_bytes, BATCH_BYTES))
+    digests = table_digests(look_up_table)
+
+    # Generate every combo
+    try:
+        for index, combo in combos:
+            job.check()
+            fingerprint = combination_fingerprint(source_hash, mode, digests, combo)
+            done = manifest.find(fingerprint)
+            previous = manifest.entries.get(index)
+            if done is not None and previous is not None and previous['fingerprint'] == fingerprint:
+                metrics.count("skipped")
+                job.advance()
+                continue
+            if done is not None or (writer is not None and writer.defer(index, combo, fingerprint)):
+                if done is not None:
+                    manifest.alias(index, combo, done, output_name(index, mode))
+                metrics.count("duplicates")
+                job.advance()
+                continue
+
+            with metrics.stage("render"):
+                recolor(matrix, look_up_table, combo, mode)
+            with metrics.stage("save"):
+                if writer is None:
+                    saved = save_file(matrix, index, mode, target_folder)
+                    manifest.record(index, combo, fingerprint, saved, hash_file(saved))
+                    written = os.path.getsize(saved)
+                else:
+                    written = writer.add(index, combo, fingerprint, matrix)
+            metrics.count("bytes written", written)
+            job.advance(pixels)
+    finally:
+        # Combinations rendered before a cancellation are written too
+        if writer is not None:
+            with metrics.stage("save"):
+                metrics.count("bytes written", writer.close())
+        manifest.close()
 
 def validate_data(data) -> bool:
     """
@@ -125,6 +245,24 @@ def validate_data(data) -> bool:
         messagebox.showinfo(message='Select 1 image in "File selection".')
         return True
 
+    # Check if the image can be switched
+    mode = Image.open(data.file_names[0]).mode
+    if mode not in MODES:
+        messagebox.showinfo(message='This operation is possible only for L, LA, RGB, RGBA and 16-bit grayscale images.')
+        return True
+
+    # Check if the colors were picked from an image of the same kind
+    try:
+        check_mode(data.switch_mode, mode)
+    except ValueError as error:
+        messagebox.showinfo(message=str(error))
+        return True
+
+    # Check if the region was made for this image
+    if data.region is not None and data.region.size not in (None, Image.open(data.file_names[0]).size):
+        messagebox.showinfo(message='The region mask and the image have different resolutions.')
+        return True
+
     # Check if there is any color
     if len(data.switch_data) < 1:
         messagebox.showinfo(message='Select at least 1 color to switch.')
@@ -132,91 +270,237 @@ def validate_data(data) -> bool:
 
     return False
 
-def make_look_up_table(matrix: np.array, data) -> dict:
+def preview_image(image: Image) -> Image:
+    """
+    Returns a copy of the image which can be displayed by ImageTk. 16-bit images are reduced to 8 bits,
+    other supported modes are displayed as they are.
+
+    Args:
+        image (Image): The image to display.
+
+    Returns:
+        Image: The displayable image.
+    """
+    if MODES[image.mode][1] > 255:
+        return Image.fromarray((load_matrix(image) >> 8).astype(np.uint8))
+    return image
+
+def make_look_up_table(matrix: np.array, data, mode: str = "RGB", region=None, plan=None) -> dict:
     """
-    Creates a lookup table mapping hex color values to pixel coordinates in the image matrix.
+    Creates a lookup table mapping hex color values to the pixels of the image matrix which should be switched.
     Supports exact color matching and tolerance-based matching (cubic or spherical) for approximate color matches.
 
+    Matching is done against the unique colors of the image (see ColorIndex), so its cost depends on the
+    number of colors in the image rather than on the number of pixels. Only the color channels are
+    matched, so alpha does not prevent RGBA pixels from matching. With a region of interest only the pixels
+    inside the region are indexed and matched.
+
+    When indexing the whole image at once does not fit in memory, the plan splits it into strips of rows
+    which are indexed and matched one after another.
+
+    Soft matches (see SwitchSettings.is_soft) weight the pixels instead of the hard tolerance cutoff:
+    by the distance of their color to the original color near the tolerance, and with a Gaussian feather
+    of the mask (see feather_mask).
+
     Args:
-        matrix (np.array): 3D array representing image pixel data (rows, columns, RGB values).
-        data (list[SwitchData]): List of SwitchData objects containing color and tolerance settings.
+        matrix (np.array): Array representing image pixel data, (rows, columns) or (rows, columns, bands).
+        data (list[SwitchSettings]): List of SwitchSettings snapshots containing color and tolerance settings.
+        mode (str): The PIL mode of the image, one of MODES.
+        region (RegionData | None): The region of interest, None for the whole image.
+        plan (MemoryPlan | None): The strips and dtypes of the table, None to index the whole image at once.
 
     Returns:
-        dict: A dictionary where keys are hex color values and values are lists of pixel coordinates (row, column).
+        dict: A dictionary where keys are hex color values and values are tuples (pixels, diff, keep_diff,
+              weight, base): flat indices of the matched pixels, the difference of their color channels to the
+              original color (None when the difference is not kept), the keep difference flag, and for soft
+              matches the float32 weight of the target color in every pixel and the original colors of the
+              pixels (both None when the pixels are fully switched).
     """
+    height, width = matrix.shape[:2]
+    positions = None
+    if region is not None:
+        positions = region.positions(matrix.shape)
+    if plan is None or plan.strips == 1:
+        strips = [positions]
+    else:
+        strips = []
+        for top, bottom in plan.rows(height):
+            if positions is None:
+                strips.append(np.arange(top * width, bottom * width, dtype=np.intp))
+            else:
+                first, last = np.searchsorted(positions, [top * width, bottom * width])
+                strips.append(positions[first:last])
+
     # Create look up table
+    channels, max_value = MODES[mode]
+    colors = color_view(matrix, channels)
+    parts = {item.hex_color: ([], [], []) for item in data}
+    for strip_positions in strips:
+        index = ColorIndex(matrix, mode, strip_positions)
+        for item in data:
+            if item.use_tolerance:
+                found = index.match(item.rgb_color, item.tolerance_type, item.tolerance_value)
+            else:
+                found = index.match(item.rgb_color)
+
+            # Soft edges weight the pixels by the distance of their color, measured on the palette only
+            weight = None
+            if item.is_soft() and item.soft_edge > 0:
+                weights = index.soft_weights(
+                    found, item.rgb_color, item.tolerance_type, item.tolerance_value, item.soft_edge
+                )
+                pixels, weight = index.pixels(found, weights)
+            else:
+                pixels = index.pixels(found)
+            diff = None
+            if item.keep_difference and not (item.is_soft() and item.feather > 0):
+                diff = colors[pixels] - np.asarray(item.rgb_color[:index.channels])
+            if plan is not None:
+                pixels = pixels.astype(plan.index_dtype, copy=False)
+                diff = diff.astype(plan.diff_dtype, copy=False) if diff is not None else None
+            parts[item.hex_color][0].append(pixels)
+            parts[item.hex_color][1].append(diff)
+            parts[item.hex_color][2].append(weight)
+        del index
+
     table = {}
     for item in data:
-        table[item.hex_color] = []
-    # Check tolerance usage
-    for item in data:
-        if item.use_tolerance:
-            tolerance_type = item.box_tolerance.get()
-            tol_value = item.tolerance_value.get()
-            keep_diff = item.keep_difference
-
-            if tolerance_type == 'Cubic' and tol_value > 0:
-                for row in range(len(matrix)):
-                    for column in range(len(matrix[row])):
-                        r = int(matrix[row][column][0]) - item.rgb_color[0] 
-                        g = int(matrix[row][column][1]) - item.rgb_color[1] 
-                        b = int(matrix[row][column][2]) - item.rgb_color[2] 
-                        if abs(r) < tol_value and abs(g) < tol_value and abs(b) < tol_value:
-                            table[item.hex_color].append((row, column, keep_diff, r, g, b))
-
-            elif tolerance_type == "Spherical" and tol_value > 0:
-                for row in range(len(matrix)):
-                    for column in range(len(matrix[row])):
-                        r = int(matrix[row][column][0]) - item.rgb_color[0]
-                        g = int(matrix[row][column][1]) - item.rgb_color[1]
-                        b = int(matrix[row][column][2]) - item.rgb_color[2]
-                        if sqrt(r*r + g*g + b*b) < tol_value:
-                            table[item.hex_color].append((row, column, keep_diff, r, g, b))
+        pixels, diffs, weights = parts[item.hex_color]
+        pixels = pixels[0] if len(pixels) == 1 else np.concatenate(pixels)
+        weight = None
+        if weights[0] is not None:
+            weight = weights[0] if len(weights) == 1 else np.concatenate(weights)
+        diff = None
+        feathered = item.is_soft() and item.feather > 0
+        if item.keep_difference and not feathered:
+            diff = diffs[0] if len(diffs) == 1 else np.concatenate(diffs)
+
+        # Feathering spreads the mask to the neighbouring pixels, their differences are taken afterwards
+        if feathered:
+            pixels, weight = feather_mask(pixels, weight, (height, width), item.feather, positions, max_value)
+            if plan is not None:
+                pixels = pixels.astype(plan.index_dtype, copy=False)
+            if item.keep_difference:
+                diff = colors[pixels] - np.asarray(item.rgb_color[:channels])
+                if plan is not None:
+                    diff = diff.astype(plan.diff_dtype, copy=False)
+
+        # Pixels blend from their original colors, unless every one of them is fully switched
+        base = None
+        if weight is not None and (weight >= 1).all():
+            weight = None
+        if weight is not None:
+            base = colors[pixels]
+        table[item.hex_color] = (pixels, diff, item.keep_difference, weight, base)
 
-            else:
-                for row in range(len(matrix)):
-                    for column in range(len(matrix[row])):
-                        if list(item.rgb_color) == list(matrix[row][column]):
-                            table[item.hex_color].append((row, column, keep_diff, 0, 0, 0))
+    return table
 
-        else:
-            for row in range(len(matrix)):
-                for column in range(len(matrix[row])):
-                    if list(item.rgb_color) == list(matrix[row][column]):
-                        table[item.hex_color].append((row, column, keep_diff, 0, 0, 0))
+def feather_mask(
+        pixels: np.ndarray, weight: np.ndarray | None, shape: tuple, sigma: float, positions: np.ndarray | None = None,
+        max_value: int = 255
+    ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Blurs a match mask with a Gaussian filter, so the switched area fades out over a few pixels instead of
+    ending on a jagged edge. The mask is blurred as a whole frame plane, so it costs about one filter pass.
 
-    return table
+    Args:
+        pixels (np.ndarray): Flat indices of the matched pixels.
+        weight (np.ndarray | None): Their weights, None when they are all fully switched.
+        shape (tuple): Height and width of the image.
+        sigma (float): The standard deviation of the filter in pixels.
+        positions (np.ndarray | None): Flat indices of the pixels of the region of interest, the mask
+                                       does not spread outside of it. None for the whole image.
+        max_value (int): The maximum value of a channel, weights too small to change it are dropped.
 
-def generate_file(matrix: np.array, table: dict, combination: list[tuple], index: int):
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Sorted flat indices of the pixels of the blurred mask and their float32 weights.
+    """
+    plane = np.zeros(shape[0] * shape[1], dtype=np.float32)
+    plane[pixels] = 1 if weight is None else weight
+    plane = ndimage.gaussian_filter(plane.reshape(shape), sigma, mode='nearest').ravel()
+    if positions is not None:
+        inside = np.zeros(plane.size, dtype=bool)
+        inside[positions] = True
+        plane[~inside] = 0
+    pixels = np.flatnonzero(plane >= 0.5 / max_value)
+    return pixels, np.minimum(plane[pixels], 1)
+
+def generate_file(matrix: np.array, table: dict, combination: list[tuple], index: int, mode: str = "RGB", folder: str = ""):
     """
     Generates a new image by applying the color transformations based on the given combination 
     and saves the new image file.
 
     Args:
-        matrix (np.array): A 2D array representing the pixel data of the image.
-        table (dict): A lookup table mapping color hex values to pixel coordinates.
+        matrix (np.array): Array representing the pixel data of the image, changed in place.
+        table (dict): A lookup table mapping color hex values to matched pixels (see make_look_up_table).
         combination (list[tuple]): A list of color transformations (RGB and target color).
         index (int): The index used to name the generated image file.
+        mode (str): The PIL mode of the image, one of MODES.
+        folder (str): The folder where the image is saved, the current directory by default.
+    """
+    recolor(matrix, table, combination, mode)
+    save_file(matrix, index, mode, folder)
+
+def recolor(matrix: np.array, table: dict, combination: list[tuple], mode: str = "RGB") -> None:
     """
+    Applies the color transformations of the combination to the image.
+    Only the color channels are written, through a view of the matrix, so alpha is kept as it is.
+    Pixels of soft edges are blended with the target color by their weight, as whole-array operations.
+
+    Args:
+        matrix (np.array): Array representing the pixel data of the image, changed in place.
+        table (dict): A lookup table mapping color hex values to matched pixels (see make_look_up_table).
+        combination (list[tuple]): A list of color transformations (RGB and target color).
+        mode (str): The PIL mode of the image, one of MODES.
+    """
+    channels, max_value = MODES[mode]
+    colors = color_view(matrix, channels)
+    # Soft edges blend over the colors below them, so their pixels get their original colors back first
+    for _, target in combination:
+        pixels, _, _, weight, base = table[target]
+        if weight is not None:
+            colors[pixels] = base
     for rgb, target in combination:
-        for row, column, keep_diff, r, g, b in table[target]:
-            if keep_diff:
-                new_r = list(rgb)[0] + r
-                if new_r < MIN_COLOR_VALUE: new_r = MIN_COLOR_VALUE
-                elif new_r > MAX_COLOR_VALUE: new_r = MAX_COLOR_VALUE
+        pixels, diff, keep_diff, weight, _ = table[target]
+        color = np.asarray(native_color(rgb, mode))
+        if keep_diff:
+            color = np.clip(color + diff, MIN_COLOR_VALUE, max_value)
+        if weight is None:
+            colors[pixels] = color
+        else:
+            below = colors[pixels].astype(np.float32)
+            colors[pixels] = np.rint(below + weight[:, np.newaxis] * (color - below))
+
+def save_file(matrix: np.array, index: int, mode: str = "RGB", folder: str = "") -> str:
+    """
+    Saves the image of a combination. Images with alpha or 16-bit samples are saved as PNG, others as JPEG.
+    The file is written under a temporary name and moved into place, so files hard linked to an older
+    version of it (see Manifest.alias) are never changed.
 
-                new_g = list(rgb)[1] + g
-                if new_g < MIN_COLOR_VALUE: new_g = MIN_COLOR_VALUE
-                elif new_g > MAX_COLOR_VALUE: new_g = MAX_COLOR_VALUE
+    Args:
+        matrix (np.array): Array representing the pixel data of the image.
+        index (int): The index used to name the generated image file.
+        mode (str): The PIL mode of the image, one of MODES.
+        folder (str): The folder where the image is saved, the current directory by default.
 
-                new_b = list(rgb)[2] + b
-                if new_b < MIN_COLOR_VALUE: new_b = MIN_COLOR_VALUE
-                elif new_b > MAX_COLOR_VALUE: new_b = MAX_COLOR_VALUE
+    Returns:
+        str: The path of the saved file.
+    """
+    file_name = os.path.join(folder, output_name(index, mode))
+    temporary = f"{file_name}.{os.getpid()}.tmp"
+    Image.fromarray(matrix).save(temporary, format="PNG" if output_extension(mode) == "png" else "JPEG")
+    os.replace(temporary, file_name)
+    return file_name
 
-            else:
-                new_r, new_g, new_b = list(rgb)
-            matrix[row][column] = [new_r, new_g, new_b]
+def output_name(index: int, mode: str = "RGB") -> str:
+    """
+    Returns the file name of a combination.
 
-    new_image = Image.fromarray(matrix)
+    Args:
+        index (int): The index of the combination.
+        mode (str): The PIL mode of the image.
 
-    new_image.save(f"combination_{index}.jpg")
+    Returns:
+        str: The file name, e.g. "combination_3.jpg".
+    """
+    return f"combination_{index}.{output_extension(mode)}"
@@ -0,0 +1,193 @@
+from threading import Lock
+import json
+import os
+
+import lazy_loader as lazy
+import numpy as np
+from PIL import Image
+
+from source.ops.pixel_cache import pixel_cache
+
+registration = lazy.load("skimage.registration", suppress_warning=True)
+
+# Images are decimated to about this many pixels per side to estimate their shift,
+# then the shift is refined on a window of this size at full resolution, on the gradients of the
+# window: plain luminance is too smooth at full resolution to tell shifts of a pixel or two apart.
+ALIGN_SIDE = 512
+# Versioned, shifts estimated without the gradient refinement could be off by a pixel and are not reused
+TRANSFORMS_NAME = "transforms-2.json"
+
+
+class TransformCache():
+    """
+    The TransformCache class remembers the transforms found by align_image, keyed by the hashes of
+    the reference and the aligned image files. It is saved next to the pixel cache, so aligning
+    the same stack again does not estimate anything.
+
+    Attributes:
+        path (str | None): The JSON file of the transforms, None to keep them in memory only.
+        transforms (dict): Key mapped to the (rows, columns) shift of the image.
+    """
+    path: str | None
+    transforms: dict
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self.transforms = {}
+        self._lock = Lock()
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as file:
+                    self.transforms = json.load(file)
+            except (OSError, json.JSONDecodeError):
+                self.transforms = {}
+
+    def get(self, key: str) -> tuple[int, int] | None:
+        with self._lock:
+            shift = self.transforms.get(key)
+        return tuple(shift) if shift is not None else None
+
+    def put(self, key: str, shift: tuple[int, int]) -> None:
+        with self._lock:
+            self.transforms[key] = [int(shift[0]), int(shift[1])]
+
+    def save(self) -> None:
+        """
+        Writes the transforms to the JSON file, if any.
+        """
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with self._lock:
+            with open(temporary, "w") as file:
+                json.dump(self.transforms, file)
+        os.replace(temporary, self.path)
+
+
+def open_resampled(file_name: str, size: tuple[int, int]) -> tuple[np.ndarray, str]:
+    """
+    Returns the pixels of the image resized to the given size. The resized pixels are kept in the
+    pixel cache like decoded ones, so strips of them are read from a memory map.
+
+    Args:
+        file_name (str): The image file.
+        size (tuple[int, int]): Width and height of the common grid.
+
+    Returns:
+        tuple[np.ndarray, str]: The pixels and the PIL mode of the image.
+    """
+    matrix, mode = pixel_cache.open_pixels(file_name)
+    if (matrix.shape[1], matrix.shape[0]) == tuple(size):
+        return matrix, mode
+
+    key = f"{pixel_cache.file_hash(file_name)}-{size[0]}x{size[1]}"
+    entry = pixel_cache.find(key) if pixel_cache.max_bytes > 0 else None
+    if entry is not None:
+        return np.load(entry[0], mmap_mode='r'), entry[1]
+
+    resized = np.asarray(Image.fromarray(np.asarray(matrix)).resize(size, Image.BILINEAR))
+    if pixel_cache.max_bytes > 0:
+        entry = pixel_cache.store(key, resized, mode)
+        if entry is not None:
+            return np.load(entry[0], mmap_mode='r'), mode
+    return resized, mode
+
+
+def luminance(matrix: np.ndarray, step: int = 1) -> np.ndarray:
+    """
+    Returns the mean of the color channels of every `step`-th pixel, minus its average,
+    as float32. Alpha is ignored.
+
+    Args:
+        matrix (np.ndarray): The pixels, (rows, columns) or (rows, columns, bands).
+        step (int): The decimation step.
+    """
+    plane = matrix[::step, ::step]
+    if plane.ndim == 3:
+        # LA images have one color channel, RGB and RGBA three
+        plane = plane[..., :1 if plane.shape[2] < 3 else 3].mean(axis=2, dtype=np.float32)
+    plane = plane.astype(np.float32)
+    return plane - plane.mean()
+
+
+def gradient_magnitude(plane: np.ndarray) -> np.ndarray:
+    """
+    Returns the magnitude of the gradient of a plane, minus its average, as float32.
+    """
+    edges = np.hypot(*np.gradient(plane)).astype(np.float32)
+    return edges - edges.mean()
+
+
+def estimate_shift(reference: np.ndarray, moving: np.ndarray) -> tuple[int, int]:
+    """
+    Estimates the translation which registers the moving image with the reference by phase
+    cross-correlation, first on decimated images, then on the gradients of a full resolution window,
+    which corrects the rounding of the decimated estimate to the decimation step.
+
+    Args:
+        reference (np.ndarray): The pixels of the reference image.
+        moving (np.ndarray): The pixels of the moving image, of any size.
+
+    Returns:
+        tuple[int, int]: The (rows, columns) shift: the pixel (y, x) of the moving image lies
+                         at (y + rows, x + columns) in the reference.
+    """
+    height, width = reference.shape[:2]
+    step = max(1, -(-max(height, width) // ALIGN_SIDE))
+
+    # Coarse estimate, the moving image is cropped or padded to the reference
+    coarse_reference = luminance(reference, step)
+    coarse_moving = np.zeros_like(coarse_reference)
+    plane = luminance(moving, step)[:coarse_reference.shape[0], :coarse_reference.shape[1]]
+    coarse_moving[:plane.shape[0], :plane.shape[1]] = plane
+    shift, _, _ = registration.phase_cross_correlation(coarse_reference, coarse_moving, normalization=None)
+    rows, columns = int(round(shift[0] * step)), int(round(shift[1] * step))
+    if step == 1:
+        return rows, columns
+
+    # Refinement on a window of the reference and the matching window of the moving image
+    side = min(ALIGN_SIDE, height, width)
+    top, left = (height - side) // 2, (width - side) // 2
+    source_top, source_left = top - rows, left - columns
+    if (
+        source_top < 0 or source_left < 0
+        or source_top + side > moving.shape[0] or source_left + side > moving.shape[1]
+    ):
+        return rows, columns
+    window = gradient_magnitude(luminance(reference[top:top + side, left:left + side]))
+    moving_window = gradient_magnitude(luminance(moving[source_top:source_top + side, source_left:source_left + side]))
+    residual, _, _ = registration.phase_cross_correlation(window, moving_window, normalization=None)
+    return rows + int(round(residual[0])), columns + int(round(residual[1]))
+
+
+def placement(shift: tuple[int, int], source_shape: tuple, top: int, bottom: int, width: int) -> tuple | None:
+    """
+    Finds where the rows [top, bottom) of the common grid are in a shifted image.
+
+    Args:
+        shift (tuple[int, int]): The (rows, columns) shift of the image, see estimate_shift.
+        source_shape (tuple): The shape of the image.
+        top (int): The first row of the strip of the grid.
+        bottom (int): The row after the last one of the strip of the grid.
+        width (int): The width of the grid.
+
+    Returns:
+        tuple | None: The slices of rows and columns of the strip and of the image, (strip rows,
+                      strip columns, image rows, image columns), or None when the image does not
+                      cover the strip.
+    """
+    rows, columns = shift
+    first, last = max(top, rows), min(bottom, source_shape[0] + rows)
+    left, right = max(0, columns), min(width, source_shape[1] + columns)
+    if first >= last or left >= right:
+        return None
+    return (
+        slice(first - top, last - top), slice(left, right),
+        slice(first - rows, last - rows), slice(left - columns, right - columns),
+    )
+
+
+transform_cache = TransformCache(
+    os.path.join(pixel_cache.directory, TRANSFORMS_NAME) if pixel_cache.max_bytes > 0 else None
+)
@@ -0,0 +1,424 @@
+from math import sqrt
+from typing import TYPE_CHECKING
+
+import lazy_loader as lazy
+import numpy as np
+from PIL import Image
+
+if TYPE_CHECKING:
+    from scipy.spatial import cKDTree
+
+# Only tolerance queries need the KD-tree and only perceptual ones need CIELAB
+spatial = lazy.load("scipy.spatial", suppress_warning=True)
+skimage_color = lazy.load("skimage.color", suppress_warning=True)
+
+# Number of unique colors converted or compared at once in the CIELAB space.
+LAB_CHUNK_SIZE = 1 << 16
+
+CUBIC = "Cubic"
+SPHERICAL = "Spherical"
+DELTA_E_76 = "ΔE76"
+DELTA_E_2000 = "ΔE2000"
+TOLERANCE_TYPES = [CUBIC, SPHERICAL, DELTA_E_76, DELTA_E_2000]
+
+# Supported image modes: number of color channels (alpha is never matched nor switched)
+# and the maximum value of a channel. 16-bit PNG files are opened as "I" by older Pillow versions.
+MODES = {
+    "L": (1, 255),
+    "LA": (1, 255),
+    "RGB": (3, 255),
+    "RGBA": (3, 255),
+    "I;16": (1, 65535),
+    "I": (1, 65535),
+}
+# Tolerance values and target colors are always given in 8-bit units.
+MAX_8BIT_VALUE = 255
+# JPEG keeps neither alpha nor 16-bit samples
+LOSSLESS_MODES = {"LA", "RGBA", "I;16", "I"}
+
+
+class ColorIndex:
+    """
+    The ColorIndex class indexes the unique colors of an image, so tolerance queries are answered
+    against the palette of the image instead of against every pixel. Matched colors are expanded
+    back to pixels through the inverse map returned by np.unique.
+
+    The index may be restricted to some pixels of the image (a region of interest), in which case
+    only their colors are indexed and only they are returned as matches.
+
+    Only the color channels of the image are indexed (see MODES): the gray level of L, LA and
+    16-bit images and the R, G and B values of RGB and RGBA images. Colors are kept in the native
+    units of the image, tolerances are given in 8-bit units and scaled to them.
+
+    Attributes:
+        shape (tuple): Height and width of the indexed image.
+        channels (int): Number of color channels.
+        max_value (int): The maximum value of a channel.
+        keys (np.ndarray): Sorted, packed values of the unique colors.
+        colors (np.ndarray): Unique colors as an array with shape (K, channels).
+        inverse (np.ndarray): Flat array mapping every indexed pixel to its row in `colors`.
+        positions (np.ndarray | None): Flat indices of the indexed pixels, None when the whole image is indexed.
+        tree (cKDTree | None): Spatial index over `colors`, built on the first RGB tolerance query.
+        lab (np.ndarray | None): CIELAB values of `colors`, computed on the first perceptual query.
+        lab_tree (cKDTree | None): Spatial index over `lab`, built on the first ΔE76 query.
+    """
+    shape: tuple
+    channels: int
+    max_value: int
+    keys: np.ndarray
+    colors: np.ndarray
+    inverse: np.ndarray
+    positions: np.ndarray | None = None
+    tree: "cKDTree | None" = None
+    lab: np.ndarray | None = None
+    lab_tree: "cKDTree | None" = None
+
+    def __init__(self, matrix: np.ndarray, mode: str = "RGB", positions: np.ndarray | None = None):
+        """
+        Builds the unique color table of the image.
+
+        Args:
+            matrix (np.ndarray): Array representing image pixel data, (rows, columns) or (rows, columns, bands).
+            mode (str): The PIL mode of the image, one of MODES.
+            positions (np.ndarray | None): Sorted flat indices of the pixels to index, None for the whole image.
+        """
+        self.shape = matrix.shape[:2]
+        self.channels, self.max_value = MODES[mode]
+        bits = self.max_value.bit_length()
+        colors = color_view(matrix, self.channels)
+        if positions is not None:
+            colors = colors[positions]
+        self.positions = positions
+        self.keys, self.inverse = np.unique(pack_colors(colors, bits), return_inverse=True)
+        self.colors = unpack_colors(self.keys, self.channels, bits)
+        self.tree = None
+        self.lab = None
+        self.lab_tree = None
+
+    def match(self, color: tuple, tolerance_type: str | None = None, tol_value: int = 0) -> np.ndarray:
+        """
+        Finds the unique colors which match the given pixel value.
+
+        Tolerances are strict, like in the per pixel version of the lookup table: a color matches
+        a cubic tolerance when every channel differs by less than `tol_value`, a spherical tolerance
+        when its euclidean distance is less than `tol_value` and the perceptual tolerances when its
+        ΔE76 or ΔE2000 color difference is less than `tol_value`.
+
+        Args:
+            color (tuple): The pixel value to look for, in the native units of the image. Alpha is ignored.
+            tolerance_type (str | None): One of TOLERANCE_TYPES or None for exact matching.
+            tol_value (int): The tolerance value in 8-bit units. Values below 1 mean exact matching.
+
+        Returns:
+            np.ndarray: Sorted indices of the matching rows in `colors`.
+        """
+        color = np.asarray(color[:self.channels], dtype=np.int64)
+        if tol_value <= 0 or tolerance_type not in TOLERANCE_TYPES:
+            return self.match_exact(color)
+        if tolerance_type == CUBIC:
+            return self.match_distance(color, tol_value, np.inf)
+        if tolerance_type == SPHERICAL:
+            return self.match_distance(color, tol_value, 2)
+        if tolerance_type == DELTA_E_76:
+            return self.match_delta_e_76(color, tol_value)
+        return self.match_delta_e_2000(color, tol_value)
+
+    def match_exact(self, color: np.ndarray) -> np.ndarray:
+        """
+        Finds the unique color equal to the given color.
+
+        Args:
+            color (np.ndarray): The color to look for.
+
+        Returns:
+            np.ndarray: Index of the matching row in `colors`, or an empty array.
+        """
+        key = pack_colors(color[np.newaxis], self.max_value.bit_length())[0]
+        position = np.searchsorted(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            return np.array([position], dtype=np.intp)
+        return np.array([], dtype=np.intp)
+
+    def match_distance(self, color: np.ndarray, tol_value: int, norm: float) -> np.ndarray:
+        """
+        Finds the unique colors within the tolerance in the native color space of the image.
+
+        As the distances between integer colors are integers (or square roots of integers),
+        the radius passed to the tree is shrunk by half a unit, which turns its inclusive bound
+        into the strict one.
+
+        Args:
+            color (np.ndarray): The color to look for.
+            tol_value (int): The tolerance value in 8-bit units.
+            norm (float): np.inf for the cubic tolerance, 2 for the spherical one.
+
+        Returns:
+            np.ndarray: Sorted indices of the matching rows in `colors`.
+        """
+        tol_value = tol_value * self.max_value // MAX_8BIT_VALUE
+        if norm == np.inf:
+            radius = tol_value - 0.5
+        else:
+            radius = sqrt(tol_value * tol_value - 0.5)
+
+        if self.tree is None:
+            self.tree = spatial.cKDTree(self.colors)
+        found = self.tree.query_ball_point(color, r=radius, p=norm, return_sorted=True)
+        return np.asarray(found, dtype=np.intp)
+
+    def match_delta_e_76(self, color: np.ndarray, tol_value: int) -> np.ndarray:
+        """
+        Finds the unique colors whose ΔE76 (euclidean distance in CIELAB) is below the tolerance.
+
+        Args:
+            color (np.ndarray): The color to look for.
+            tol_value (int): The tolerance value.
+
+        Returns:
+            np.ndarray: Sorted indices of the matching rows in `colors`.
+        """
+        lab = self.lab_colors()
+        reference = to_lab(color[np.newaxis], self.max_value)[0]
+        if self.lab_tree is None:
+            self.lab_tree = spatial.cKDTree(lab)
+        found = np.asarray(self.lab_tree.query_ball_point(reference, r=tol_value, return_sorted=True), dtype=np.intp)
+        # query_ball_point is inclusive, the tolerance is not
+        distance = np.linalg.norm(lab[found] - reference, axis=1)
+        return found[distance < tol_value]
+
+    def match_delta_e_2000(self, color: np.ndarray, tol_value: int) -> np.ndarray:
+        """
+        Finds the unique colors whose ΔE2000 color difference is below the tolerance.
+        The colors are compared in chunks of LAB_CHUNK_SIZE to bound the temporary memory.
+
+        Args:
+            color (np.ndarray): The color to look for.
+            tol_value (int): The tolerance value.
+
+        Returns:
+            np.ndarray: Sorted indices of the matching rows in `colors`.
+        """
+        lab = self.lab_colors()
+        reference = to_lab(color[np.newaxis], self.max_value)
+        found = [np.array([], dtype=np.intp)]
+        for start in range(0, len(lab), LAB_CHUNK_SIZE):
+            distance = skimage_color.deltaE_ciede2000(reference, lab[start:start + LAB_CHUNK_SIZE])
+            found.append(np.flatnonzero(distance < tol_value) + start)
+        return np.concatenate(found).astype(np.intp)
+
+    def distances(self, indices: np.ndarray, color: tuple, tolerance_type: str) -> np.ndarray:
+        """
+        Returns the distances of unique colors to the given pixel value, as measured by the tolerance type.
+        Only the given colors are measured, e.g. those found by match, so soft edges cost about as much
+        as the match itself.
+
+        Args:
+            indices (np.ndarray): Indices of rows in `colors`.
+            color (tuple): The pixel value, in the native units of the image. Alpha is ignored.
+            tolerance_type (str): One of TOLERANCE_TYPES.
+
+        Returns:
+            np.ndarray: float64 distances, in native units for the cubic and spherical tolerances
+                        and in ΔE units for the perceptual ones.
+        """
+        color = np.asarray(color[:self.channels], dtype=np.int64)
+        if len(indices) == 0:
+            return np.zeros(0, dtype=np.float64)
+        if tolerance_type == CUBIC:
+            return np.abs(self.colors[indices] - color).max(axis=1).astype(np.float64)
+        if tolerance_type == SPHERICAL:
+            return np.linalg.norm(self.colors[indices] - color, axis=1)
+        lab = self.lab_colors()[indices]
+        reference = to_lab(color[np.newaxis], self.max_value)
+        if tolerance_type == DELTA_E_76:
+            return np.linalg.norm(lab - reference, axis=1)
+        return np.concatenate([
+            skimage_color.deltaE_ciede2000(reference, lab[start:start + LAB_CHUNK_SIZE])
+            for start in range(0, len(lab), LAB_CHUNK_SIZE)
+        ])
+
+    def soft_weights(
+            self, indices: np.ndarray, color: tuple, tolerance_type: str, tol_value: int, soft_edge: int
+        ) -> np.ndarray:
+        """
+        Returns the blending weights of unique colors: 1 up to the soft edge, then falling linearly
+        to 0 at the tolerance. The soft edge is the outer `soft_edge` percent of the tolerance.
+        Without a tolerance or a soft edge every color has weight 1.
+
+        Args:
+            indices (np.ndarray): Indices of rows in `colors`, matched with the same tolerance.
+            color (tuple): The pixel value, in the native units of the image.
+            tolerance_type (str): One of TOLERANCE_TYPES.
+            tol_value (int): The tolerance value in 8-bit units.
+            soft_edge (int): The soft part of the tolerance, in percent.
+
+        Returns:
+            np.ndarray: float32 weights in (0, 1], one per index.
+        """
+        if tol_value <= 0 or soft_edge <= 0:
+            return np.ones(len(indices), dtype=np.float32)
+        if tolerance_type in (CUBIC, SPHERICAL):
+            tol_value = tol_value * self.max_value / MAX_8BIT_VALUE
+        band = tol_value * soft_edge / 100
+        weights = (tol_value - self.distances(indices, color, tolerance_type)) / band
+        return np.clip(weights, 0, 1).astype(np.float32)
+
+    def lab_colors(self) -> np.ndarray:
+        """
+        Returns the CIELAB values of the unique colors, converting them on the first call.
+        Only the palette of the image is converted, and it is converted in chunks of LAB_CHUNK_SIZE,
+        so the conversion never allocates full frame float planes.
+
+        Returns:
+            np.ndarray: Array with shape (K, 3) of L*, a* and b* values.
+        """
+        if self.lab is None:
+            self.lab = np.empty((len(self.colors), 3), dtype=np.float64)
+            for start in range(0, len(self.colors), LAB_CHUNK_SIZE):
+                self.lab[start:start + LAB_CHUNK_SIZE] = to_lab(self.colors[start:start + LAB_CHUNK_SIZE], self.max_value)
+        return self.lab
+
+    def pixels(self, indices: np.ndarray, values: np.ndarray | None = None):
+        """
+        Expands indices of unique colors to the flat indices of the pixels having those colors.
+
+        Args:
+            indices (np.ndarray): Indices of rows in `colors`.
+            values (np.ndarray | None): Values of the indexed colors, e.g. soft_weights, expanded
+                                        to their pixels too.
+
+        Returns:
+            np.ndarray | tuple: Sorted flat pixel indices (row * width + column), and the value of
+                                every pixel when values are given.
+        """
+        hit = np.zeros(len(self.colors), dtype=bool)
+        hit[indices] = True
+        found = np.flatnonzero(hit[self.inverse])
+        pixels = found if self.positions is None else self.positions[found]
+        if values is None:
+            return pixels
+        per_color = np.zeros(len(self.colors), dtype=values.dtype)
+        per_color[indices] = values
+        return pixels, per_color[self.inverse[found]]
+
+
+def color_view(matrix: np.ndarray, channels: int) -> np.ndarray:
+    """
+    Returns a view of the color channels of the image with one row per pixel.
+    The view shares memory with the matrix, so assigning to it changes the image.
+
+    Args:
+        matrix (np.ndarray): Array representing image pixel data, (rows, columns) or (rows, columns, bands).
+        channels (int): Number of color channels, see MODES.
+
+    Returns:
+        np.ndarray: Array with shape (rows * columns, channels).
+    """
+    if matrix.ndim == 2:
+        return matrix.reshape(-1, 1)
+    return matrix.reshape(-1, matrix.shape[-1])[:, :channels]
+
+
+def pack_colors(colors: np.ndarray, bits: int = 8) -> np.ndarray:
+    """
+    Packs the channels of every color into a single integer (0xRRGGBB for 8-bit RGB colors).
+    Channels are shifted one by one, so the only full size temporary is the packed plane itself.
+
+    Args:
+        colors (np.ndarray): Array with shape (N, channels).
+        bits (int): Number of bits of a channel.
+
+    Returns:
+        np.ndarray: 1D array of packed colors.
+    """
+    channels = colors.shape[1]
+    dtype = np.uint32 if bits * channels <= 32 else np.uint64
+    keys = colors[:, 0].astype(dtype)
+    for channel in range(1, channels):
+        keys <<= dtype(bits)
+        keys |= colors[:, channel].astype(dtype, copy=False)
+    return keys
+
+
+def unpack_colors(keys: np.ndarray, channels: int = 3, bits: int = 8) -> np.ndarray:
+    """
+    Reverses pack_colors.
+
+    Args:
+        keys (np.ndarray): 1D array of packed colors.
+        channels (int): Number of color channels.
+        bits (int): Number of bits of a channel.
+
+    Returns:
+        np.ndarray: Array with shape (len(keys), channels).
+    """
+    mask = (1 << bits) - 1
+    return np.stack(
+        [(keys >> ((channels - 1 - channel) * bits)) & mask for channel in range(channels)],
+        axis=1
+    ).astype(np.int64)
+
+
+def to_lab(colors: np.ndarray, max_value: int = MAX_8BIT_VALUE) -> np.ndarray:
+    """
+    Converts RGB or gray colors to CIELAB.
+
+    Args:
+        colors (np.ndarray): Array with shape (N, 3) of RGB values or (N, 1) of gray levels.
+        max_value (int): The maximum value of a channel.
+
+    Returns:
+        np.ndarray: Array with shape (N, 3) of L*, a* and b* values.
+    """
+    colors = np.asarray(colors, dtype=np.float64) / max_value
+    if colors.shape[1] == 1:
+        colors = np.repeat(colors, 3, axis=1)
+    return skimage_color.rgb2lab(colors)
+
+
+def load_matrix(image: Image.Image) -> np.ndarray:
+    """
+    Decodes the image to an array, with one plane per band. 32-bit "I" images (16-bit PNG files
+    opened by older Pillow versions) are narrowed to uint16.
+
+    Args:
+        image (Image.Image): The opened image, in one of MODES.
+
+    Returns:
+        np.ndarray: Array with shape (rows, columns) or (rows, columns, bands).
+    """
+    matrix = np.array(image)
+    if image.mode == "I":
+        matrix = np.clip(matrix, 0, 65535).astype(np.uint16)
+    return matrix
+
+
+def output_extension(mode: str) -> str:
+    """
+    Returns the file extension used to save images of the given mode.
+
+    Args:
+        mode (str): The PIL mode of the image.
+
+    Returns:
+        str: "png" for modes with alpha or 16-bit samples, "jpg" otherwise.
+    """
+    return "png" if mode in LOSSLESS_MODES else "jpg"
+
+
+def native_color(rgb: tuple, mode: str) -> tuple:
+    """
+    Converts an 8-bit RGB color (as returned by the color chooser) to the color channels of the given mode.
+    Gray levels use the same ITU-R 601-2 luma transform as PIL's convert("L").
+
+    Args:
+        rgb (tuple): The 8-bit RGB color.
+        mode (str): The PIL mode of the image, one of MODES.
+
+    Returns:
+        tuple: The color in the native units of the image.
+    """
+    channels, max_value = MODES[mode]
+    if channels == 1:
+        rgb = ((rgb[0] * 299 + rgb[1] * 587 + rgb[2] * 114) // 1000, )
+    return tuple(int(value) * max_value // MAX_8BIT_VALUE for value in rgb[:3])
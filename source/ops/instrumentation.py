@@ -0,0 +1,200 @@
+from contextlib import contextmanager
+from cProfile import Profile
+from io import StringIO
+from pstats import Stats
+from time import perf_counter, time
+import json
+import os
+import sys
+import tracemalloc
+
+# Jobs write their metrics as JSON lines to this file ("-" for the standard output) when it is set.
+METRICS_ENVIRONMENT_VARIABLE = "IMAGEINATION_METRICS"
+# Number of functions kept from the profile of a job.
+PROFILE_TOP = 15
+
+
+class Instrumentation():
+    """
+    The Instrumentation class measures the stages of a job (e.g. load, lookup, render, save) and counts
+    what they do (e.g. pixels matched, bytes written). It optionally profiles the job with cProfile and
+    traces its memory with tracemalloc. Every finished stage and the final summary can be emitted as
+    JSON lines, for headless runs.
+
+    Attributes:
+        name (str): The name of the instrumented job.
+        stages (dict): Stage name mapped to {"calls", "seconds"} and, when memory is traced, "peak_mb".
+        counters (dict): Counter name mapped to its value.
+        profile (Profile | None): The profiler, when profiling is enabled.
+        trace_memory (bool): Whether the memory of every stage is traced.
+        sink (file | None): Where JSON lines are written, None to keep the metrics in memory only.
+        summary (dict | None): The result of finish().
+    """
+    name: str
+    stages: dict
+    counters: dict
+    profile: Profile | None
+    trace_memory: bool
+    sink: object | None
+    summary: dict | None
+
+    def __init__(self, name: str, profile: bool = False, trace_memory: bool = False, sink=None):
+        """
+        Initializes the instrumentation of a job.
+
+        Args:
+            name (str): The name of the instrumented job.
+            profile (bool): Whether the job is profiled with cProfile.
+            trace_memory (bool): Whether the memory of every stage is traced with tracemalloc.
+            sink (file | None): Where JSON lines are written. By default the file named by the
+                                IMAGEINATION_METRICS environment variable, if any.
+        """
+        self.name = name
+        self.stages = {}
+        self.counters = {}
+        self.profile = Profile() if profile else None
+        self.trace_memory = trace_memory
+        self.sink = sink
+        self._close_sink = False
+        self.summary = None
+
+    def start(self) -> None:
+        """
+        Opens the default sink, starts profiling and memory tracing, if enabled.
+        Must be called in the thread running the job.
+        """
+        if self.sink is None:
+            self.sink = default_sink()
+            self._close_sink = self.sink not in (None, sys.stdout)
+        if self.profile is not None:
+            self.profile.enable()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Measures a stage. Stages with the same name are summed.
+
+        Args:
+            name (str): The name of the stage.
+        """
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+            stage['calls'] += 1
+            stage['seconds'] += seconds
+            event = {"stage": name, "seconds": seconds}
+            if self.trace_memory and tracemalloc.is_tracing():
+                peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+                stage['peak_mb'] = max(stage.get('peak_mb', 0.0), peak_mb)
+                event['peak_mb'] = peak_mb
+            self.emit(event)
+
+    def count(self, name: str, value: int = 1) -> None:
+        """
+        Adds a value to a counter.
+
+        Args:
+            name (str): The name of the counter.
+            value (int): The value to add.
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def finish(self, status: str = "") -> dict:
+        """
+        Stops profiling and memory tracing and emits the summary of the job.
+
+        Args:
+            status (str): How the job ended.
+
+        Returns:
+            dict: The summary: status, stages, counters and the top functions of the profile.
+        """
+        self.summary = {"status": status, "stages": self.stages, "counters": self.counters}
+        if self.profile is not None:
+            self.profile.disable()
+            self.summary['profile'] = top_functions(self.profile)
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.emit({"summary": self.summary})
+        if self._close_sink:
+            self.sink.close()
+        self.sink = None
+        return self.summary
+
+    def emit(self, event: dict) -> None:
+        """
+        Writes an event as a JSON line to the sink, if any.
+
+        Args:
+            event (dict): The event.
+        """
+        if self.sink is None:
+            return
+        event = {"time": time(), "job": self.name, **event}
+        self.sink.write(json.dumps(event) + "\n")
+        self.sink.flush()
+
+    def describe(self) -> str:
+        """
+        Returns a one line description of the stages and counters, displayed in the GUI.
+        The GUI polls it while the job adds stages and counters, so it reads snapshots of them.
+        """
+        parts = []
+        for name, stage in list(self.stages.items()):
+            text = f"{name} {stage['seconds']:.2f} s"
+            if stage['calls'] > 1:
+                text += f" ({stage['calls']}x)"
+            if 'peak_mb' in stage:
+                text += f", {stage['peak_mb']:.0f} MB"
+            parts.append(text)
+        for name, value in list(self.counters.items()):
+            if name == "bytes written":
+                parts.append(f"{value / 2**20:.1f} MB written")
+            else:
+                parts.append(f"{name}: {value}")
+        return " | ".join(parts)
+
+
+def default_sink():
+    """
+    Opens the file named by the IMAGEINATION_METRICS environment variable for appending.
+
+    Returns:
+        file | None: The opened file, the standard output for "-", or None when the variable is not set.
+    """
+    target = os.environ.get(METRICS_ENVIRONMENT_VARIABLE, "")
+    if target == "":
+        return None
+    if target == "-":
+        return sys.stdout
+    return open(target, "a")
+
+
+def top_functions(profile: Profile) -> list[dict]:
+    """
+    Returns the functions which took the most cumulative time.
+
+    Args:
+        profile (Profile): A disabled profiler.
+
+    Returns:
+        list[dict]: Up to PROFILE_TOP functions with their number of calls and total and cumulative time.
+    """
+    stats = Stats(profile, stream=StringIO())
+    entries = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP]
+    return [
+        {
+            "function": f"{file}:{line}({function})",
+            "calls": calls,
+            "total_seconds": total,
+            "cumulative_seconds": cumulative,
+        }
+        for (file, line, function), (_, calls, total, cumulative, _) in entries
+    ]
@@ -0,0 +1,208 @@
+from threading import Thread, Event
+from queue import Queue
+from time import perf_counter
+
+from source.ops.instrumentation import Instrumentation
+
+QUEUED = "Queued"
+RUNNING = "Running"
+DONE = "Done"
+CANCELLED = "Cancelled"
+FAILED = "Failed"
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a running job when the user cancelled it.
+    """
+
+
+class Job():
+    """
+    The Job class holds a long running operation and its progress. The operation runs in the worker thread
+    of a JobRunner and reports its progress with set_total and advance, which the GUI polls.
+
+    Attributes:
+        name (str): The name displayed in the job list.
+        function (callable): The operation, called as function(job, *args).
+        args (tuple): Arguments of the operation. They must not be Tk widgets or variables.
+        status (str): QUEUED, RUNNING, DONE, CANCELLED or FAILED.
+        done (int): Number of finished steps.
+        total (int): Number of steps, 0 while unknown.
+        pixels (int): Number of pixels processed so far.
+        started (float | None): perf_counter() value when the job started.
+        finished (float | None): perf_counter() value when the job stopped.
+        error (Exception | None): The exception which made the job fail.
+        metrics (Instrumentation): Timings and counters of the stages of the operation.
+    """
+    name: str
+    function: callable
+    args: tuple
+    status: str
+    done: int
+    total: int
+    pixels: int
+    started: float | None
+    finished: float | None
+    error: Exception | None
+    metrics: Instrumentation
+
+    def __init__(self, name: str, function: callable, args: tuple, profile: bool = False, trace_memory: bool = False, sink=None):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.status = QUEUED
+        self.done = 0
+        self.total = 0
+        self.pixels = 0
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.metrics = Instrumentation(name, profile, trace_memory, sink)
+        self._cancel = Event()
+
+    def set_total(self, total: int) -> None:
+        """
+        Sets the number of steps of the job. Called by the operation.
+        """
+        self.total = total
+
+    def advance(self, pixels: int = 0) -> None:
+        """
+        Marks one step as finished. Called by the operation between steps.
+
+        Args:
+            pixels (int): Number of pixels processed by the step.
+
+        Raises:
+            JobCancelled: When the job has been cancelled.
+        """
+        self.check()
+        self.done += 1
+        self.pixels += pixels
+
+    def check(self) -> None:
+        """
+        Stops the operation if the job has been cancelled.
+
+        Raises:
+            JobCancelled: When the job has been cancelled.
+        """
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def cancel(self) -> None:
+        """
+        Asks the job to stop. A queued job never starts, a running one stops at its next step.
+        """
+        self._cancel.set()
+        if self.status == QUEUED:
+            self.status = CANCELLED
+
+    def elapsed(self) -> float:
+        """
+        Returns the number of seconds the job has been running.
+        """
+        if self.started is None:
+            return 0.0
+        return (self.finished or perf_counter()) - self.started
+
+    def eta(self) -> float | None:
+        """
+        Returns the estimated number of seconds left, None when it cannot be estimated yet.
+        """
+        if self.status != RUNNING or self.done == 0 or self.total == 0:
+            return None
+        return self.elapsed() / self.done * (self.total - self.done)
+
+    def speed(self) -> float:
+        """
+        Returns the number of pixels processed per second.
+        """
+        elapsed = self.elapsed()
+        return self.pixels / elapsed if elapsed > 0 else 0.0
+
+    def run(self) -> None:
+        """
+        Runs the operation and records how it ended. Called by the worker thread.
+        """
+        if self._cancel.is_set():
+            self.status = CANCELLED
+            return
+
+        self.status = RUNNING
+        self.started = perf_counter()
+        self.metrics.start()
+        try:
+            self.function(self, *self.args)
+            self.status = DONE
+        except JobCancelled:
+            self.status = CANCELLED
+        except Exception as error:
+            self.error = error
+            self.status = FAILED
+        self.finished = perf_counter()
+        self.metrics.count("pixels", self.pixels)
+        self.metrics.finish(self.status)
+
+
+class JobRunner():
+    """
+    The JobRunner class runs jobs one after another in a worker thread, so the Tk main loop never blocks
+    on image generation. Jobs can be queued while another one is running.
+
+    Attributes:
+        jobs (list[Job]): Every submitted job, in order of submission.
+        queue (Queue): Jobs waiting for the worker thread.
+        worker (Thread): The worker thread.
+        profile (bool): Whether new jobs are profiled with cProfile.
+        trace_memory (bool): Whether the memory of new jobs is traced with tracemalloc.
+    """
+    jobs: list[Job]
+    queue: Queue
+    worker: Thread
+    profile: bool
+    trace_memory: bool
+
+    def __init__(self):
+        self.jobs = []
+        self.profile = False
+        self.trace_memory = False
+        self.queue = Queue()
+        self.worker = Thread(target=self.work, daemon=True)
+        self.worker.start()
+
+    def submit(self, name: str, function: callable, *args) -> Job:
+        """
+        Queues an operation.
+
+        Args:
+            name (str): The name displayed in the job list.
+            function (callable): The operation, called as function(job, *args) in the worker thread.
+            *args: Arguments of the operation.
+
+        Returns:
+            Job: The queued job.
+        """
+        job = Job(name, function, args, self.profile, self.trace_memory)
+        self.jobs.append(job)
+        self.queue.put(job)
+        return job
+
+    def work(self) -> None:
+        """
+        Main loop of the worker thread.
+        """
+        while True:
+            job = self.queue.get()
+            job.run()
+            self.queue.task_done()
+
+    def current(self) -> Job | None:
+        """
+        Returns the running job, if any.
+        """
+        for job in self.jobs:
+            if job.status == RUNNING:
+                return job
+        return None
@@ -0,0 +1,222 @@
+from hashlib import blake2b
+import json
+import os
+
+import numpy as np
+
+from source.ops.pixel_cache import hash_file
+from source.ops.sys_operators import RGB_to_hex
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+class Manifest():
+    """
+    The Manifest class records the combinations rendered into an output folder: the color mapping
+    of every combination, the file it was saved to, the hash of that file and a fingerprint of
+    everything the rendered pixels depend on (see combination_fingerprint).
+
+    The manifest is a JSON lines journal appended after every combination, so an interrupted run
+    loses at most the line being written. When a run is resumed, combinations whose fingerprint
+    is already recorded with an intact file are not rendered again. After a tolerance tweak only
+    the combinations whose matched pixels changed get a new fingerprint and are rendered.
+    Combinations rendering the same image as an earlier one share its fingerprint; they are recorded
+    as aliases of it and get a hard link to its file instead of being rendered again.
+
+    Combinations packed into a larger file (see packed_output) are recorded with their location in it,
+    e.g. the page of a multi-page TIFF, so the manifest is also the index of the packed files.
+
+    Attributes:
+        folder (str): The absolute path of the output folder.
+        path (str): The path of the manifest file.
+        entries (dict): Index of the combination mapped to its latest entry.
+        fingerprints (dict): Fingerprint mapped to the latest entry having it.
+        verified (set): Fingerprints whose files were written or checked by this run.
+    """
+    folder: str
+    path: str
+    entries: dict
+    fingerprints: dict
+    verified: set
+
+    def __init__(self, folder: str, resume: bool = False):
+        """
+        Opens the manifest of the folder.
+
+        Args:
+            folder (str): The output folder.
+            resume (bool): Whether the entries of previous runs are kept. Otherwise the manifest is started over.
+        """
+        # Entries are stored relative to the folder, paths given relative to the working directory resolve the same
+        self.folder = os.path.abspath(folder)
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self.entries = {}
+        self.fingerprints = {}
+        self.verified = set()
+
+        if resume and os.path.exists(self.path):
+            with open(self.path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Line cut by an interrupted run
+                        continue
+                    self.entries[entry['index']] = entry
+                    if entry['fingerprint'] not in self.fingerprints or 'alias_of' not in entry:
+                        self.fingerprints[entry['fingerprint']] = entry
+        self._file = open(self.path, "a" if resume else "w")
+
+    def find(self, fingerprint: str) -> dict | None:
+        """
+        Returns the entry of an already rendered combination, if its file is still intact.
+
+        Args:
+            fingerprint (str): The fingerprint of the combination.
+
+        Returns:
+            dict | None: The entry, or None when the combination must be rendered.
+        """
+        entry = self.fingerprints.get(fingerprint)
+        if entry is None or fingerprint in self.verified:
+            return entry
+
+        path = os.path.join(self.folder, entry['path'])
+        if not os.path.exists(path):
+            return None
+        if 'location' in entry:
+            # Packed files only grow, rehashing them for every combination would read them over and over
+            if os.path.getsize(path) < entry['size']:
+                return None
+        elif os.path.getsize(path) != entry['size'] or hash_file(path) != entry['hash']:
+            return None
+        self.verified.add(fingerprint)
+        return entry
+
+    def alias(self, index: int, combination: list[tuple], entry: dict, file_name: str) -> dict:
+        """
+        Records a combination which renders the same image as an already recorded one. The file of the
+        combination is made a hard link to the file of the entry; when hard links are not supported,
+        or when the entry is packed into a larger file, the alias points to the file of the entry.
+
+        Args:
+            index (int): The index of the combination.
+            combination (list[tuple]): The color transformations (RGB and original hex color).
+            entry (dict): The entry of the combination rendering the same image.
+            file_name (str): The name of the file the combination would be saved to, in the output folder.
+
+        Returns:
+            dict: The recorded entry.
+        """
+        original = os.path.join(self.folder, entry['path'])
+        if 'location' in entry:
+            return self.record(
+                index, combination, entry['fingerprint'], original, entry['hash'], entry['index'], entry['location']
+            )
+
+        target = os.path.join(self.folder, file_name)
+        if os.path.abspath(original) != os.path.abspath(target):
+            try:
+                temporary = f"{target}.{os.getpid()}.link"
+                os.link(original, temporary)
+                os.replace(temporary, target)
+            except OSError:
+                target = original
+
+        return self.record(index, combination, entry['fingerprint'], target, entry['hash'], entry['index'])
+
+    def record(
+            self, index: int, combination: list[tuple], fingerprint: str, file_name: str,
+            file_hash: str | None = None, alias_of: int | None = None, location: dict | None = None
+        ) -> dict:
+        """
+        Appends the entry of a combination to the manifest.
+
+        Args:
+            index (int): The index of the combination.
+            combination (list[tuple]): The color transformations (RGB and original hex color).
+            fingerprint (str): The fingerprint of the combination.
+            file_name (str): The path of the file holding the rendered combination, absolute or relative
+                             to the working directory.
+            file_hash (str | None): The hash of the file, computed when not given.
+            alias_of (int | None): The index of the combination this one is an alias of.
+            location (dict | None): Where the combination is in a packed file, None for a file of its own.
+
+        Returns:
+            dict: The recorded entry.
+        """
+        path = os.path.abspath(file_name)
+        entry = {
+            "index": index,
+            "mapping": {original: RGB_to_hex(rgb) for rgb, original in combination},
+            "fingerprint": fingerprint,
+            "path": os.path.relpath(path, self.folder),
+            "size": os.path.getsize(path),
+            "hash": file_hash if file_hash is not None else hash_file(path),
+        }
+        if alias_of is not None and alias_of != index:
+            entry['alias_of'] = alias_of
+        if location is not None:
+            entry['location'] = location
+        self.entries[index] = entry
+        if fingerprint not in self.fingerprints or alias_of is None:
+            self.fingerprints[fingerprint] = entry
+        self.verified.add(fingerprint)
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        return entry
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def table_digests(table: dict) -> dict:
+    """
+    Hashes the matched pixels of every original color of a lookup table.
+
+    Args:
+        table (dict): A lookup table (see make_look_up_table).
+
+    Returns:
+        dict: Original hex color mapped to the digest of its pixels, differences, keep difference flag
+              and soft weights, or to None when it matches no pixel.
+    """
+    digests = {}
+    for hex_color, (pixels, diff, keep_diff, weight, _) in table.items():
+        if len(pixels) == 0:
+            digests[hex_color] = None
+            continue
+        digest = blake2b(digest_size=16)
+        digest.update(np.ascontiguousarray(pixels, dtype='<i8'))
+        if diff is not None:
+            digest.update(np.ascontiguousarray(diff, dtype='<i8'))
+        digest.update(b"keep" if keep_diff else b"replace")
+        if weight is not None:
+            digest.update(np.ascontiguousarray(weight, dtype='<f4'))
+        digests[hex_color] = digest.hexdigest()
+    return digests
+
+
+def combination_fingerprint(source_hash: str, mode: str, digests: dict, combination: list[tuple]) -> str:
+    """
+    Fingerprints the rendering of a combination: the source image, its mode, the pixels matched by every
+    original color (which covers the tolerance and the region) and the target colors, in rendering order.
+    Original colors matching no pixel are left out, so combinations differing only by their targets
+    share a fingerprint.
+
+    Args:
+        source_hash (str): The hash of the source image file.
+        mode (str): The PIL mode of the image.
+        digests (dict): The digests of the lookup table (see table_digests).
+        combination (list[tuple]): The color transformations (RGB and original hex color).
+
+    Returns:
+        str: Hexadecimal digest.
+    """
+    digest = blake2b(digest_size=16)
+    digest.update(f"{source_hash}|{mode}".encode())
+    for rgb, original in combination:
+        if digests[original] is None:
+            continue
+        digest.update(f"|{digests[original]}>{RGB_to_hex(rgb)}".encode())
+    return digest.hexdigest()
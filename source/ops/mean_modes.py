@@ -0,0 +1,148 @@
+import os
+
+import lazy_loader as lazy
+import numpy as np
+from PIL import Image
+
+from source.ops.color_index import MODES
+
+tifffile = lazy.load("tifffile")
+
+ALPHA_MODES = {"LA", "RGBA"}
+
+
+class MeanMode():
+    """
+    The MeanMode class describes the result of a mean image over inputs of different modes (L, LA, RGB,
+    RGBA and 16-bit grayscale). The result has color channels when any input has them, alpha when any
+    input has it and 16-bit samples when any input has them.
+
+    Inputs are promoted strip by strip, never with a full frame convert(): gray strips are broadcast
+    to three channels, 8-bit samples are scaled to 16 bits by 257 and inputs without alpha count as opaque.
+    With alpha, colors are averaged weighted by alpha, so transparent pixels do not darken the result,
+    and the alpha of the result is the weighted mean of the alphas.
+
+    Attributes:
+        channels (int): Number of color channels of the result, 1 or 3.
+        alpha (bool): Whether the result has an alpha channel.
+        max_value (int): The maximum value of a sample of the result, 255 or 65535.
+    """
+    channels: int
+    alpha: bool
+    max_value: int
+
+    def __init__(self, channels: int, alpha: bool, max_value: int):
+        self.channels = channels
+        self.alpha = alpha
+        self.max_value = max_value
+
+    @classmethod
+    def promote(cls, modes) -> "MeanMode":
+        """
+        Returns the mode of the mean of images of the given PIL modes.
+
+        Args:
+            modes (iterable[str]): The PIL modes of the inputs, keys of MODES.
+        """
+        modes = set(modes)
+        channels = max(MODES[mode][0] for mode in modes)
+        max_value = max(MODES[mode][1] for mode in modes)
+        return cls(channels, bool(modes & ALPHA_MODES), max_value)
+
+    def shape(self, height: int, width: int) -> tuple:
+        """
+        Returns the shape of the result.
+        """
+        bands = self.channels + self.alpha
+        return (height, width) if bands == 1 else (height, width, bands)
+
+    def dtype(self) -> np.dtype:
+        return np.dtype(np.uint16 if self.max_value > MODES["L"][1] else np.uint8)
+
+    def accumulator_bound(self, weight_sum: int) -> int:
+        """
+        Returns the largest value summed by the accumulator: colors are multiplied by alpha as well.
+        """
+        return self.max_value * weight_sum * (self.max_value if self.alpha else 1)
+
+    def weighted(self, strip: np.ndarray, mode: str, weight: int, dtype: np.dtype) -> tuple:
+        """
+        Promotes a strip of an input to the mode of the result and weights it.
+
+        Args:
+            strip (np.ndarray): The pixels of the strip, in the mode of the input.
+            mode (str): The PIL mode of the input.
+            weight (int): The weight of the input.
+            dtype (np.dtype): The dtype of the accumulator.
+
+        Returns:
+            tuple: The weighted colors, with shape (rows, columns, channels), and the weighted alpha,
+                   with shape (rows, columns), or None when the result has no alpha.
+        """
+        channels, max_value = MODES[mode]
+        scale = dtype.type(self.max_value // max_value)
+        color = strip[..., np.newaxis] if strip.ndim == 2 else strip[..., :channels]
+        color = color.astype(dtype)
+        if scale != 1:
+            color *= scale
+        if not self.alpha:
+            return color * dtype.type(weight), None
+
+        if mode in ALPHA_MODES:
+            alpha = strip[..., -1].astype(dtype) * (scale * dtype.type(weight))
+        else:
+            alpha = np.full(strip.shape[:2], self.max_value * weight, dtype=dtype)
+        color *= alpha[..., np.newaxis]
+        return color, alpha
+
+    def finish(self, matrix: np.ndarray, alpha_sum: np.ndarray | None, coverage) -> np.ndarray:
+        """
+        Divides the sums of a strip, rounded down, and returns the strip of the result.
+
+        Args:
+            matrix (np.ndarray): The sum of the colors, with shape (rows, columns, channels).
+            alpha_sum (np.ndarray | None): The sum of the alphas, None when the result has no alpha.
+            coverage (np.ndarray | int): The sum of the weights covering every pixel.
+
+        Returns:
+            np.ndarray: The strip of the result, in the shape and dtype of the result.
+        """
+        if np.ndim(coverage) == 2:
+            coverage = np.maximum(coverage, 1)
+        if self.alpha:
+            color = np.floor_divide(matrix, np.maximum(alpha_sum, 1)[..., np.newaxis])
+            alpha = np.floor_divide(alpha_sum, coverage)
+            result = np.concatenate([color, alpha[..., np.newaxis]], axis=2)
+        else:
+            result = np.floor_divide(matrix, coverage[..., np.newaxis] if np.ndim(coverage) == 2 else coverage)
+        if result.shape[2] == 1:
+            result = result[..., 0]
+        return result.astype(self.dtype())
+
+    def save(self, matrix: np.ndarray, folder: str, name: str = "mean_image_result") -> str:
+        """
+        Saves the result in the best matching precision: JPEG for 8-bit L and RGB, PNG for 8-bit images
+        with alpha and 16-bit grayscale, and TIFF for 16-bit images with color or alpha, which Pillow
+        cannot write.
+
+        Args:
+            matrix (np.ndarray): The result.
+            folder (str): The output folder.
+            name (str): The file name without extension.
+
+        Returns:
+            str: The path of the saved file.
+        """
+        high = self.max_value > MODES["L"][1]
+        if high and (self.channels > 1 or self.alpha):
+            file_name = os.path.join(folder, f"{name}.tif")
+            tifffile.imwrite(
+                file_name, matrix, photometric="rgb" if self.channels > 1 else "minisblack",
+                planarconfig="contig", extrasamples=("unassalpha", ) if self.alpha else None, metadata=None
+            )
+            return file_name
+
+        extension = "png" if high or self.alpha else "jpg"
+        file_name = os.path.join(folder, f"{name}.{extension}")
+        Image.fromarray(matrix).save(file_name)
+        return file_name
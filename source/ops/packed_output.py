@@ -0,0 +1,346 @@
+from hashlib import blake2b
+import abc
+import os
+
+import numpy as np
+from PIL import Image
+import tifffile
+
+from source.ops.color_index import output_extension
+
+SEPARATE_FILES = "Separate files"
+CONTACT_SHEETS = "Contact sheets"
+MULTI_PAGE_TIFF = "Multi-page TIFF"
+CHUNKED_ARRAY = "Chunked array"
+OUTPUT_FORMATS = [SEPARATE_FILES, CONTACT_SHEETS, MULTI_PAGE_TIFF, CHUNKED_ARRAY]
+
+# Rendered combinations are kept in memory up to this many bytes, then written at once.
+BATCH_BYTES = 256 * 2**20
+# Maximum width and height of a contact sheet, in pixels.
+MAX_SHEET_SIDE = 16384
+
+
+class PackedWriter(abc.ABC):
+    """
+    The PackedWriter class packs rendered combinations into a few large files instead of a file per
+    combination. Combinations are buffered and every full batch is written with one sequential write,
+    then recorded in the manifest with its location in the packed file (see read_combination).
+
+    Attributes:
+        folder (str): The output folder.
+        mode (str): The PIL mode of the images.
+        manifest (Manifest): The manifest recording the combinations.
+        batch_bytes (int): Bytes of combinations buffered before they are written.
+        capacity (int): Number of combinations written at once, 0 until the first combination is added.
+        number (int): Number of the next packed file.
+        pending (list[tuple]): Index, color transformations, fingerprint and pixels of the buffered combinations.
+        aliases (list[tuple]): Index, color transformations and fingerprint of the combinations rendering
+                               the same image as a buffered one.
+    """
+    folder: str
+    mode: str
+    manifest: object
+    batch_bytes: int
+    capacity: int
+    number: int
+    pending: list[tuple]
+    aliases: list[tuple]
+
+    PREFIX: str = "packed"
+    EXTENSION: str = "bin"
+
+    def __init__(self, folder: str, mode: str, manifest, resume: bool = False, batch_bytes: int = BATCH_BYTES):
+        """
+        Initializes the writer.
+
+        Args:
+            folder (str): The output folder.
+            mode (str): The PIL mode of the images.
+            manifest (Manifest): The manifest recording the combinations.
+            resume (bool): Whether the packed files of previous runs are kept. Otherwise they are overwritten.
+            batch_bytes (int): Bytes of combinations buffered before they are written.
+        """
+        self.folder = folder
+        self.mode = mode
+        self.manifest = manifest
+        self.batch_bytes = batch_bytes
+        self.capacity = 0
+        self.number = next_file_number(folder, self.PREFIX, self.extension()) if resume else 0
+        self.pending = []
+        self.aliases = []
+        self._fingerprints = set()
+
+    def extension(self) -> str:
+        return self.EXTENSION
+
+    def batch_capacity(self, matrix: np.ndarray) -> int:
+        """
+        Returns the number of combinations written at once.
+
+        Args:
+            matrix (np.ndarray): The pixels of a combination.
+        """
+        return max(1, self.batch_bytes // matrix.nbytes)
+
+    def add(self, index: int, combination: list[tuple], fingerprint: str, matrix: np.ndarray) -> int:
+        """
+        Buffers a rendered combination and writes the batch when it is full.
+
+        Args:
+            index (int): The index of the combination.
+            combination (list[tuple]): The color transformations (RGB and original hex color).
+            fingerprint (str): The fingerprint of the combination.
+            matrix (np.ndarray): The pixels of the combination, copied since the matrix is rendered in place.
+
+        Returns:
+            int: Number of bytes written.
+        """
+        if self.capacity == 0:
+            self.capacity = self.batch_capacity(matrix)
+        self.pending.append((index, combination, fingerprint, np.array(matrix)))
+        self._fingerprints.add(fingerprint)
+        if len(self.pending) >= self.capacity:
+            return self.flush()
+        return 0
+
+    def defer(self, index: int, combination: list[tuple], fingerprint: str) -> bool:
+        """
+        Defers a combination rendering the same image as a buffered one, it is recorded as an alias
+        of it once the batch is written. The manifest cannot find buffered combinations yet.
+
+        Args:
+            index (int): The index of the combination.
+            combination (list[tuple]): The color transformations (RGB and original hex color).
+            fingerprint (str): The fingerprint of the combination.
+
+        Returns:
+            bool: Whether the combination was deferred, otherwise it must be rendered.
+        """
+        if fingerprint not in self._fingerprints:
+            return False
+        self.aliases.append((index, combination, fingerprint))
+        return True
+
+    def flush(self) -> int:
+        """
+        Writes the buffered combinations to a packed file and records them in the manifest.
+
+        Returns:
+            int: Number of bytes written.
+        """
+        if len(self.pending) == 0:
+            return 0
+
+        matrices = [matrix for _, _, _, matrix in self.pending]
+        file_name, locations, written = self.write(matrices)
+        for (index, combination, fingerprint, matrix), location in zip(self.pending, locations):
+            self.manifest.record(index, combination, fingerprint, file_name, pixel_digest(matrix), location=location)
+        for index, combination, fingerprint in self.aliases:
+            self.manifest.alias(index, combination, self.manifest.find(fingerprint), os.path.basename(file_name))
+        self.pending = []
+        self.aliases = []
+        self._fingerprints = set()
+        return written
+
+    @abc.abstractmethod
+    def write(self, matrices: list[np.ndarray]) -> tuple[str, list[dict], int]:
+        """
+        Writes a batch of combinations. Implemented by every packed format.
+
+        Args:
+            matrices (list[np.ndarray]): The pixels of the combinations.
+
+        Returns:
+            tuple[str, list[dict], int]: The written file, the location of every combination in it
+                                         and the number of bytes written.
+        """
+
+    def next_path(self) -> str:
+        """
+        Returns the path of the next packed file.
+        """
+        path = os.path.join(self.folder, f"{self.PREFIX}_{self.number}.{self.extension()}")
+        self.number += 1
+        return path
+
+    def close(self) -> int:
+        """
+        Writes the combinations left in the buffer.
+
+        Returns:
+            int: Number of bytes written.
+        """
+        return self.flush()
+
+
+class ContactSheetWriter(PackedWriter):
+    """
+    Packs combinations into contact sheets: images with the combinations laid out in a grid,
+    row after row. Locations are the number of the cell and its box in the sheet.
+    """
+    PREFIX: str = "sheet"
+
+    def extension(self) -> str:
+        return output_extension(self.mode)
+
+    def batch_capacity(self, matrix: np.ndarray) -> int:
+        height, width = matrix.shape[:2]
+        columns = max(1, MAX_SHEET_SIDE // width)
+        rows = max(1, MAX_SHEET_SIDE // height)
+        return max(1, min(columns * rows, self.batch_bytes // matrix.nbytes))
+
+    def write(self, matrices: list[np.ndarray]) -> tuple[str, list[dict], int]:
+        height, width = matrices[0].shape[:2]
+        columns = min(len(matrices), max(1, MAX_SHEET_SIDE // width))
+        rows = -(-len(matrices) // columns)
+        sheet = np.zeros((rows * height, columns * width) + matrices[0].shape[2:], dtype=matrices[0].dtype)
+
+        locations = []
+        for cell, matrix in enumerate(matrices):
+            top, left = cell // columns * height, cell % columns * width
+            sheet[top:top + height, left:left + width] = matrix
+            locations.append({"cell": cell, "box": [left, top, left + width, top + height]})
+
+        path = self.next_path()
+        temporary = f"{path}.{os.getpid()}.tmp"
+        Image.fromarray(sheet).save(temporary, format="PNG" if self.extension() == "png" else "JPEG")
+        os.replace(temporary, path)
+        return path, locations, os.path.getsize(path)
+
+
+class MultiPageTiffWriter(PackedWriter):
+    """
+    Packs the combinations of a run into a single uncompressed multi-page TIFF file, which is kept open
+    while the run lasts and appended to batch after batch. Locations are the number of the page.
+    The file is a BigTIFF, classic TIFF files cannot grow past 4 GB and runs easily write more.
+    """
+    PREFIX: str = "combinations"
+    EXTENSION: str = "tif"
+
+    def __init__(self, folder: str, mode: str, manifest, resume: bool = False, batch_bytes: int = BATCH_BYTES):
+        super().__init__(folder, mode, manifest, resume, batch_bytes)
+        self.path = self.next_path()
+        self.pages = 0
+        self._tiff = None
+
+    def write(self, matrices: list[np.ndarray]) -> tuple[str, list[dict], int]:
+        if self._tiff is None:
+            self._tiff = tifffile.TiffWriter(self.path, bigtiff=True)
+
+        photometric = "minisblack" if self.mode in ("L", "LA", "I;16") else "rgb"
+        extrasamples = ("unassalpha", ) if self.mode in ("LA", "RGBA") else None
+        start = self.pages
+        for matrix in matrices:
+            self._tiff.write(
+                matrix, photometric=photometric, planarconfig="contig", extrasamples=extrasamples, metadata=None
+            )
+            self.pages += 1
+        self._tiff.filehandle.flush()
+        return self.path, [{"page": page} for page in range(start, self.pages)], sum(m.nbytes for m in matrices)
+
+    def close(self) -> int:
+        written = self.flush()
+        if self._tiff is not None:
+            self._tiff.close()
+            self._tiff = None
+        return written
+
+
+class ChunkedArrayWriter(PackedWriter):
+    """
+    Packs combinations into .npy chunks: arrays stacking a batch of combinations along a first axis,
+    which can be opened as memory maps. Locations are the offset of the combination in the chunk.
+    """
+    PREFIX: str = "chunk"
+    EXTENSION: str = "npy"
+
+    def write(self, matrices: list[np.ndarray]) -> tuple[str, list[dict], int]:
+        path = self.next_path()
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            np.save(file, np.stack(matrices))
+        os.replace(temporary, path)
+        return path, [{"offset": offset} for offset in range(len(matrices))], os.path.getsize(path)
+
+
+WRITERS = {
+    CONTACT_SHEETS: ContactSheetWriter,
+    MULTI_PAGE_TIFF: MultiPageTiffWriter,
+    CHUNKED_ARRAY: ChunkedArrayWriter,
+}
+
+
+def open_writer(
+        output_format: str, folder: str, mode: str, manifest, resume: bool = False, batch_bytes: int = BATCH_BYTES
+    ) -> PackedWriter | None:
+    """
+    Opens the writer of a packed output format.
+
+    Args:
+        output_format (str): One of OUTPUT_FORMATS.
+        folder (str): The output folder.
+        mode (str): The PIL mode of the images.
+        manifest (Manifest): The manifest recording the combinations.
+        resume (bool): Whether the packed files of previous runs are kept.
+        batch_bytes (int): Bytes of combinations buffered before they are written.
+
+    Returns:
+        PackedWriter | None: The writer, or None when every combination is saved to a file of its own.
+    """
+    if output_format == SEPARATE_FILES:
+        return None
+    return WRITERS[output_format](folder, mode, manifest, resume, batch_bytes)
+
+
+def read_combination(folder: str, entry: dict) -> np.ndarray:
+    """
+    Reads the pixels of a combination recorded in a manifest, whether packed or not.
+
+    Args:
+        folder (str): The output folder.
+        entry (dict): The manifest entry of the combination.
+
+    Returns:
+        np.ndarray: The pixels of the combination.
+    """
+    path = os.path.join(folder, entry['path'])
+    location = entry.get('location')
+    if location is None:
+        return np.asarray(Image.open(path))
+    if 'page' in location:
+        return tifffile.imread(path, key=location['page'])
+    if 'offset' in location:
+        return np.array(np.load(path, mmap_mode='r')[location['offset']])
+    left, top, right, bottom = location['box']
+    return np.asarray(Image.open(path))[top:bottom, left:right]
+
+
+def next_file_number(folder: str, prefix: str, extension: str) -> int:
+    """
+    Returns the first number not used by the packed files of the folder.
+
+    Args:
+        folder (str): The output folder.
+        prefix (str): The prefix of the packed files.
+        extension (str): The extension of the packed files.
+    """
+    numbers = [-1]
+    if os.path.isdir(folder):
+        for entry in os.scandir(folder):
+            name, _, ext = entry.name.rpartition(".")
+            if ext == extension and name.startswith(prefix + "_") and name[len(prefix) + 1:].isdigit():
+                numbers.append(int(name[len(prefix) + 1:]))
+    return max(numbers) + 1
+
+
+def pixel_digest(matrix: np.ndarray) -> str:
+    """
+    Hashes the pixels of a combination, recorded as the hash of packed combinations.
+
+    Args:
+        matrix (np.ndarray): The pixels.
+
+    Returns:
+        str: Hexadecimal BLAKE2b digest.
+    """
+    return blake2b(np.ascontiguousarray(matrix).tobytes(), digest_size=20).hexdigest()
@@ -0,0 +1,244 @@
+from hashlib import blake2b
+from threading import Lock, get_ident
+from time import time
+import os
+
+import numpy as np
+from PIL import Image
+
+from source.ops.color_index import load_matrix
+
+CACHE_DIRECTORY_VARIABLE = "IMAGEINATION_CACHE_DIR"
+# Maximum size of the cache in megabytes, 0 disables the cache.
+CACHE_SIZE_VARIABLE = "IMAGEINATION_CACHE_SIZE"
+# Entries not used for this many days are evicted, whatever the size of the cache.
+CACHE_AGE_VARIABLE = "IMAGEINATION_CACHE_DAYS"
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".imageination", "pixels")
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_CACHE_AGE = 30
+HASH_CHUNK_SIZE = 1 << 20
+
+
+class PixelCache():
+    """
+    The PixelCache class stores decoded images as uncompressed .npy files, keyed by the hash of the
+    image file. Repeated jobs on the same image open its pixels as a memory map instead of decoding
+    the file again. The least recently used entries are evicted when the cache grows over its size,
+    or when they were not used for too long.
+
+    Attributes:
+        directory (str): The folder of the cache files.
+        max_bytes (int): The maximum size of the cache, 0 disables the cache.
+        max_age (float): Entries not used for this many seconds are evicted.
+    """
+    directory: str
+    max_bytes: int
+    max_age: float
+
+    def __init__(self, directory: str | None = None, max_bytes: int | None = None, max_age: float | None = None):
+        """
+        Initializes the cache. Settings which are not given are read from the IMAGEINATION_CACHE_DIR,
+        IMAGEINATION_CACHE_SIZE (megabytes) and IMAGEINATION_CACHE_DAYS environment variables.
+
+        Args:
+            directory (str | None): The folder of the cache files.
+            max_bytes (int | None): The maximum size of the cache, 0 disables the cache.
+            max_age (float | None): Entries not used for this many seconds are evicted.
+        """
+        if directory is None:
+            directory = os.environ.get(CACHE_DIRECTORY_VARIABLE, DEFAULT_CACHE_DIRECTORY)
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get(CACHE_SIZE_VARIABLE, DEFAULT_CACHE_SIZE)) * 2**20)
+        if max_age is None:
+            max_age = float(os.environ.get(CACHE_AGE_VARIABLE, DEFAULT_CACHE_AGE)) * 24 * 3600
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._hashes = {}
+        self._lock = Lock()
+
+    def file_hash(self, file_name: str) -> str:
+        """
+        Returns the hash of the content of the file. Hashes are remembered while the size
+        and the modification time of the file do not change.
+
+        Args:
+            file_name (str): The image file.
+
+        Returns:
+            str: Hexadecimal BLAKE2b digest of the file.
+        """
+        stat = os.stat(file_name)
+        key = (os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if key in self._hashes:
+                return self._hashes[key]
+
+        digest = hash_file(file_name)
+        with self._lock:
+            self._hashes[key] = digest
+        return digest
+
+    def open_pixels(self, file_name: str, writable: bool = False) -> tuple[np.ndarray, str]:
+        """
+        Returns the decoded pixels of the image, from the cache when possible.
+
+        The pixels are a read-only memory map of the cache file. With `writable` the map is copy-on-write:
+        changes stay private to the returned array and only the changed pages are copied into memory.
+        32-bit "I" images are narrowed to uint16 like by load_matrix, so their mode is "I;16".
+
+        Args:
+            file_name (str): The image file.
+            writable (bool): Whether the returned array may be changed.
+
+        Returns:
+            tuple[np.ndarray, str]: The pixels and the PIL mode of the image.
+        """
+        if self.max_bytes <= 0:
+            return self.decode(file_name)
+
+        file_hash = self.file_hash(file_name)
+        entry = self.find(file_hash)
+        if entry is None:
+            matrix, mode = self.decode(file_name)
+            entry = self.store(file_hash, matrix, mode)
+            if entry is None:
+                return matrix, mode
+
+        path, mode = entry
+        os.utime(path)
+        return np.load(path, mmap_mode='c' if writable else 'r'), mode
+
+    def open_image(self, file_name: str) -> Image.Image:
+        """
+        Returns the image built from its cached pixels, e.g. for the preview pop-up.
+
+        Args:
+            file_name (str): The image file.
+
+        Returns:
+            Image.Image: The image.
+        """
+        matrix, mode = self.open_pixels(file_name)
+        return Image.fromarray(np.asarray(matrix))
+
+    def decode(self, file_name: str) -> tuple[np.ndarray, str]:
+        """
+        Decodes the image file.
+
+        Args:
+            file_name (str): The image file.
+
+        Returns:
+            tuple[np.ndarray, str]: The pixels and the PIL mode of the image.
+        """
+        image = Image.open(file_name)
+        mode = "I;16" if image.mode == "I" else image.mode
+        return load_matrix(image), mode
+
+    def find(self, file_hash: str) -> tuple[str, str] | None:
+        """
+        Looks for the cache file of an image.
+
+        Args:
+            file_hash (str): The hash of the image file.
+
+        Returns:
+            tuple[str, str] | None: The path of the cache file and the mode of the image, or None.
+        """
+        if not os.path.isdir(self.directory):
+            return None
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(file_hash + ".") and entry.name.endswith(".npy"):
+                mode = entry.name[len(file_hash) + 1:-len(".npy")].replace("_", ";")
+                return entry.path, mode
+        return None
+
+    def store(self, file_hash: str, matrix: np.ndarray, mode: str) -> tuple[str, str] | None:
+        """
+        Writes the pixels of an image to the cache, then evicts old entries.
+
+        Args:
+            file_hash (str): The hash of the image file.
+            matrix (np.ndarray): The decoded pixels.
+            mode (str): The PIL mode of the image.
+
+        Returns:
+            tuple[str, str] | None: The path of the cache file and the mode of the image,
+                                    or None when the image is bigger than the whole cache.
+        """
+        if matrix.nbytes > self.max_bytes:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{file_hash}.{mode.replace(';', '_')}.npy")
+        temporary = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+        with open(temporary, "wb") as file:
+            np.save(file, matrix)
+        os.replace(temporary, path)
+
+        self.evict(keep=path)
+        return path, mode
+
+    def evict(self, keep: str | None = None) -> None:
+        """
+        Removes the entries not used for longer than max_age, then the least recently used entries
+        until the cache fits in max_bytes.
+
+        Args:
+            keep (str | None): A cache file which must not be removed.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy") and entry.path != keep:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        if keep is not None:
+            total += os.path.getsize(keep)
+        now = time()
+        for used, size, path in entries:
+            if total <= self.max_bytes and now - used <= self.max_age:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                # Still mapped by another job on Windows
+                pass
+
+    def clear(self) -> None:
+        """
+        Removes every entry of the cache.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy"):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+
+def hash_file(file_name: str) -> str:
+    """
+    Hashes the content of a file.
+
+    Args:
+        file_name (str): The file.
+
+    Returns:
+        str: Hexadecimal BLAKE2b digest of the file.
+    """
+    digest = blake2b(digest_size=20)
+    with open(file_name, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+pixel_cache = PixelCache()
@@ -0,0 +1,179 @@
+from random import Random
+from typing import Iterator
+import sys
+
+import numpy as np
+
+ALL_COMBINATIONS = "All combinations"
+RANDOM_SAMPLE = "Random sample"
+STRATIFIED_SAMPLE = "Stratified sample"
+INDEX_RANGE = "Index range"
+SAMPLING_MODES = [ALL_COMBINATIONS, RANDOM_SAMPLE, STRATIFIED_SAMPLE, INDEX_RANGE]
+
+
+def prune_table(table: dict, order: list[str], pixel_count: int) -> dict:
+    """
+    Removes from every original color of a lookup table the pixels which are overwritten by the original
+    colors switched after it. Combinations are applied in order, so when matches overlap the last color wins.
+    Pixels of soft matches, blended with a weight below one, do not hide the colors before them.
+
+    After pruning, an original color without pixels (matching nothing, or fully shadowed by the colors
+    after it) has no effect on the rendered image, whatever its target color. Combinations differing only
+    by the targets of such colors render identical images (see combination_fingerprint).
+
+    Args:
+        table (dict): A lookup table (see make_look_up_table).
+        order (list[str]): Original hex colors in the order they are applied.
+        pixel_count (int): Number of pixels of the image.
+
+    Returns:
+        dict: The lookup table with only the pixels each original color really changes.
+    """
+    covered = np.zeros(pixel_count, dtype=bool)
+    pruned = {}
+    for hex_color in reversed(order):
+        pixels, diff, keep_diff, weight, base = table[hex_color]
+        visible = ~covered[pixels]
+        covered[pixels if weight is None else pixels[weight >= 1]] = True
+        if not visible.all():
+            pixels = pixels[visible]
+            diff = diff[visible] if diff is not None else None
+            weight = weight[visible] if weight is not None else None
+            base = base[visible] if base is not None else None
+        pruned[hex_color] = (pixels, diff, keep_diff, weight, base)
+    return {hex_color: pruned[hex_color] for hex_color in order}
+
+
+def idle_colors(table: dict) -> list[str]:
+    """
+    Returns the original colors which change no pixel of a pruned lookup table.
+
+    Args:
+        table (dict): A lookup table pruned by prune_table.
+
+    Returns:
+        list[str]: The hex colors whose target color does not matter.
+    """
+    return [hex_color for hex_color, (pixels, *_) in table.items() if len(pixels) == 0]
+
+
+def combination_count(choices: list[list]) -> int:
+    """
+    Returns the number of combinations of the product of the choices.
+
+    Args:
+        choices (list[list]): The color transformations of every original color.
+
+    Returns:
+        int: The size of the product, as a Python integer (it may not fit in 64 bits).
+    """
+    total = 1
+    for options in choices:
+        total *= len(options)
+    return total
+
+
+def decode_index(index: int, radices: list[int]) -> list[int]:
+    """
+    Decodes the index of a combination into the index of the option taken for every original color.
+    Indices are mixed-radix numbers whose last digit varies the fastest, so they follow the order
+    of itertools.product and combination_{index} names the same file whether sampled or not.
+
+    Args:
+        index (int): The index of the combination.
+        radices (list[int]): The number of options of every original color.
+
+    Returns:
+        list[int]: The digit of every original color.
+    """
+    digits = [0] * len(radices)
+    for position in range(len(radices) - 1, -1, -1):
+        index, digits[position] = divmod(index, radices[position])
+    return digits
+
+
+def sample_indices(total: int, sampling=None) -> Iterator[int]:
+    """
+    Yields the indices of the combinations to render, in increasing order. Memory use depends on the
+    size of the sample only, never on the number of combinations.
+
+    Args:
+        total (int): The number of combinations.
+        sampling (SamplingSettings | None): How the combinations are sampled, None for all of them.
+
+    Yields:
+        int: The index of a combination.
+    """
+    mode = ALL_COMBINATIONS if sampling is None else sampling.mode
+    if mode == ALL_COMBINATIONS:
+        yield from range(total)
+        return
+
+    if mode == INDEX_RANGE:
+        yield from range(max(sampling.start, 0), min(sampling.stop, total))
+        return
+
+    random = Random(sampling.seed)
+    count = min(sampling.count, total)
+    if mode == RANDOM_SAMPLE:
+        yield from sorted(sample_range(random, total, count))
+    elif mode == STRATIFIED_SAMPLE:
+        # One combination drawn from every one of `count` equal slices of the index space
+        for stratum in range(count):
+            yield random.randrange(total * stratum // count, total * (stratum + 1) // count)
+    else:
+        raise ValueError(f"Unknown sampling mode: {mode}")
+
+
+def sample_range(random: Random, total: int, count: int) -> set[int]:
+    """
+    Draws `count` distinct indices from range(total) without materializing the range.
+
+    Random.sample needs len() of the range, which fails from sys.maxsize on. Larger index spaces are
+    sampled with Floyd's algorithm, in O(count) time and memory. Smaller ones keep using Random.sample,
+    so a seed keeps drawing the same combinations as before.
+
+    Args:
+        random (Random): The seeded generator.
+        total (int): The number of indices.
+        count (int): The number of indices to draw, at most total.
+
+    Returns:
+        set[int]: The drawn indices.
+    """
+    if total <= sys.maxsize:
+        return set(random.sample(range(total), count))
+    selected = set()
+    for upper in range(total - count, total):
+        index = random.randrange(upper + 1)
+        selected.add(upper if index in selected else index)
+    return selected
+
+
+def plan_combinations(choices: list[list], sampling=None) -> tuple[int, Iterator[tuple[int, list]]]:
+    """
+    Plans the combinations to render without building the product of the choices.
+
+    Args:
+        choices (list[list]): The color transformations (RGB and original hex color) of every original color.
+        sampling (SamplingSettings | None): How the combinations are sampled, None for all of them.
+
+    Returns:
+        tuple[int, Iterator[tuple[int, list]]]: The number of planned combinations and an iterator
+                                                of their indices and color transformations.
+    """
+    total = combination_count(choices)
+    indices = sample_indices(total, sampling)
+    if sampling is None or sampling.mode == ALL_COMBINATIONS:
+        planned = total
+    elif sampling.mode == INDEX_RANGE:
+        planned = max(min(sampling.stop, total) - max(sampling.start, 0), 0)
+    else:
+        planned = min(sampling.count, total)
+
+    radices = [len(options) for options in choices]
+    combinations = (
+        (index, [options[digit] for options, digit in zip(choices, decode_index(index, radices))])
+        for index in indices
+    )
+    return planned, combinations
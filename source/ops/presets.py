@@ -0,0 +1,303 @@
+from hashlib import blake2b
+import base64
+import json
+import os
+
+import numpy as np
+
+from source.data.SwitchSettings import SwitchSettings
+from source.data.SamplingSettings import SamplingSettings
+from source.data.RegionData import RegionData
+from source.data.SwitchPreset import SwitchPreset
+from source.ops.color_index import MODES, MAX_8BIT_VALUE
+from source.ops.pixel_cache import pixel_cache
+
+PRESET_VERSION = 1
+PRESET_EXTENSION = ".json"
+# Masks are stored in the pixel cache like decoded images, under this mode
+MASK_MODE = "mask"
+
+
+class MatchPlan():
+    """
+    The MatchPlan class is the compiled matching of a color switch job: for every original color its
+    source color, distance metric, threshold, soft edge, feather and keep difference flag, hashed together
+    with the region of interest into a digest.
+
+    The pixels matched by an original color (its mask) only depend on the image and on this digest, so
+    masks are kept in the pixel cache keyed by the hash of the image and the digest. Running a preset
+    again on the same image reads its lookup table instead of matching the colors, and presets sharing
+    an original color with the same settings share its mask.
+
+    Attributes:
+        entries (list[dict]): For every original color its hex, source, metric (None without tolerance),
+                              threshold, soft_edge, feather, keep_difference and digest.
+    """
+    entries: list[dict]
+
+    def __init__(self, entries: list[dict]):
+        self.entries = entries
+
+    @classmethod
+    def compile(cls, settings: list[SwitchSettings], region: RegionData | None = None) -> "MatchPlan":
+        """
+        Compiles the matching of the switch settings.
+
+        Args:
+            settings (list[SwitchSettings]): Snapshots of the switch data.
+            region (RegionData | None): The region of interest, None for the whole image.
+        """
+        region_hash = region_digest(region)
+        entries = []
+        for item in settings:
+            entry = {
+                "hex": item.hex_color,
+                "source": [int(value) for value in item.rgb_color],
+                "metric": item.tolerance_type if item.use_tolerance else None,
+                "threshold": int(item.tolerance_value) if item.use_tolerance else 0,
+                "soft_edge": int(item.soft_edge) if item.is_soft() else 0,
+                "feather": float(item.feather) if item.is_soft() else 0.0,
+                "keep_difference": bool(item.keep_difference),
+            }
+            digest = blake2b(digest_size=16)
+            digest.update(json.dumps(entry, sort_keys=True).encode())
+            digest.update(region_hash.encode())
+            entry["digest"] = digest.hexdigest()
+            entries.append(entry)
+        return cls(entries)
+
+    def load(self, image_hash: str, plan=None) -> dict:
+        """
+        Reads the cached masks of the image.
+
+        Args:
+            image_hash (str): The hash of the image file.
+            plan (MemoryPlan | None): The dtypes of the table, see scheduler.plan_switch.
+
+        Returns:
+            dict: The part of the lookup table (see make_look_up_table) found in the cache.
+        """
+        table = {}
+        if pixel_cache.max_bytes <= 0:
+            return table
+        for entry in self.entries:
+            found = pixel_cache.find(mask_key(image_hash, entry))
+            if found is None:
+                continue
+            os.utime(found[0])
+            stacked = np.load(found[0])
+            pixels = stacked[:, 0].astype(np.intp if plan is None else plan.index_dtype)
+            diff = weight = base = None
+            if entry.get("soft_edge", 0) > 0 or entry.get("feather", 0) > 0:
+                weight_found = pixel_cache.find(weight_key(image_hash, entry))
+                if weight_found is None:
+                    continue
+                os.utime(weight_found[0])
+                # No weights are stored when every pixel is fully switched
+                weight = np.load(weight_found[0])
+                weight = weight if len(weight) else None
+            channels = (stacked.shape[1] - 1) // max(entry['keep_difference'] + (weight is not None), 1)
+            if entry['keep_difference']:
+                diff = stacked[:, 1:1 + channels]
+                if plan is not None:
+                    diff = diff.astype(plan.diff_dtype)
+            if weight is not None:
+                base = stacked[:, -channels:]
+                if plan is not None:
+                    base = base.astype(plan.diff_dtype)
+            table[entry['hex']] = (pixels, diff, entry['keep_difference'], weight, base)
+        return table
+
+    def store(self, image_hash: str, table: dict) -> None:
+        """
+        Writes the masks of a lookup table to the cache. Pixels, differences and the original colors of
+        soft matches are stored as the columns of one array, the weights of soft matches as another one.
+
+        Args:
+            image_hash (str): The hash of the image file.
+            table (dict): A lookup table (see make_look_up_table), possibly of some of the colors only.
+        """
+        if pixel_cache.max_bytes <= 0:
+            return
+        for entry in self.entries:
+            if entry['hex'] not in table:
+                continue
+            pixels, diff, _, weight, base = table[entry['hex']]
+            columns = [np.asarray(pixels, dtype=np.int64)[:, np.newaxis]]
+            if diff is not None:
+                columns.append(np.asarray(diff, dtype=np.int64))
+            if base is not None:
+                columns.append(np.asarray(base, dtype=np.int64))
+            if entry['soft_edge'] > 0 or entry['feather'] > 0:
+                stored = np.zeros(0, dtype=np.float32) if weight is None else weight
+                pixel_cache.store(weight_key(image_hash, entry), stored, MASK_MODE)
+            pixel_cache.store(mask_key(image_hash, entry), np.concatenate(columns, axis=1), MASK_MODE)
+
+
+def mask_key(image_hash: str, entry: dict) -> str:
+    """
+    Returns the pixel cache key of the mask of an original color in an image.
+    """
+    return f"{image_hash}-{entry['digest']}"
+
+
+def weight_key(image_hash: str, entry: dict) -> str:
+    """
+    Returns the pixel cache key of the weights of a soft match of an original color in an image.
+    """
+    return f"{mask_key(image_hash, entry)}-weight"
+
+
+def region_digest(region: RegionData | None) -> str:
+    """
+    Hashes the pixels selected by a region of interest.
+
+    Args:
+        region (RegionData | None): The region, None for the whole image.
+
+    Returns:
+        str: Hexadecimal BLAKE2b digest, empty for the whole image.
+    """
+    if region is None:
+        return ""
+    digest = blake2b(digest_size=16)
+    digest.update(json.dumps([region.box, region.size]).encode())
+    if region.mask is not None:
+        digest.update(np.packbits(region.mask).tobytes())
+        digest.update(str(region.mask.shape).encode())
+    return digest.hexdigest()
+
+
+def save_preset(preset: SwitchPreset, file_name: str) -> None:
+    """
+    Saves the preset as JSON, with its compiled match plan. The plan names the cached masks of the preset,
+    it is compiled again when the preset is loaded, so an edited file never refers to wrong masks.
+    The file is written under a temporary name and moved into place.
+
+    Args:
+        preset (SwitchPreset): The preset.
+        file_name (str): The JSON file.
+    """
+    switches = []
+    for item in preset.settings:
+        switches.append({
+            "source": [int(value) for value in item.rgb_color],
+            "hex": item.hex_color,
+            "targets": [[int(value) for value in color] for color in item.color_list],
+            "use_tolerance": bool(item.use_tolerance),
+            "tolerance_type": item.tolerance_type,
+            "tolerance_value": int(item.tolerance_value),
+            "soft_edge": int(item.soft_edge),
+            "feather": float(item.feather),
+            "keep_difference": bool(item.keep_difference),
+        })
+
+    content = {
+        "version": PRESET_VERSION,
+        "name": preset.name,
+        "switches": switches,
+        "plan": MatchPlan.compile(preset.settings, preset.region).entries,
+        "region": region_to_dict(preset.region),
+        "sampling": None if preset.sampling is None else dict(vars(preset.sampling)),
+        "output_format": preset.output_format,
+        "mode": preset.mode,
+        "bit_depth": None if preset.mode is None else bit_depth(preset.mode),
+    }
+    temporary = f"{file_name}.{os.getpid()}.tmp"
+    with open(temporary, "w") as file:
+        json.dump(content, file, indent=2)
+    os.replace(temporary, file_name)
+
+
+def load_preset(file_name: str) -> SwitchPreset:
+    """
+    Loads a preset saved by save_preset.
+
+    Args:
+        file_name (str): The JSON file.
+
+    Returns:
+        SwitchPreset: The preset.
+
+    Raises:
+        ValueError: If the file is not a preset, or is made for an unknown image mode.
+    """
+    try:
+        with open(file_name) as file:
+            content = json.load(file)
+        settings = [
+            SwitchSettings(
+                switch['source'], switch['hex'], switch['targets'], switch['use_tolerance'],
+                switch['tolerance_type'], switch['tolerance_value'], switch['keep_difference'],
+                switch.get("soft_edge", 0), switch.get("feather", 0)
+            )
+            for switch in content['switches']
+        ]
+        sampling = content.get("sampling")
+        mode = content.get("mode")
+        if mode is not None and (mode not in MODES or content.get("bit_depth", bit_depth(mode)) != bit_depth(mode)):
+            raise ValueError(f"{file_name} has an unknown image mode {mode}")
+        return SwitchPreset(
+            content.get("name") or os.path.splitext(os.path.basename(file_name))[0], settings,
+            region_from_dict(content.get("region")), None if sampling is None else SamplingSettings(**sampling),
+            content.get("output_format"), mode
+        )
+    except (OSError, UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError) as error:
+        raise ValueError(f"{file_name} is not a preset: {error}") from error
+
+
+def bit_depth(mode: str) -> int:
+    """
+    Returns the number of bits of a sample of the given PIL mode, 8 or 16.
+    """
+    return 16 if MODES[mode][1] > MAX_8BIT_VALUE else 8
+
+
+def check_mode(preset_mode: str | None, mode: str) -> None:
+    """
+    Checks that original colors picked from an image of one mode can be matched in an image of another.
+    Colors are kept in the native units of the image, so the color channels and the bit depth must be
+    the same; alpha is not matched and may differ.
+
+    Args:
+        preset_mode (str | None): The PIL mode the colors were picked from, None when unknown.
+        mode (str): The PIL mode of the image to switch.
+
+    Raises:
+        ValueError: If the colors cannot be matched in the image.
+    """
+    if preset_mode is None or MODES[preset_mode] == MODES[mode]:
+        return
+    kind = {1: "gray", 3: "color"}
+    raise ValueError(
+        f"The colors were picked from {bit_depth(preset_mode)}-bit {kind[MODES[preset_mode][0]]} pixels ({preset_mode}), "
+        f"they cannot be matched in {bit_depth(mode)}-bit {kind[MODES[mode][0]]} pixels ({mode})."
+    )
+
+
+def region_to_dict(region: RegionData | None) -> dict | None:
+    """
+    Returns the region as a JSON object, its mask packed in bits and encoded in base64.
+    """
+    if region is None:
+        return None
+    content = {"kind": region.kind, "box": list(region.box), "size": None if region.size is None else list(region.size)}
+    if region.mask is not None:
+        content["mask_shape"] = list(region.mask.shape)
+        content["mask"] = base64.b64encode(np.packbits(region.mask).tobytes()).decode("ascii")
+    return content
+
+
+def region_from_dict(content: dict | None) -> RegionData | None:
+    """
+    Returns the region of a JSON object made by region_to_dict.
+    """
+    if content is None:
+        return None
+    mask = None
+    if "mask" in content:
+        shape = tuple(content['mask_shape'])
+        bits = np.frombuffer(base64.b64decode(content['mask']), dtype=np.uint8)
+        mask = np.unpackbits(bits, count=int(np.prod(shape))).astype(bool).reshape(shape)
+    size = None if content.get("size") is None else tuple(content['size'])
+    return RegionData(content['kind'], content['box'], mask, size)
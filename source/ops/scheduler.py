@@ -0,0 +1,238 @@
+from math import gamma, pi
+import os
+
+import numpy as np
+
+from source.ops.color_index import MODES, CUBIC, MAX_8BIT_VALUE
+from source.ops.mean_modes import MeanMode
+
+# Memory budget of a job in megabytes. By default half of the physical memory.
+MEMORY_BUDGET_VARIABLE = "IMAGEINATION_MEMORY_BUDGET"
+DEFAULT_MEMORY_BUDGET = 2048
+DEFAULT_MEMORY_FRACTION = 0.5
+
+# Bytes per pixel while the unique colors of a strip are indexed: packed key, its sorted copy,
+# the sort permutation, the inverse map and the positions of the pixels (see ColorIndex).
+INDEX_BYTES_PER_PIXEL = 40
+# Matched pixels are estimated assuming colors spread evenly, which real images do not do.
+MATCH_SAFETY_FACTOR = 4
+# Strips are not made thinner than this while workers can be dropped instead.
+MIN_STRIP_ROWS = 64
+# Bytes per channel of a decoded image, by PIL mode.
+SAMPLE_BYTES = {"I;16": 2, "I": 2}
+
+
+class MemoryPlan():
+    """
+    The MemoryPlan class tells how a job fits its memory budget: in how many strips of rows the image
+    is processed, by how many workers and with which dtypes.
+
+    Attributes:
+        budget (int): The memory budget in bytes.
+        estimate (int): The estimated peak memory of the job in bytes.
+        strip_rows (int): Number of rows processed at once.
+        strips (int): Number of strips, 1 when the whole image is processed at once.
+        workers (int): Number of images loaded in parallel.
+        index_dtype (np.dtype): The dtype of the flat pixel indices of the lookup table.
+        diff_dtype (np.dtype): The dtype of the kept color differences of the lookup table.
+        accumulator_dtype (np.dtype): The dtype of the sum of weighted images.
+        batch_bytes (int): Bytes of rendered combinations buffered by packed outputs.
+        fits (bool): Whether the estimate fits the budget. Jobs which do not fit run with the smallest strips.
+    """
+    budget: int
+    estimate: int
+    strip_rows: int
+    strips: int
+    workers: int
+    index_dtype: np.dtype
+    diff_dtype: np.dtype
+    accumulator_dtype: np.dtype
+    batch_bytes: int
+    fits: bool
+
+    def __init__(
+            self, budget: int, estimate: int, height: int, strip_rows: int, workers: int = 1,
+            index_dtype=np.intp, diff_dtype=np.int64, accumulator_dtype=np.int64, batch_bytes: int = 0
+        ):
+        self.budget = budget
+        self.estimate = estimate
+        self.strip_rows = max(1, min(strip_rows, height))
+        self.strips = -(-height // self.strip_rows) if height > 0 else 1
+        self.workers = workers
+        self.index_dtype = np.dtype(index_dtype)
+        self.diff_dtype = np.dtype(diff_dtype)
+        self.accumulator_dtype = np.dtype(accumulator_dtype)
+        self.batch_bytes = batch_bytes
+        self.fits = estimate <= budget
+
+    def split(self) -> "MemoryPlan":
+        """
+        Returns the plan with strips half as high, used when a stage runs out of memory anyway.
+
+        Raises:
+            MemoryError: When strips are a single row already.
+        """
+        if self.strip_rows <= 1:
+            raise MemoryError("Not enough memory to process a single row.")
+        height = self.strip_rows * self.strips
+        return MemoryPlan(
+            self.budget, self.estimate, height, self.strip_rows // 2, self.workers,
+            self.index_dtype, self.diff_dtype, self.accumulator_dtype, self.batch_bytes
+        )
+
+    def rows(self, height: int):
+        """
+        Yields the first and last (excluded) row of every strip.
+
+        Args:
+            height (int): Number of rows of the image.
+        """
+        for top in range(0, height, self.strip_rows):
+            yield top, min(top + self.strip_rows, height)
+
+    def describe(self) -> dict:
+        """
+        Returns the plan as a dictionary, emitted with the metrics of the job.
+        """
+        return {
+            "budget_mb": self.budget / 2**20,
+            "estimate_mb": self.estimate / 2**20,
+            "strip_rows": self.strip_rows,
+            "strips": self.strips,
+            "workers": self.workers,
+            "index_dtype": self.index_dtype.name,
+            "diff_dtype": self.diff_dtype.name,
+            "accumulator_dtype": self.accumulator_dtype.name,
+            "batch_mb": self.batch_bytes / 2**20,
+            "fits": self.fits,
+        }
+
+
+def memory_budget() -> int:
+    """
+    Returns the memory budget of a job: IMAGEINATION_MEMORY_BUDGET megabytes when set, otherwise
+    half of the physical memory, or DEFAULT_MEMORY_BUDGET megabytes when it cannot be read.
+
+    Returns:
+        int: The budget in bytes.
+    """
+    if MEMORY_BUDGET_VARIABLE in os.environ:
+        return int(float(os.environ[MEMORY_BUDGET_VARIABLE]) * 2**20)
+    try:
+        return int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") * DEFAULT_MEMORY_FRACTION)
+    except (AttributeError, ValueError, OSError):
+        # os.sysconf is not available on Windows
+        return DEFAULT_MEMORY_BUDGET * 2**20
+
+
+def match_fraction(settings: list, channels: int) -> float:
+    """
+    Estimates the fraction of the pixels matched by the original colors, from the volume of their
+    tolerance in the color space. Perceptual tolerances are counted like spherical ones.
+
+    Args:
+        settings (list[SwitchSettings]): The switch settings.
+        channels (int): Number of color channels.
+
+    Returns:
+        float: The estimated fraction, at most 1 per original color.
+    """
+    total = 0.0
+    for item in settings:
+        tolerance = item.tolerance_value if item.use_tolerance else 0
+        if tolerance <= 0:
+            volume = 1
+        elif item.tolerance_type == CUBIC:
+            volume = (2 * tolerance - 1) ** channels
+        else:
+            volume = pi ** (channels / 2) / gamma(channels / 2 + 1) * tolerance ** channels
+        total += min(1.0, volume * MATCH_SAFETY_FACTOR / (MAX_8BIT_VALUE + 1) ** channels)
+    return total
+
+
+def plan_switch(shape: tuple, mode: str, settings: list, budget: int | None = None) -> MemoryPlan:
+    """
+    Plans a switch colors job. The image and the lookup table must fit in memory; the unique colors
+    are indexed in strips of rows when indexing the whole image at once would not fit. A region of
+    interest is not taken into account, the estimate is for the whole image.
+
+    Args:
+        shape (tuple): The shape of the pixel array of the image.
+        mode (str): The PIL mode of the image.
+        settings (list[SwitchSettings]): The switch settings.
+        budget (int | None): The memory budget in bytes, see memory_budget by default.
+
+    Returns:
+        MemoryPlan: The plan.
+    """
+    budget = memory_budget() if budget is None else budget
+    height, width = shape[:2]
+    pixels = height * width
+    channels, max_value = MODES[mode]
+
+    index_dtype = np.int32 if pixels < 2**31 else np.int64
+    diff_dtype = np.int16 if max_value <= MAX_8BIT_VALUE else np.int32
+    frame = pixels * int(np.prod(shape[2:])) * SAMPLE_BYTES.get(mode, 1)
+    matched = int(pixels * match_fraction(settings, channels))
+    diff = np.dtype(diff_dtype).itemsize * channels if any(item.keep_difference for item in settings) else 0
+    table = matched * (np.dtype(index_dtype).itemsize + diff)
+    # Soft matches keep a float32 weight and the original colors of their pixels, feathers blur float planes
+    if any(item.is_soft() for item in settings):
+        table += matched * (4 + frame // max(pixels, 1))
+    feather = 8 * pixels if any(item.is_soft() and item.feather > 0 for item in settings) else 0
+
+    # The image is rendered in place and copied once more when it is encoded
+    fixed = 2 * frame + table + feather
+    index_row = width * (INDEX_BYTES_PER_PIXEL + channels * 8)
+    strip_rows = (budget - fixed) // max(index_row, 1)
+    strip_rows = max(1, min(strip_rows, height))
+    batch_bytes = max(frame, budget - fixed - strip_rows * index_row)
+    estimate = fixed + strip_rows * index_row
+    return MemoryPlan(
+        budget, estimate, height, strip_rows,
+        index_dtype=index_dtype, diff_dtype=diff_dtype, batch_bytes=batch_bytes
+    )
+
+
+def plan_mean(mean_data: dict, shape: tuple, cached: bool = True, budget: int | None = None) -> MemoryPlan:
+    """
+    Plans a mean image job. Weighted images are summed strip by strip, several images at once.
+    Workers are kept as long as strips stay at least MIN_STRIP_ROWS high.
+
+    Args:
+        mean_data (dict): File name mapped to its weight, height, width and mode.
+        shape (tuple): The shape of the result.
+        cached (bool): Whether images are read from memory maps of the pixel cache. Otherwise every
+                       worker decodes a whole image for every strip.
+        budget (int | None): The memory budget in bytes, see memory_budget by default.
+
+    Returns:
+        MemoryPlan: The plan.
+    """
+    budget = memory_budget() if budget is None else budget
+    height, width = shape[:2]
+    samples = width * int(np.prod(shape[2:]))
+    sample_bytes = max(SAMPLE_BYTES.get(item['mode'], 1) for item in mean_data.values())
+    # Colors are weighted by alpha too when any image has it, see MeanMode
+    mean_mode = MeanMode.promote(item['mode'] for item in mean_data.values())
+
+    weight_sum = sum(item['weight'] for item in mean_data.values())
+    accumulator_dtype = np.uint32 if mean_mode.accumulator_bound(weight_sum) < 2**32 else np.int64
+    accumulator = np.dtype(accumulator_dtype).itemsize
+
+    def row_bytes(workers: int) -> int:
+        # Sum and result, then for every worker a strip of the image and its weighted copy
+        return samples * (accumulator + sample_bytes + workers * (sample_bytes + accumulator))
+
+    def fixed_bytes(workers: int) -> int:
+        return 0 if cached else workers * height * samples * sample_bytes
+
+    workers = max(1, min(os.cpu_count() or 1, len(mean_data)))
+    while True:
+        strip_rows = (budget - fixed_bytes(workers)) // max(row_bytes(workers), 1)
+        if strip_rows >= min(height, MIN_STRIP_ROWS) or workers == 1:
+            break
+        workers -= 1
+    strip_rows = max(1, min(strip_rows, height))
+    estimate = fixed_bytes(workers) + strip_rows * row_bytes(workers)
+    return MemoryPlan(budget, estimate, height, strip_rows, workers, accumulator_dtype=accumulator_dtype)
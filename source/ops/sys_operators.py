@@ -7,4 +7,21 @@ def RGB_to_hex(rgb):
     if len(g) < 2: g = f"0{g}"
     if len(b) < 2: b = f"0{b}"
 
-    return f"#{r}{g}{b}"
\ No newline at end of file
+    return f"#{r}{g}{b}"
+
+def pixel_to_RGB(pixel, max_value=255):
+    if not isinstance(pixel, tuple):
+        pixel = (pixel, )
+    if len(pixel) < 3:
+        pixel = pixel[:1] * 3
+
+    return tuple(int(value) * 255 // max_value for value in pixel[:3])
+
+def pixel_to_hex(pixel, max_value=255):
+    # The hex is scaled to 8 bits for display, deeper pixels keep their raw values so distinct colors get distinct labels
+    label = RGB_to_hex(pixel_to_RGB(pixel, max_value))
+    if max_value > 255:
+        if not isinstance(pixel, tuple):
+            pixel = (pixel, )
+        label = f"{label} ({', '.join(str(int(value)) for value in pixel[:3])})"
+    return label
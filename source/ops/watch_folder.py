@@ -0,0 +1,462 @@
+from queue import Queue, Full
+from threading import Thread, Event, Lock
+from time import perf_counter, time_ns
+import json
+import os
+
+from PIL import Image
+
+from source.data.SwitchPreset import SwitchPreset
+from source.ops import FrameSwitchColorOperators as switch_ops
+from source.ops import FrameMeanImageOperator as mean_ops
+from source.ops import alignment, color_index, mean_modes
+from source.ops.color_index import MODES
+from source.ops.instrumentation import Instrumentation
+from source.ops.job_runner import Job, DONE
+from source.ops.packed_output import SEPARATE_FILES
+from source.ops.presets import check_mode
+
+SWITCH = "switch"
+MEAN = "mean"
+ENGINES = [SWITCH, MEAN]
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff")
+# The processed files of a watched folder, kept in the output folder
+INDEX_NAME = "watch_index.json"
+# A file is picked up once it did not change between two scans, or for this many seconds
+SETTLE_SECONDS = 2.0
+# Directories modified this recently are scanned even when their mtime did not change,
+# file systems with coarse timestamps could hide a later change within the same tick
+RACY_SECONDS = 2.0
+
+
+class FolderIndex():
+    """
+    The FolderIndex class finds the new image files of a folder by polling it with os.scandir.
+
+    Files are indexed by size and modification time, so a file is picked up again only when it changes.
+    A file is ready once its size and modification time did not change between two scans (or for
+    SETTLE_SECONDS), so files still being copied are left for a later scan. While no file is settling,
+    the folder is not listed at all as long as its own modification time does not change.
+    Files whose job failed are not recorded as processed: they are retried when they change, or when
+    the service starts again.
+
+    Attributes:
+        folder (str): The watched folder.
+        path (str | None): The JSON file of the processed files, None to keep them in memory only.
+        processed (dict): Path of a processed file mapped to its [size, mtime_ns].
+        claimed (dict): Path of a file handed out by scan and not finished yet mapped to its [size, mtime_ns].
+        settling (dict): Path of a new file which may still be written mapped to its [size, mtime_ns].
+        failed (dict): Path of a file whose job failed in this run mapped to its [size, mtime_ns].
+    """
+    folder: str
+    path: str | None
+    processed: dict
+    claimed: dict
+    settling: dict
+    failed: dict
+
+    def __init__(self, folder: str, path: str | None = None):
+        self.folder = folder
+        self.path = path
+        self.processed = {}
+        self.claimed = {}
+        self.settling = {}
+        self.failed = {}
+        self._directory_mtime = None
+        self._lock = Lock()
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as file:
+                    self.processed = json.load(file)
+            except (OSError, json.JSONDecodeError):
+                self.processed = {}
+
+    def scan(self) -> list[str]:
+        """
+        Lists the folder and claims the files which are ready.
+
+        Returns:
+            list[str]: The ready files, oldest first.
+        """
+        now = time_ns()
+        directory_mtime = os.stat(self.folder).st_mtime_ns
+        if (
+            directory_mtime == self._directory_mtime and not self.settling
+            and now - directory_mtime > RACY_SECONDS * 1e9
+        ):
+            return []
+        self._directory_mtime = directory_mtime
+
+        ready = []
+        settling = {}
+        with self._lock, os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not entry.name.lower().endswith(IMAGE_EXTENSIONS) or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                key = [stat.st_size, stat.st_mtime_ns]
+                if key in (self.processed.get(entry.path), self.claimed.get(entry.path), self.failed.get(entry.path)):
+                    continue
+                if self.settling.get(entry.path) == key or now - stat.st_mtime_ns > SETTLE_SECONDS * 1e9:
+                    self.claimed[entry.path] = key
+                    ready.append((stat.st_mtime_ns, entry.path))
+                else:
+                    settling[entry.path] = key
+        self.settling = settling
+        return [path for _, path in sorted(ready)]
+
+    def finish(self, paths: list[str]) -> None:
+        """
+        Marks claimed files as processed and saves the index.
+        """
+        with self._lock:
+            for path in paths:
+                if path in self.claimed:
+                    self.processed[path] = self.claimed.pop(path)
+        self.save()
+
+    def release(self, paths: list[str]) -> None:
+        """
+        Gives back claimed files which were not processed, so the next scan picks them up again.
+        """
+        with self._lock:
+            for path in paths:
+                self.claimed.pop(path, None)
+        self._directory_mtime = None
+
+    def fail(self, paths: list[str]) -> None:
+        """
+        Gives back claimed files whose job failed, without recording them as processed.
+        """
+        with self._lock:
+            for path in paths:
+                if path in self.claimed:
+                    self.failed[path] = self.claimed.pop(path)
+
+    def save(self) -> None:
+        """
+        Writes the processed files to the JSON file, if any.
+        """
+        if self.path is None:
+            return
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with self._lock:
+            with open(temporary, "w") as file:
+                json.dump(self.processed, file)
+        os.replace(temporary, self.path)
+
+
+class WatchService():
+    """
+    The WatchService class runs color switch or mean image jobs on the files dropped into a folder,
+    without the GUI.
+
+    New files (see FolderIndex) are collected into batches of `batch_size` files, or fewer once the oldest
+    one waited `batch_seconds`. The switch engine applies a preset to every file of a batch, each into its
+    own folder, resuming from its manifest. The mean engine averages the files of a batch into one image.
+    Batches go through a queue of `queue_size` batches to `workers` worker threads. When the queue is full
+    the folder is not scanned until a worker takes a batch, so a burst of files waits on disk, not in memory.
+    Processed files are recorded in the output folder. Failed ones are not: they are retried when they change,
+    or when the service starts again. A failure never stops a worker, its files are reported as failed.
+
+    Throughput (files, batches and megapixels per second, batch latency, backlog) is emitted as JSON lines
+    every `report_seconds` and when the service stops, with the metrics of every job.
+
+    Attributes:
+        folder (str): The watched folder.
+        output (str): The folder of the results and of the index of processed files.
+        engine (str): SWITCH or MEAN.
+        preset (SwitchPreset | None): The preset applied by the switch engine.
+        batch_size (int): The number of files of a full batch.
+        batch_seconds (float): How long the oldest file of a partial batch waits for more files.
+        workers (int): The number of batches processed at once.
+        queue_size (int): The number of batches waiting for a worker.
+        poll_seconds (float): The time between two scans of the folder.
+        report_seconds (float): The time between two throughput reports.
+        resample (bool): Whether the mean engine resamples images to the size of the first one of a batch.
+        align (bool): Whether the mean engine aligns images to the first one of a batch.
+        index (FolderIndex): The new and processed files of the folder.
+        metrics (Instrumentation): The stages and counters of the service.
+    """
+    folder: str
+    output: str
+    engine: str
+    preset: SwitchPreset | None
+    batch_size: int
+    batch_seconds: float
+    workers: int
+    queue_size: int
+    poll_seconds: float
+    report_seconds: float
+    resample: bool
+    align: bool
+    index: FolderIndex
+    metrics: Instrumentation
+
+    def __init__(
+            self, folder: str, output: str, engine: str = SWITCH, preset: SwitchPreset | None = None,
+            batch_size: int = 8, batch_seconds: float = 5.0, workers: int = 2, queue_size: int = 4,
+            poll_seconds: float = 1.0, report_seconds: float = 30.0, resample: bool = False, align: bool = False,
+            sink=None
+        ):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine}, expected one of {ENGINES}")
+        if engine == SWITCH and preset is None:
+            raise ValueError("The switch engine needs a preset")
+        if engine == MEAN and batch_size < 2:
+            raise ValueError("Mean images need batches of at least 2 files")
+        self.folder = folder
+        self.output = output
+        self.engine = engine
+        self.preset = preset
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.workers = workers
+        self.queue_size = queue_size
+        self.poll_seconds = poll_seconds
+        self.report_seconds = report_seconds
+        self.resample = resample
+        self.align = align
+        os.makedirs(output, exist_ok=True)
+        self.index = FolderIndex(folder, os.path.join(output, INDEX_NAME))
+        self.metrics = Instrumentation(f"Watch {folder}", sink=sink)
+        self._queue = Queue(maxsize=queue_size)
+        self._stopping = Event()
+        self._lock = Lock()
+        self._started = None
+        self._latency = 0.0
+        self._busy = 0
+
+    def run(self, once: bool = False) -> dict:
+        """
+        Watches the folder until stop is called. Blocks the calling thread.
+
+        Args:
+            once (bool): Whether to stop once the files already in the folder are processed.
+
+        Returns:
+            dict: The summary of the metrics of the service.
+        """
+        self.metrics.start()
+        self._started = perf_counter()
+        # LazyLoader is not thread-safe before Python 3.12, the modules are loaded before the workers use them
+        for module in (
+                color_index.spatial, color_index.skimage_color, switch_ops.ndimage, alignment.registration,
+                mean_modes.tifffile
+            ):
+            module.__name__
+        threads = [Thread(target=self.work, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        pending = []
+        waiting_since = None
+        last_report = perf_counter()
+        try:
+            while not self._stopping.is_set():
+                with self.metrics.stage("scan"):
+                    ready = self.index.scan()
+                self.count("files seen", len(ready))
+                pending += ready
+                if pending and waiting_since is None:
+                    waiting_since = perf_counter()
+
+                # Full batches are queued at once, a partial one when its oldest file waited long enough
+                while pending and not self._stopping.is_set():
+                    partial = once or perf_counter() - waiting_since >= self.batch_seconds
+                    if len(pending) < self.batch_size and not partial:
+                        break
+                    if self.engine == MEAN and len(pending) < 2:
+                        break
+                    batch, pending = pending[:self.batch_size], pending[self.batch_size:]
+                    if not self.put(batch):
+                        self.index.release(batch)
+                    waiting_since = perf_counter() if pending else None
+
+                if perf_counter() - last_report >= self.report_seconds:
+                    self.report()
+                    last_report = perf_counter()
+                if once and not ready and not self.index.settling:
+                    break
+                self._stopping.wait(self.poll_seconds)
+        finally:
+            if pending:
+                self.count("files left", len(pending))
+                self.index.release(pending)
+            for _ in threads:
+                self._queue.put(None)
+            for thread in threads:
+                thread.join()
+            self.report()
+        return self.metrics.finish("Stopped")
+
+    def stop(self) -> None:
+        """
+        Asks the service to stop. Queued batches are still processed.
+        """
+        self._stopping.set()
+
+    def put(self, batch: list[str]) -> bool:
+        """
+        Queues a batch, waiting while the queue is full. This is the backpressure of the service.
+
+        Returns:
+            bool: Whether the batch was queued, False when the service stopped while waiting.
+        """
+        with self.metrics.stage("backpressure"):
+            while not self._stopping.is_set():
+                try:
+                    self._queue.put((perf_counter(), batch), timeout=self.poll_seconds)
+                    return True
+                except Full:
+                    continue
+        return False
+
+    def work(self) -> None:
+        """
+        Main loop of a worker thread.
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            queued, batch = item
+            with self._lock:
+                self._busy += 1
+            failed = batch
+            try:
+                failed = self.process(batch)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                    self._latency += perf_counter() - queued
+                # Failed files are not recorded as processed, so the next start of the service retries them
+                self.index.fail(failed)
+                self.index.finish([path for path in batch if path not in failed])
+                self.count("batches")
+
+    def process(self, batch: list[str]) -> list[str]:
+        """
+        Runs the jobs of a batch in the calling worker thread.
+
+        Args:
+            batch (list[str]): The files of the batch.
+
+        Returns:
+            list[str]: The files of the jobs which did not finish.
+        """
+        failed = []
+        handled = []
+        try:
+            for job, files in self.jobs(batch):
+                job.run()
+                self.count(f"jobs {job.status.lower()}")
+                self.count("files done" if job.status == DONE else "files failed", len(files))
+                self.count("pixels", job.pixels)
+                self.count("bytes written", job.metrics.counters.get("bytes written", 0))
+                if job.error is not None:
+                    self.metrics.emit({"error": str(job.error), "files": files})
+                if job.status != DONE:
+                    failed.extend(files)
+                handled.extend(files)
+        except Exception as error:
+            # Preparing a job failed, the worker goes on with the next batch
+            rest = [path for path in batch if path not in handled]
+            self.count("files failed", len(rest))
+            self.metrics.emit({"error": f"{type(error).__name__}: {error}", "files": rest})
+            failed.extend(rest)
+        return failed
+
+    def jobs(self, batch: list[str]):
+        """
+        Yields the jobs of a batch with the files they process. Files which cannot be processed are
+        counted as skipped.
+        """
+        headers = {}
+        for file in batch:
+            try:
+                with Image.open(file) as image:
+                    headers[file] = {"weight": 1, "height": image.height, "width": image.width, "mode": image.mode}
+            except (OSError, Image.DecompressionBombError) as error:
+                self.skip([file], f"cannot be read: {error}")
+                continue
+            if headers[file]['mode'] not in MODES:
+                self.skip([file], f"mode {headers.pop(file)['mode']} is not supported")
+
+        if self.engine == SWITCH:
+            yield from self.switch_jobs(headers)
+        else:
+            yield from self.mean_jobs(headers)
+
+    def switch_jobs(self, headers: dict):
+        preset = self.preset
+        for file, header in headers.items():
+            if preset.region is not None and preset.region.size not in (None, (header['width'], header['height'])):
+                self.skip([file], "the region of the preset was made for another resolution")
+                continue
+            try:
+                check_mode(preset.mode, header['mode'])
+            except ValueError as error:
+                self.skip([file], str(error))
+                continue
+            # The extension is kept, so a.png and a.jpg get folders of their own
+            target = os.path.join(self.output, os.path.basename(file))
+            os.makedirs(target, exist_ok=True)
+            args = (
+                file, preset.settings, preset.region, target, True, preset.sampling,
+                preset.output_format or SEPARATE_FILES
+            )
+            job = Job(f"Switch colors: {os.path.basename(file)}", switch_ops.render_images, args, sink=self.metrics.sink)
+            yield job, [file]
+
+    def mean_jobs(self, headers: dict):
+        files = list(headers)
+        if len(files) < 2:
+            self.skip(files, "a mean image needs at least 2 files")
+            return
+        resolutions = {(header['height'], header['width']) for header in headers.values()}
+        if len(resolutions) != 1 and not (self.resample or self.align):
+            self.skip(files, "the files have different resolutions, resample or align them")
+            return
+
+        first = headers[files[0]]
+        shape = mean_ops.mean_mode_of(headers).shape(first['height'], first['width'])
+        name = os.path.basename(files[0])
+        target = os.path.join(self.output, f"mean_{name}")
+        os.makedirs(target, exist_ok=True)
+        args = (headers, shape, target, self.resample, self.align)
+        job = Job(f"Mean image: {name} and {len(files) - 1} more", mean_ops.render_mean_file, args, sink=self.metrics.sink)
+        yield job, files
+
+    def skip(self, files: list[str], reason: str) -> None:
+        self.count("files skipped", len(files))
+        self.metrics.emit({"skipped": files, "reason": reason})
+
+    def count(self, name: str, value: int = 1) -> None:
+        # Counters are shared by the worker threads
+        with self._lock:
+            self.metrics.count(name, value)
+
+    def throughput(self) -> dict:
+        """
+        Returns the throughput of the service since it started.
+        """
+        with self._lock:
+            counters = dict(self.metrics.counters)
+            latency = self._latency
+            busy = self._busy
+        seconds = max(perf_counter() - self._started, 1e-9)
+        batches = counters.get("batches", 0)
+        return {
+            "seconds": seconds,
+            "files_per_second": counters.get("files done", 0) / seconds,
+            "batches_per_second": batches / seconds,
+            "megapixels_per_second": counters.get("pixels", 0) / seconds / 1e6,
+            "mean_batch_latency": latency / batches if batches else None,
+            "queued_batches": self._queue.qsize(),
+            "busy_workers": busy,
+            "settling_files": len(self.index.settling),
+        }
+
+    def report(self) -> None:
+        self.metrics.emit({"throughput": self.throughput()})
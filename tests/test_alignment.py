@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from PIL import Image
+from skimage import data
+
+from source.ops.alignment import estimate_shift
+
+
+def shifted(image: np.ndarray, rows: int, columns: int) -> np.ndarray:
+    """
+    Returns the image moved so that its pixel (y, x) lies at (y + rows, x + columns) of the original.
+    """
+    height, width = image.shape[:2]
+    moving = np.zeros_like(image)
+    moving[max(-rows, 0):height - max(rows, 0), max(-columns, 0):width - max(columns, 0)] = (
+        image[max(rows, 0):height + min(rows, 0), max(columns, 0):width + min(columns, 0)]
+    )
+    return moving
+
+
+@pytest.mark.parametrize("size", [512, 2048, 3000])
+@pytest.mark.parametrize("shift", [(17, 9), (1, 1), (5, -2), (-40, 33)])
+def test_estimate_shift_is_exact_when_decimated(size, shift):
+    # Above ALIGN_SIDE the shift is estimated on images decimated by a step of 4 and 6, then refined
+    reference = np.asarray(Image.fromarray(data.astronaut()).resize((size, size), Image.BILINEAR))
+    assert estimate_shift(reference, shifted(reference, *shift)) == shift
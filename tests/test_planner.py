@@ -0,0 +1,26 @@
+from random import Random
+
+from source.data.SamplingSettings import SamplingSettings
+from source.ops.planner import RANDOM_SAMPLE, plan_combinations, sample_indices, sample_range
+
+
+def test_random_sample_beyond_maxsize():
+    total = 10**25
+    indices = list(sample_indices(total, SamplingSettings(RANDOM_SAMPLE, 50, 7)))
+    assert len(indices) == 50
+    assert indices == sorted(set(indices))
+    assert all(0 <= index < total for index in indices)
+    assert indices == list(sample_indices(total, SamplingSettings(RANDOM_SAMPLE, 50, 7)))
+
+
+def test_random_sample_of_25_colors_with_10_targets():
+    choices = [[((value, value, value), f"#{color:06x}") for value in range(10)] for color in range(25)]
+    planned, combinations = plan_combinations(choices, SamplingSettings(RANDOM_SAMPLE, 5, 1))
+    combinations = list(combinations)
+    assert planned == len(combinations) == 5
+    assert all(len(combination) == 25 for _, combination in combinations)
+
+
+def test_sample_range_limits():
+    assert sample_range(Random(0), 2**64 + 3, 0) == set()
+    assert sample_range(Random(0), 10, 10) == set(range(10))